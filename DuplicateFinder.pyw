@@ -21,7 +21,9 @@ if (__name__ == '__main__'):
     logging.info('Started')
 
     # Loading settings...
-    AppSettings().Load(_MODULE_DIR / 'bin.bin')
+    AppSettings().Load(
+        _MODULE_DIR / 'settings.json',
+        legacy_file=_MODULE_DIR / 'bin.bin')
 
     # Running the application...
     dupFinderWin = DupFinderWin(appDir=_MODULE_DIR)
@@ -0,0 +1,286 @@
+# Copyright (c) 2022, Megacodist
+# All rights reserved.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Finds duplicate files, like those left by retried downloads, without any
+GUI, for example from cron on a headless server. The report is written as
+JSON to the standard output or to a file. With --action, all files of the
+chosen groups but the first one are deleted, moved or replaced with links to
+the first one, and the changes are journaled so moves & hardlinks can be
+undone with --undo.
+
+Exit codes:
+    0   no duplicates found
+    1   duplicates or truncated duplicates found
+    2   invalid arguments or an error occurred
+"""
+
+import argparse
+import json
+import logging
+from pathlib import Path
+import sys
+from typing import TYPE_CHECKING
+
+from actions import (
+    ActionEngine, ActionKind, ActionReport, DescribeReport, PlanActions)
+from fingerprint import HashScheduler, VerifyLevel
+from finder_core import FindDuplicates, FindResult, ResultToDict
+from metrics import LogMetrics, ProfileRun, Span
+
+if TYPE_CHECKING:
+    from fingerprint_cache import FingerprintCache
+
+
+# Definning global variables...
+_MODULE_DIR = Path(__file__).resolve().parent
+
+EXIT_NO_DUPLICATES = 0
+EXIT_DUPLICATES = 1
+EXIT_ERROR = 2
+
+
+def _ParseArgs(argv: list[str] | None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        'roots',
+        nargs='*',
+        type=Path,
+        help='folders to search for duplicates')
+    parser.add_argument(
+        '-r',
+        '--subfolders',
+        action='store_true',
+        help='search subfolders of the roots as well')
+    parser.add_argument(
+        '-l',
+        '--level',
+        choices=[level.value for level in VerifyLevel],
+        default=VerifyLevel.FULL.value,
+        help='how duplicates are verified (default: %(default)s)')
+    parser.add_argument(
+        '-x',
+        '--exclude',
+        action='append',
+        default=[],
+        metavar='PATTERN',
+        help='glob pattern of subfolder names to skip, can be repeated')
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        default=None,
+        help='number of hashing threads')
+    parser.add_argument(
+        '--cache',
+        type=Path,
+        default=None,
+        metavar='FILE',
+        help='fingerprint cache database to reuse between runs')
+    parser.add_argument(
+        '-o',
+        '--output',
+        type=Path,
+        default=None,
+        metavar='FILE',
+        help='write the JSON report to FILE instead of standard output')
+    parser.add_argument(
+        '--html',
+        type=Path,
+        default=None,
+        metavar='FILE',
+        help='also export the report as an HTML page to FILE')
+    parser.add_argument(
+        '--action',
+        choices=[kind.value for kind in ActionKind],
+        default=None,
+        help='what to do with all files of groups but the first one')
+    parser.add_argument(
+        '--choice',
+        choices=['duplicates', 'similars', 'both', 'truncated'],
+        default='duplicates',
+        help='which groups to act on (default: %(default)s)')
+    parser.add_argument(
+        '--move-to',
+        type=Path,
+        default=None,
+        metavar='DIR',
+        help='folder to move files to with --action move')
+    parser.add_argument(
+        '-n',
+        '--dry-run',
+        action='store_true',
+        help='only check the files which would be acted on')
+    parser.add_argument(
+        '--journal-dir',
+        type=Path,
+        default=_MODULE_DIR / 'journal',
+        metavar='DIR',
+        help='folder of journals of changes (default: %(default)s)')
+    parser.add_argument(
+        '--undo',
+        type=Path,
+        default=None,
+        metavar='JOURNAL',
+        help='undo changes of a journal instead of searching')
+    parser.add_argument(
+        '-v',
+        '--verbose',
+        action='store_true',
+        help='log the time & counters of every phase to standard error')
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='write a cProfile & a tracemalloc snapshot of the run to the '
+        + "'profiles' folder")
+    args = parser.parse_args(argv)
+    if args.undo is None and not args.roots:
+        parser.error('at least one root is required')
+    if args.action == ActionKind.MOVE.value and args.move_to is None:
+        parser.error('--move-to is required with --action move')
+    if args.action in (ActionKind.DELETE.value, ActionKind.MOVE.value,) \
+            and args.level != VerifyLevel.FULL.value:
+        # Names alone may match different files & sampled digests may
+        # report files differing between blocks...
+        parser.error(
+            f'--action {args.action} requires --level full')
+    if args.action == ActionKind.DELETE.value and \
+            args.choice in ('similars', 'both',):
+        # Similar files are matched by their names only...
+        parser.error(
+            '--action delete cannot be used with --choice similars or '
+            + 'both, as similar files are not verified')
+    if args.action == ActionKind.LINK.value and (
+            args.choice != 'duplicates'
+            or args.level != VerifyLevel.FULL.value):
+        parser.error(
+            '--action link requires --choice duplicates and --level full')
+    return args
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = _ParseArgs(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(levelname)s: %(message)s')
+    with ProfileRun(_MODULE_DIR / 'profiles', 'cli', args.profile):
+        exitCode = _Run(args)
+    LogMetrics('Finding duplicates')
+    return exitCode
+
+
+def _Run(args: argparse.Namespace) -> int:
+    level = VerifyLevel(args.level)
+
+    if args.undo is not None:
+        return _Undo(args)
+
+    for root in args.roots:
+        if not root.is_dir():
+            logging.error(f"'{root}' is not a folder")
+            return EXIT_ERROR
+
+    cache = None
+    try:
+        if args.cache is not None:
+            # Importing sqlite only when the cache is requested...
+            from fingerprint_cache import FingerprintCache
+            cache = FingerprintCache(args.cache)
+        with HashScheduler(args.workers, cache=cache) as scheduler:
+            result = FindDuplicates(
+                args.roots,
+                subfolders=args.subfolders,
+                level=level,
+                excludes=args.exclude,
+                scheduler=scheduler)
+        actionReport = None
+        if args.action is not None:
+            actionReport = _Act(args, result, cache)
+    except OSError as err:
+        logging.error(f'Finding duplicates failed\n{str(err)}')
+        return EXIT_ERROR
+    finally:
+        if cache is not None:
+            cache.Close()
+
+    report = json.dumps(ResultToDict(result, level), indent=2)
+    if args.output is None:
+        print(report)
+    else:
+        try:
+            args.output.write_text(report, encoding='utf-8')
+        except OSError as err:
+            logging.error(f"Writing '{args.output}' failed\n{str(err)}")
+            return EXIT_ERROR
+
+    if args.html is not None:
+        # Importing jinja2 only when the HTML report is requested...
+        from report import ExportReport, GetTemplate
+        try:
+            with Span('export'):
+                ExportReport(
+                    args.html,
+                    GetTemplate(
+                        _MODULE_DIR / 'res',
+                        'report.html',
+                        _MODULE_DIR / 'cache'),
+                    result.allDuplicates,
+                    result.allSimilars,
+                    result.allTruncated)
+        except OSError as err:
+            logging.error(f"Writing '{args.html}' failed\n{str(err)}")
+            return EXIT_ERROR
+
+    if actionReport is not None and actionReport.nFailed:
+        return EXIT_ERROR
+    if result.allDuplicates or result.allTruncated:
+        return EXIT_DUPLICATES
+    return EXIT_NO_DUPLICATES
+
+
+def _Act(
+        args: argparse.Namespace,
+        result: FindResult,
+        cache: 'FingerprintCache | None'
+        ) -> ActionReport:
+    groups = []
+    if args.choice in ('both', 'duplicates'):
+        groups.extend(result.allDuplicates)
+    if args.choice in ('both', 'similars'):
+        groups.extend(result.allSimilars)
+    if args.choice == 'truncated':
+        groups.extend(result.allTruncated)
+    kind = ActionKind(args.action)
+    engine = ActionEngine(args.journal_dir)
+    with Span('act'):
+        report = engine.Apply(
+            PlanActions(groups, kind, cache=cache),
+            kind,
+            dest_dir=args.move_to,
+            dry_run=args.dry_run)
+    print(
+        f'{"Checked" if args.dry_run else args.action.capitalize()}: '
+        + DescribeReport(report),
+        file=sys.stderr)
+    if report.journal is not None:
+        print(f'Journal: {report.journal}', file=sys.stderr)
+    return report
+
+
+def _Undo(args: argparse.Namespace) -> int:
+    engine = ActionEngine(args.journal_dir)
+    try:
+        report = engine.Undo(args.undo, dry_run=args.dry_run)
+    except (OSError, ValueError) as err:
+        logging.error(f"Undoing '{args.undo}' failed\n{str(err)}")
+        return EXIT_ERROR
+    print(f'Restored: {DescribeReport(report)}', file=sys.stderr)
+    return EXIT_ERROR if report.nFailed else EXIT_NO_DUPLICATES
+
+
+if __name__ == '__main__':
+    sys.exit(main())
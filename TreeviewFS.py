@@ -4,43 +4,80 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
-from collections import namedtuple
-from enum import IntFlag
+from collections import deque
+from fnmatch import fnmatch
 import logging
 from pathlib import Path
-from PIL.ImageTk import PhotoImage
+import sys
+from time import perf_counter
 import tkinter as tk
 from tkinter import ttk
 from tkinter.font import nametofont
+from typing import Iterable
 
-from megacodist.exceptions import LoopBreakException
-from megacodist.collections import SortedList, CollisionPolicy
+from file_table import FileTable
+from fs_scan import ContainsFile, FolderScanner, ScanBatch
+from fs_trie import FSNode
+from metrics import AddSpan, Count, LogMetrics
+from utils import DuplicateIndex, NameDirPair
 
-from utils import NameDirPair
-
-
-_IDRoot = namedtuple(
-    '_IDRoot',
-    'id, root')
 
+class _ScanJob(object):
+    '''Keeps track of a background scan of a folder, and its subfolders
+    if requested.
+    '''
 
-class _Status(IntFlag):
-    TO_DO_NOTHING = 0x00
-    TO_BREAK_ITEM = 0x01
-    TO_BREAK_DIR = 0x02
+    def __init__(
+            self,
+            scanner: FolderScanner,
+            root: FSNode | None,
+            is_new: bool
+            ) -> None:
+        self.scanner = scanner
+        self.root = root
+        self.isNew = is_new
+        self.startTime = perf_counter()
+        # Folder nodes of the scanned folders...
+        self.folders: dict[Path, FSNode] = {}
+        if root is not None:
+            self.folders[scanner.dir] = root
+        # Batches collected from the scanner but not yet inserted...
+        self.batches: deque[ScanBatch] = deque()
 
 
 class TreeviewFS(ttk.Treeview):
     '''Subclasses tkinter.ttk.Treeview to consolidate all file system
     visualization related functionalities into this class.
+
+    The hierarchy is mirrored by an in-memory trie of FSNode objects. All
+    queries are answered from the trie and the widget is only written to.
+
+    In lazy mode, children of a folder are inserted only when it is opened,
+    and large folders are paged by 'page_size' files with a 'load more'
+    item, so the number of items stays about the same for any folder size.
+
+    Folders are scanned in the background. While scans are running, the
+    virtual event <<ScanProgress>> is generated periodically.
     '''
 
+    # The number of file names sent from scanners at once...
+    SCAN_BATCH_SIZE = 1000
+    # The number of threads walking subfolders of a folder...
+    SCAN_WORKERS = 8
+    # The interval of collecting scan results in milliseconds...
+    SCAN_POLL_MS = 50
+    # The maximum time of inserting files into the tree view at once...
+    SCAN_SLICE_S = 0.04
+
     def __init__(
             self,
             master: tk.Misc | None = None,
             *,
-            img_folder: None | PhotoImage = None,
-            img_file: None | PhotoImage = None,
+            img_folder: None | tk.PhotoImage = None,
+            img_file: None | tk.PhotoImage = None,
+            excludes: Iterable[str] = (),
+            lazy: bool = False,
+            page_size: int = 1000,
             **kwargs
             ) -> None:
 
@@ -52,6 +89,23 @@ class TreeviewFS(ttk.Treeview):
         # Setting images...
         self.img_folder = img_folder
         self.img_file = img_file
+        self._scanJobs: list[_ScanJob] = []
+        # The trie mirroring the tree view, the root node is the root item.
+        # Folder nodes & file items are looked up by their item IDs...
+        self._root = FSNode((), '')
+        self._root.isPopulated = True
+        self._root.limit = sys.maxsize
+        self._nodes: dict[str, FSNode] = {'': self._root}
+        self._fileItems: dict[str, tuple[FSNode, str]] = {}
+        self._moreItems: dict[str, FSNode] = {}
+        # Files of the tree view grouped by canonical names...
+        self._dupIndex = DuplicateIndex()
+        # Whether to insert children of folders only when opened, and at
+        # most 'pageSize' files at once...
+        self.lazy = lazy
+        self.pageSize = page_size
+        # Glob patterns of subfolders names not to be scanned...
+        self.excludes = tuple(excludes)
 
         # Getting the font of the tree view...
         self._font = None
@@ -65,6 +119,9 @@ class TreeviewFS(ttk.Treeview):
         self.bind('<Configure>', self._OnWidthChanged)
         # Binding the DELETE key event...
         self.bind('<Delete>', self._OnDeleteKey)
+        # Binding events of populating items...
+        self.bind('<<TreeviewOpen>>', self._OnTreeviewOpen)
+        self.bind('<<TreeviewSelect>>', self._OnSelectionChanged, add='+')
 
         # Treeview column width management----------------
         # Getting the minimum width of the column...
@@ -78,84 +135,260 @@ class TreeviewFS(ttk.Treeview):
                 '#0',
                 width=newWidth)
 
+    def _OnTreeviewOpen(self, event: tk.Event) -> None:
+        node = self._nodes.get(self.focus())
+        if node is not None and not node.isPopulated:
+            self._Populate(node)
+
+    def _OnSelectionChanged(self, event: tk.Event) -> None:
+        # Loading the next page of files if a 'load more' item is chosen...
+        selectedItemID = self.selection()
+        if not (selectedItemID and selectedItemID[0] in self._moreItems):
+            return
+        node = self._moreItems[selectedItemID[0]]
+        firstName = node.files[node.nShown]
+        node.limit += self.pageSize
+        self._ShowFiles(node)
+        fileID = node.fileIids[firstName]
+        self.selection_set(fileID)
+        self.focus(fileID)
+        self.see(fileID)
+
     def _OnDeleteKey(self, event: tk.Event) -> None:
         # Getting selected item...
         selectedItemID = self.selection()
         if not selectedItemID:
             # DELETE pressed, nothing selected
             return
+        selectedItemID = selectedItemID[0]
+        if selectedItemID in self._moreItems:
+            return
 
-        parentID = self.parent(selectedItemID[0])
-        self.delete(selectedItemID)
+        # Removing the item from the trie...
+        if selectedItemID in self._fileItems:
+            parent, name = self._fileItems[selectedItemID]
+            self._DeleteFile(parent, name)
+        else:
+            self._DeleteFolder(self._nodes[selectedItemID])
 
+    def _DeleteFile(self, node: FSNode, name: str) -> None:
+        '''Removes the file from 'node', its item from the tree view and
+        from the duplicate index.
+        '''
+        fileID = node.fileIids.get(name)
+        idx = node.RemoveFile(name)
+        self._dupIndex.Remove(NameDirPair(name, str(node.GetPath())))
+        if fileID is not None:
+            del self._fileItems[fileID]
+            self.delete(fileID)
+        if idx < node.nShown:
+            node.nShown -= 1
+        if node.isPopulated:
+            self._ShowFiles(node)
+        self._MergeIfSingle(node)
+
+    def _DeleteFolder(self, node: FSNode) -> None:
+        '''Removes the folder node, its descendants & their items from
+        the tree view and their files from the duplicate index.
+        '''
+        files: list[NameDirPair] = []
+        node.CollectFiles(str(node.GetPath()), files)
+        for file in files:
+            self._dupIndex.Remove(file)
+        parent = node.parent
+        parent.RemoveFolder(node)
+        if node.iid is not None:
+            self._Forget(node)
+            self.delete(node.iid)
+        self._MergeIfSingle(parent)
+
+    def _MergeIfSingle(self, node: FSNode) -> None:
         # If there is one sibbling folder,
         # merging the parent and the sibbling of deleted item...
-        folders, files = self.GetFoldersFiles(parentID)
-        if len(folders) == 1 and len(files) == 0:
-            # Appending sibbling text to parent...
-            newParentText = str(Path(
-                self.item(parentID, 'text'),
-                self.item(folders[0], 'text')))
+        if node is not self._root and len(node.folders) == 1 \
+                and len(node.files) == 0:
+            self._MergeFolder(node)
+
+    def _MergeFolder(self, node: FSNode) -> None:
+        '''Merges the only folder child of 'node' into it.'''
+        child = node.folders[0]
+        node.RemoveFolder(child)
+        self._nodes.pop(child.iid, None)
+
+        # Items of the child in the tree view...
+        childItems = []
+        if child.iid is None:
+            # Neither is in the tree view if the node is not populated...
+            pass
+        elif child.isPopulated:
+            childItems.extend(folder.iid for folder in child.folders)
+            childItems.extend(
+                child.fileIids[name]
+                for name in child.files[:child.nShown])
+            if child.moreIid is not None:
+                childItems.append(child.moreIid)
+        else:
+            if child.placeholderIid is not None:
+                childItems.append(child.placeholderIid)
+            self.item(node.iid, open=False)
+
+        # Appending child text to the node...
+        node.parts = node.parts + child.parts
+        if node.iid is not None:
+            text_ = node.text
             self.item(
-                parentID,
-                text=newParentText)
-
-            # Detaching the only folder sibbling...
-            self.detach(folders[0])
-
-            # Moving its childern to its parent...
-            for childID in self.get_children(folders[0]):
-                self.move(
-                    item=childID,
-                    parent=parentID,
-                    index='end')
-
-            self.delete(folders[0])
-
-    @classmethod
-    def _CompareFolders(cls, folder: Path) -> str:
-        """Defines the comparer for a SortedList that contains folders."""
-        return folder.root.lower()
+                node.iid,
+                text=text_,
+                values=(self._font.measure(text_),))
+
+        # Moving its childern to the node...
+        for folder in child.folders:
+            node.InsertFolder(folder)
+        node.files = child.files
+        node.fileKeys = child.fileKeys
+        node.fileIids = child.fileIids
+        for name, fileID in node.fileIids.items():
+            self._fileItems[fileID] = (node, name,)
+        if child.iid is None:
+            return
+        node.isPopulated = child.isPopulated
+        node.nShown = child.nShown
+        node.limit = child.limit
+        node.moreIid = child.moreIid
+        if node.moreIid is not None:
+            self._moreItems[node.moreIid] = node
+        node.placeholderIid = child.placeholderIid
+        for childID in childItems:
+            self.move(
+                item=childID,
+                parent=node.iid,
+                index='end')
+
+        self.delete(child.iid)
+
+    def _Forget(self, node: FSNode) -> None:
+        '''Drops 'node' and its descendants from the lookup tables.'''
+        for descendant in node.IterNodes():
+            self._nodes.pop(descendant.iid, None)
+            self._moreItems.pop(descendant.moreIid, None)
+            for fileID in descendant.fileIids.values():
+                self._fileItems.pop(fileID, None)
+
+    def _IsAttached(self, node: FSNode) -> bool:
+        '''Determines whether 'node' has not been deleted.'''
+        return node.GetRoot() is self._root
+
+    def _ShowNode(self, parent: FSNode, node: FSNode, idx: int) -> None:
+        '''Inserts the item of 'node' at 'idx' under the item of 'parent'.
+        In lazy mode, its children are inserted once it is opened.
+        '''
+        text_ = node.text
+        node.iid = self.insert(
+            parent=parent.iid,
+            index=idx,
+            text=text_,
+            open=not self.lazy,
+            image=self.img_folder,
+            values=(self._font.measure(text_),))
+        self._nodes[node.iid] = node
+        if self.lazy:
+            self._UpdatePlaceholder(node)
+        else:
+            self._Populate(node)
 
-    @classmethod
-    def _CompareFiles(cls, file: Path) -> tuple[str, str]:
-        """Defines the comparer for a SortedList that contains files."""
-        return (file.stem.lower(), file.name.lower(),)
+    def _UpdatePlaceholder(self, node: FSNode) -> None:
+        '''Makes the item of the unpopulated 'node' expandable if it has
+        any children.
+        '''
+        if node.placeholderIid is None and (node.folders or node.files):
+            node.placeholderIid = self.insert(
+                parent=node.iid,
+                index='end',
+                text='...')
+
+    def _Populate(self, node: FSNode) -> None:
+        '''Inserts folder children & the first page of file children of
+        'node' in the tree view.
+        '''
+        if node.placeholderIid is not None:
+            self.delete(node.placeholderIid)
+            node.placeholderIid = None
+        node.isPopulated = True
+        node.limit = self.pageSize if self.lazy else sys.maxsize
+        for idx, folder in enumerate(node.folders):
+            self._ShowNode(node, folder, idx)
+        self._ShowFiles(node)
+
+    def _ShowFiles(self, node: FSNode) -> None:
+        '''Inserts hidden files of the populated 'node' up to its limit
+        and updates its 'load more' item.
+        '''
+        end = min(len(node.files), node.limit)
+        for idx in range(node.nShown, end):
+            self._InsertFileItem(node, idx)
+        node.nShown = max(node.nShown, end)
+        self._UpdateMoreItem(node)
+
+    def _InsertFileItem(self, node: FSNode, idx: int) -> None:
+        name = node.files[idx]
+        fileID = self.insert(
+            parent=node.iid,
+            index=len(node.folders) + idx,
+            text=name,
+            image=self.img_file,
+            values=(self._font.measure(name),))
+        node.fileIids[name] = fileID
+        self._fileItems[fileID] = (node, name,)
+
+    def _DeleteFileItem(self, node: FSNode, name: str) -> None:
+        fileID = node.fileIids.pop(name)
+        del self._fileItems[fileID]
+        self.delete(fileID)
+
+    def _UpdateMoreItem(self, node: FSNode) -> None:
+        '''Shows the number of hidden files of the populated 'node' in its
+        'load more' item, or deletes it if all files are shown.
+        '''
+        nHidden = len(node.files) - node.nShown
+        if nHidden > 0:
+            text_ = f'Load {min(nHidden, self.pageSize):,} more of ' \
+                + f'{nHidden:,} files...'
+            if node.moreIid is None:
+                node.moreIid = self.insert(
+                    parent=node.iid,
+                    index='end',
+                    text=text_)
+                self._moreItems[node.moreIid] = node
+            else:
+                self.item(node.moreIid, text=text_)
+        elif node.moreIid is not None:
+            del self._moreItems[node.moreIid]
+            self.delete(node.moreIid)
+            node.moreIid = None
 
     def GetFullPath(
             self,
             id: str
             ) -> str:
-        parts = []
-        while id:
-            text_ = self.item(
-                id,
-                'text')
-            parts.append(text_)
-
-            id = self.parent(id)
-
-        parts.reverse()
-        return str(Path(*parts))
+        if id in self._fileItems:
+            node, name = self._fileItems[id]
+            return str(Path(node.GetPath(), name))
+        if id in self._moreItems:
+            return str(self._moreItems[id].GetPath())
+        return str(self._nodes[id].GetPath())
 
     def GetFoldersFiles(self, iid: str) -> tuple[tuple[str], tuple[str]]:
         '''Returns a pair (2-tuple) which first element is a tuple of all
         folder children and second element is a tuple of all file children
-        of 'iid' item in the tree view.
+        of 'iid' item in the tree view. Only children inserted in the tree
+        view are included.
         '''
-
-        folders = []
-        files = []
-        for child in self.get_children(iid):
-            grandChildren = self.get_children(child)
-            if len(grandChildren) > 0:
-                folders.append(child)
-            else:
-                files.append(child)
-
+        node = self._nodes[iid]
+        if not node.isPopulated:
+            return tuple([tuple(), tuple()])
         return tuple([
-            tuple(folders),
-            tuple(files)
+            tuple(folder.iid for folder in node.folders),
+            tuple(node.fileIids[name] for name in node.files[:node.nShown])
         ])
 
     def AddFolder(
@@ -163,8 +396,10 @@ class TreeviewFS(ttk.Treeview):
         dir: str | Path,
         subfolders: bool = False
     ) -> None:
-        '''Adds a folder to the tree view. If the the folder does not exist
-        of has no files inside, it raises a ValueError.
+        '''Adds a folder to the tree view, and all its subfolders that
+        contain files if 'subfolders' is true. If the the folder does not
+        exist or has no files inside, it raises a ValueError. Subfolders
+        matching 'excludes' of the tree view are skipped.
         '''
 
         # Checking dir parameter & getting dirParts
@@ -178,229 +413,331 @@ class TreeviewFS(ttk.Treeview):
             raise ValueError(f"'{str(dir)}'.\nSuch folder does not exist")
 
         # Checking whether dir contains at least one file...
-        for item in dir.iterdir():
-            if item.is_file():
-                break
-        else:
+        if not (subfolders or ContainsFile(dir)):
             raise ValueError(f"'{str(dir)}' does not contain any file.")
 
-        # Starting algorithm...
-        dirParts = Path(dir).parts
+        # Scanning the folder in the background...
+        self._StartScan(dir, subfolders)
+
+    def _GetFolderNode(self, dir: Path) -> tuple[FSNode, bool]:
+        '''Returns a pair of the folder node of 'dir' and a boolean that
+        specifies whether it has been newly created. Nodes on the way are
+        created or broken up as needed.
+        '''
+        dirParts = dir.parts
         dirPartsIndex = 0
-        status = _Status.TO_DO_NOTHING
-        # The root item id...
-        currItem = ''
-        try:
-            while True:
-                # Getting an ordered list of all folder children of currItem...
-                foldersList = SortedList(
-                    cp=CollisionPolicy.END,
-                    key=TreeviewFS._CompareFolders
-                )
-                for folderID in self.GetFoldersFiles(currItem)[0]:
-                    foldersList.Put(
-                        _IDRoot(
-                            folderID,
-                            Path(
-                                self.item(
-                                    folderID,
-                                    'text'
-                                )
-                            ).parts[0]
-                        )
-                    )
-
-                # Getting index in the current item folder children...
-                index_ = foldersList.index(
-                    _IDRoot(None, dirParts[dirPartsIndex])
-                )
-                if index_[0]:
-                    currItem = foldersList[index_[1]].id
-                    dirPartsIndex += 1
-                else:
-                    index_ = index_[1]
-                    status = _Status.TO_BREAK_DIR
-                    break
-                '''if index_ is None:
-                    index_ = 0
-                    status = _Status.TO_BREAK_DIR
+        node = self._root
+        while True:
+            child = node.FindFolder(dirParts[dirPartsIndex])
+            if child is None:
+                # Inserting the rest of dir as a new folder...
+                return self._InsertFolder(node, dirParts[dirPartsIndex:]), True
+
+            # Comparing the rest of dir with the text of the child...
+            nCommon = 1
+            while (nCommon < len(child.parts)
+                    and dirPartsIndex + nCommon < len(dirParts)
+                    and child.parts[nCommon] == \
+                        dirParts[dirPartsIndex + nCommon]):
+                nCommon += 1
+            dirPartsIndex += nCommon
+
+            if nCommon < len(child.parts):
+                # Breaking up the child...
+                node = self._BreakFolder(child, nCommon)
+                if dirPartsIndex >= len(dirParts):
+                    return node, True
+                return self._InsertFolder(node, dirParts[dirPartsIndex:]), True
+
+            if dirPartsIndex >= len(dirParts):
+                return child, False
+            node = child
+
+    def _InsertFolder(
+            self,
+            parent: FSNode,
+            parts: tuple[str, ...]
+            ) -> FSNode:
+        '''Creates a folder node under 'parent' & its item if the item of
+        'parent' is populated.
+        '''
+        node = FSNode(parts)
+        idx = parent.InsertFolder(node)
+        if parent.isPopulated:
+            self._ShowNode(parent, node, idx)
+        elif parent.iid is not None:
+            self._UpdatePlaceholder(parent)
+        return node
+
+    def _BreakFolder(self, node: FSNode, nParts: int) -> FSNode:
+        '''Breaks up the folder node after its first 'nParts' parts and
+        returns the new node of those parts, which becomes the parent of
+        the rest.
+        '''
+        parent = node.parent
+        newNode = FSNode(node.parts[:nParts])
+        idx = parent.ReplaceFolder(node, newNode)
+        node.parts = node.parts[nParts:]
+        newNode.InsertFolder(node)
+        if node.iid is None:
+            # The node is not in the tree view...
+            return newNode
+
+        # Inserting new item in place of the node with clipped text...
+        text_ = newNode.text
+        newNode.iid = self.insert(
+            parent=parent.iid,
+            index=idx,
+            text=text_,
+            image=self.img_folder,
+            open=True,
+            values=(self._font.measure(text_),))
+        self._nodes[newNode.iid] = newNode
+        newNode.isPopulated = True
+        newNode.limit = self.pageSize if self.lazy else sys.maxsize
+
+        # Moving the node under the new one & adjusting its text...
+        text_ = node.text
+        self.item(
+            node.iid,
+            text=text_,
+            values=(self._font.measure(text_),))
+        self.move(
+            item=node.iid,
+            parent=newNode.iid,
+            index=0)
+        return newNode
+
+    def _StartScan(self, dir: Path, subfolders: bool) -> None:
+        '''Starts scanning 'dir' in the background for files to be added
+        to the tree view.
+        '''
+        for job in self._scanJobs:
+            if job.scanner.dir == dir and not job.scanner.IsCancelled():
+                # The folder is already being scanned...
+                return
+
+        scanner = FolderScanner(
+            dir,
+            subfolders=subfolders,
+            excludes=self.excludes,
+            workers=self.SCAN_WORKERS,
+            batch_size=self.SCAN_BATCH_SIZE)
+        root, isNew = None, False
+        if not subfolders:
+            # Showing the folder item right away...
+            root, isNew = self._GetFolderNode(dir)
+        self._scanJobs.append(_ScanJob(scanner, root, isNew))
+        scanner.Start()
+        if len(self._scanJobs) == 1:
+            self.after(self.SCAN_POLL_MS, self._PollScans)
+        self.event_generate('<<ScanProgress>>')
+
+    def _PollScans(self) -> None:
+        '''Inserts files found by running scans into the tree view in
+        batches and reschedules itself until all scans have finished.
+        '''
+        startTime = perf_counter()
+        for job in list(self._scanJobs):
+            batches, isDone = job.scanner.GetBatches()
+            job.batches.extend(batches)
+            if job.root is not None and not self._IsAttached(job.root):
+                # The item has been deleted in the meantime...
+                job.scanner.Cancel()
+                job.batches.clear()
+            while job.batches:
+                # Not blocking the GUI for more than a time slice...
+                if perf_counter() - startTime > self.SCAN_SLICE_S:
+                    isDone = False
                     break
-                elif isinstance(index_, int):
-                    if index_ < 0:
-                        index_ = -index_
-                        status = _Status.TO_BREAK_DIR
-                        break
-                    else:
-                        currItem = foldersList[index_].id
-                        dirPartsIndex += 1
-                else:
-                    # Oops, something went wrong, logging a warning...
-                    logging.warning(
-                        f"The return value of "
-                        f"'{foldersList.__class__.__name__}.index' method "
-                        f"must be either 'None' or 'int'.")
-                    return'''
-
-                # Checking text of currItem...
-                currItemParts = Path(self.item(
-                    currItem,
-                    'text'
-                )).parts
-                currItemPartsIndex = 1
-
-                while True:
-                    # Checking current item...
-                    try:
-                        if dirParts[dirPartsIndex] == currItemParts[currItemPartsIndex]:
-                            dirPartsIndex += 1
-                            currItemPartsIndex += 1
-                        else:
-                            status = _Status.TO_BREAK_ITEM | _Status.TO_BREAK_DIR
-                            index = 0
-                            raise LoopBreakException()
-                    except IndexError:
-                        # Checking dirParts exhausted...
-                        if dirPartsIndex >= len(dirParts):
-                            # Checking if currItemParts exhausted as well...
-                            if currItemPartsIndex >= len(currItemParts):
-                                # Both parts exhausted
-                                # Not changing the initial value of TO_DO_NOTHING
-                                # of status to indicate updating currItem...
-                                pass
-                            else:
-                                # Only dirParts exhausted
-                                status = _Status.TO_BREAK_ITEM
-                            raise LoopBreakException()
-                        # Checking currItemParts exhausted...
-                        else:
-                            break
-        except LoopBreakException:
-            pass
+                self._InsertFiles(job, job.batches.popleft())
+            if isDone and not job.batches:
+                self._FinishScan(job)
+        AddSpan('scan.insert', perf_counter() - startTime)
+
+        if self._scanJobs:
+            self.after(self.SCAN_POLL_MS, self._PollScans)
+        self.event_generate('<<ScanProgress>>')
+
+    def _InsertFiles(self, job: _ScanJob, batch: ScanBatch) -> None:
+        '''Inserts files of the batch into its folder item, keeping files
+        sorted & after the folders. Folder items of subfolders are created
+        on their first batch, so folders without files are never shown.
+        '''
+        node = job.folders.get(batch.dir)
+        if node is None:
+            node, isNew = self._GetFolderNode(batch.dir)
+            job.folders[batch.dir] = node
+            if batch.dir == job.scanner.dir:
+                job.root, job.isNew = node, isNew
+        elif not self._IsAttached(node):
+            # The item has been deleted in the meantime...
+            return
 
-        # Checking the need to break the current item...
-        if status & _Status.TO_BREAK_ITEM:
-            parentItem = self.parent(currItem)
+        self._AddFiles(node, batch.names)
 
-            # Getting currItem position in parent item...
-            currItemPos = 0
-            for item in self.get_children(parentItem):
-                if currItem == item:
+    def _AddFiles(self, node: FSNode, names: Iterable[str]) -> None:
+        '''Adds files to 'node', the tree view & the duplicate index. Files
+        already in the node are skipped.
+        '''
+        newFiles = node.AddFiles(names)
+        if node.isPopulated and newFiles:
+            nShown = min(len(node.files), node.limit)
+            # Keeping the number of file items constant once the page is
+            # full: files pushed out of it lose their items...
+            for name in node.files[nShown:nShown + len(newFiles)]:
+                if name in node.fileIids:
+                    self._DeleteFileItem(node, name)
+            # Inserting items of new files in order, so the items before
+            # them are in place...
+            for name in newFiles:
+                idx = node.FindFile(name)
+                if idx >= nShown:
                     break
-                else:
-                    currItemPos += 1
-
-            # Inserting new item in place of currItem with clipped text...
-            text_ = str(Path(*currItemParts[:currItemPartsIndex]))
-            newItem = self.insert(
-                parent=parentItem,
-                index=currItemPos,
-                text=text_,
-                image=self.img_folder,
-                open=True,
-                values=(self._font.measure(text_),)
-            )
-
-            # Detaching currItem from tree view & adjusting its text...
-            self.detach(currItem)
-            text_ = str(Path(*currItemParts[currItemPartsIndex:]))
-            self.item(
-                currItem,
-                text=text_,
-                values=(self._font.measure(text_),)
-            )
+                self._InsertFileItem(node, idx)
+            node.nShown = nShown
+
+        dir_ = str(node.GetPath())
+        self._dupIndex.AddMany(
+            NameDirPair(name, dir_)
+            for name in newFiles)
+        if node.isPopulated:
+            self._UpdateMoreItem(node)
+        elif node.iid is not None:
+            self._UpdatePlaceholder(node)
+
+    def _FinishScan(self, job: _ScanJob) -> None:
+        self._scanJobs.remove(job)
+        AddSpan('scan', perf_counter() - job.startTime)
+        Count('scan.files', job.scanner.nFiles)
+        if job.scanner.error is not None:
+            logging.error(
+                f"Adding '{job.scanner.dir}' failed: {job.scanner.error}")
+        elif job.scanner.nFiles == 0 and not job.scanner.IsCancelled():
+            logging.warning(
+                f"'{job.scanner.dir}' does not contain any file.")
+        # Not leaving a newly created folder item without files...
+        root = job.root
+        if job.isNew and self._IsAttached(root) and \
+                not (root.folders or root.files):
+            self._DeleteFolder(root)
+        if not self._scanJobs:
+            LogMetrics('Scanning folders')
+
+    def CancelScans(self) -> None:
+        '''Cancels all running scans. Files found so far are kept.'''
+        for job in self._scanJobs:
+            job.scanner.Cancel()
+
+    def GetScanProgress(self) -> tuple[int, int]:
+        '''Returns a pair of the number of running scans and the number of
+        files they have found so far.
+        '''
+        return (
+            len(self._scanJobs),
+            sum(job.scanner.nFiles for job in self._scanJobs),)
 
-            #
-            self.move(
-                item=currItem,
-                parent=newItem,
-                index=0
-            )
-            currItem = newItem
-
-        # Checking whether only a portion of dir path is needed...
-        if status & _Status.TO_BREAK_DIR:
-            text_ = str(Path(*dirParts[dirPartsIndex:]))
-            currItem = self.insert(
-                parent=currItem,
-                index=index_,
-                text=text_,
-                open=True,
-                image=self.img_folder,
-                values=(self._font.measure(text_),)
-            )
-
-        # Checking whether to retrieve or update the folder content...
-        if status:
-            # The folder item created & its ID is currItem
-            # Getting its content...
-            filesList = SortedList(key=TreeviewFS._CompareFiles)
-            for item in dir.iterdir():
-                if item.is_file():
-                    filesList.add(item)
-            for file in filesList:
-                self.insert(
-                    parent=currItem,
-                    index='end',
-                    text=file.name,
-                    image=self.img_file,
-                    values=(self._font.measure(file.name),)
-                )
-        else:
-            # There is neither TO_BREAK_DIR nor TO_BREAK_ITEM flags
-            # Updating currItem...
-            self._UpdateItem(currItem)
-
-    def _UpdateItem(self, iid: str) -> None:
-        # Getting all current folders & files in the list...
-        folders, files = self.GetFoldersFiles(iid)
-        filesList = SortedList(
-            collision=CollisionPolicy.IGNORE,
-            key=TreeviewFS._CompareFiles)
-        for file in files:
-            filesList.Put(file)
-        # Getting all files of iid in the file system...
-        # Adding them to the TreeViewFS
-        parentFSPath = Path(self.GetFullPath(iid))
-        for item in parentFSPath.iterdir():
-            if item.is_file():
-                idx = filesList.Put(item)
-                if idx:
-                    self.insert(
-                        parent=iid,
-                        index=idx + len(folders),
-                        text=item.name,
-                        image=self.img_file,
-                        values=(self._font.measure(item.name),))
-
-    def GetFileDirList(self) -> list[NameDirPair]:
-        list_ = []
-        self._UpdateFileDirList(
-            '',
-            '',
-            list_
-        )
-        return list_
+    def HasFolder(self, dir: str | Path) -> bool:
+        '''Determines whether 'dir' or any of its subfolders is in the tree
+        view or is being scanned.
+        '''
+        dir = Path(dir)
+        if any(job.scanner.dir == dir for job in self._scanJobs):
+            return True
+        return self._FindFolderNode(dir) is not None
 
-    def _UpdateFileDirList(
+    def SyncPath(
             self,
-            iid: str,
-            path: str,
-            filesList: list[NameDirPair]
+            path: str | Path,
+            subfolders: bool = False,
+            root: str | Path | None = None
             ) -> None:
-
-        folders, files = self.GetFoldersFiles(iid)
-
-        for itemID in files:
-            filesList.append(
-                NameDirPair(
-                    name=self.item(itemID, 'text'),
-                    dir=path
-                )
-            )
-
-        for itemID in folders:
-            self._UpdateFileDirList(
-                itemID,
-                str(Path(path, self.item(itemID, 'text'))),
-                filesList
-            )
+        '''Brings the tree view in line with the current state of 'path' in
+        the file system: an existing file is added, a missing file or folder
+        is removed. Files are added only to folders already in the tree view,
+        unless 'subfolders' is true, in which case new folders are created
+        and existing folders are scanned. If 'root', the watched folder, is
+        provided, paths inside subfolders of it matching 'excludes' are not
+        added, as scans do not add them either.
+        '''
+        path = Path(path)
+        if root is not None and path.exists() and \
+                self._IsExcluded(path, Path(root)):
+            # Not adding what scans have pruned...
+            return
+        if path.is_file():
+            if subfolders or self._FindFolderNode(path.parent, True):
+                node, _ = self._GetFolderNode(path.parent)
+                self._AddFiles(node, (path.name,))
+        elif path.is_dir():
+            if subfolders:
+                self._StartScan(path, True)
+        else:
+            node = self._FindFolderNode(path.parent, True)
+            if node is not None and node.FindFile(path.name) is not None:
+                self._DeleteFile(node, path.name)
+                return
+            node = self._FindFolderNode(path)
+            if node is not None:
+                self._DeleteFolder(node)
+
+    def _IsExcluded(self, path: Path, root: Path) -> bool:
+        '''Determines whether any folder of 'path' below 'root', 'path'
+        itself included if it is a folder, matches a pattern of 'excludes'.
+        '''
+        try:
+            parts = path.relative_to(root).parts
+        except ValueError:
+            return False
+        if not path.is_dir():
+            parts = parts[:-1]
+        return any(
+            fnmatch(part, pattern)
+            for part in parts
+            for pattern in self.excludes)
+
+    def _FindFolderNode(
+            self,
+            dir: Path,
+            exact: bool = False
+            ) -> FSNode | None:
+        '''Returns the topmost folder node whose path is 'dir' or is inside
+        'dir', or None if there is no such node. If 'exact' is true, only
+        the node of 'dir' itself is returned.
+        '''
+        dirParts = dir.parts
+        dirPartsIndex = 0
+        node = self._root
+        while dirPartsIndex < len(dirParts):
+            child = node.FindFolder(dirParts[dirPartsIndex])
+            if child is None:
+                return None
+            nParts = min(
+                len(child.parts),
+                len(dirParts) - dirPartsIndex)
+            if child.parts[:nParts] != \
+                    dirParts[dirPartsIndex:dirPartsIndex + nParts]:
+                return None
+            if exact and nParts < len(child.parts):
+                return None
+            dirPartsIndex += nParts
+            node = child
+        return node if node is not self._root else None
+
+    def GetDuplicateGroups(
+            self
+            ) -> tuple[list[list[NameDirPair]], list[list[NameDirPair]]]:
+        '''Returns the pair of current name-based 'allDuplicates' and
+        'allSimilars' of all files in the tree view. The groups are kept up
+        to date as files are added & removed, so no indexing is needed.
+        '''
+        return (
+            self._dupIndex.GetDuplicates(),
+            self._dupIndex.GetSimilars(),)
+
+    def GetFileDirList(self) -> FileTable:
+        '''Returns the table of all files in the tree view.'''
+        table = FileTable()
+        self._root.CollectTable('', table)
+        table.Compact()
+        return table
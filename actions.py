@@ -0,0 +1,478 @@
+# Copyright (c) 2022, Megacodist
+# All rights reserved.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+__doc__ = """This module offers carrying out choices on duplicates, such as
+deleting or moving all files of groups but the first one. It exposes the
+following types:
+
+ActionKind
+Action(path=XXX, keep=XXX, stat=XXX, keepStat=XXX)
+ActionReport(nDone=XXX, nSkipped=XXX, nFailed=XXX, nBytes=XXX, seconds=XXX,
+    journal=XXX)
+ActionEngine
+"""
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from enum import Enum
+import errno
+import json
+import logging
+import os
+from pathlib import Path
+import shutil
+from threading import Lock
+from time import perf_counter, strftime, time, time_ns
+from typing import Iterable, Mapping, TYPE_CHECKING
+
+from file_table import FileRow
+from fingerprint import FileStat, GetStat
+from utils import FormatSize, GroupFile
+
+try:
+    import fcntl
+except ImportError:
+    # Reflinks are not available on this platform...
+    fcntl = None
+
+if TYPE_CHECKING:
+    from fingerprint_cache import FingerprintCache
+
+
+# The Linux ioctl cloning a file into another, sharing their extents...
+FICLONE = 0x40049409
+# Errors meaning that the file system cannot clone the file...
+_NO_REFLINK_ERRNOS = {
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EINVAL,
+    errno.EXDEV,
+    errno.ENOSYS,
+}
+
+
+class ActionKind(Enum):
+    # Removes the file...
+    DELETE = 'delete'
+    # Moves the file to a folder, keeping its path below that folder...
+    MOVE = 'move'
+    # Replaces the file with a reflink or a hardlink to the kept file, so
+    # its space is reclaimed while its path stays valid. Only for files
+    # with identical content...
+    LINK = 'link'
+
+
+# An action on 'path', a duplicate of 'keep' which must still exist when
+# acting. 'stat' & 'keepStat' are the FileStat of the files when they were
+# found, the action is skipped if either has changed since...
+Action = namedtuple(
+    'Action',
+    'path, keep, stat, keepStat')
+
+ActionReport = namedtuple(
+    'ActionReport',
+    'nDone, nSkipped, nFailed, nBytes, seconds, journal')
+
+
+# Outcomes of actions...
+_DONE = 'done'
+_SKIPPED = 'skipped'
+_FAILED = 'failed'
+
+
+def PlanActions(
+        groups: Iterable[list[GroupFile]],
+        kind: ActionKind,
+        stats: Mapping[str, FileStat] | None = None,
+        cache: 'FingerprintCache | None' = None
+        ) -> list[Action]:
+    '''Returns actions of 'kind' on all files of the groups but the first
+    one, which is kept. The expected attributes of a file are those it had
+    when it was verified: they are taken from the table of a FileRow, from
+    'stats' by path or from 'cache'. Only files to be moved, which can be
+    moved back, fall back to their current attributes; other files without
+    known attributes are left out, as nothing would show that they have
+    changed since. Missing files are left out, and so are files kept by
+    another group, as groups may share files, and files already acted on
+    by an earlier group.
+    '''
+    def GetExpectedStat(file: GroupFile, path: str) -> FileStat | None:
+        if isinstance(file, FileRow) and file.knownStat is not None:
+            return file.knownStat
+        stat = None if stats is None else stats.get(path)
+        if stat is None and cache is not None:
+            stat = cache.GetStat(path)
+        if stat is None and kind is ActionKind.MOVE:
+            try:
+                stat = GetStat(path)
+            except OSError:
+                pass
+        return stat
+
+    groups = list(groups)
+    keeps = {str(Path(group[0].dir, group[0].name)) for group in groups}
+    actions = []
+    seen = set()
+    for group in groups:
+        keep = str(Path(group[0].dir, group[0].name))
+        keepStat = GetExpectedStat(group[0], keep)
+        if keepStat is None:
+            continue
+        for file in group[1:]:
+            path = str(Path(file.dir, file.name))
+            if path in keeps or path in seen:
+                continue
+            stat = GetExpectedStat(file, path)
+            if stat is None:
+                continue
+            seen.add(path)
+            actions.append(Action(path, keep, stat, keepStat))
+    return actions
+
+
+def DescribeReport(report: ActionReport) -> str:
+    '''Returns a one-line summary of the report along with throughput.'''
+    rate = report.nDone / report.seconds if report.seconds else 0.0
+    return (
+        f'{report.nDone:,} files ({FormatSize(report.nBytes)}) in '
+        + f'{report.seconds:.2f} s, {rate:,.0f} files/s; '
+        + f'{report.nSkipped:,} skipped, {report.nFailed:,} failed')
+
+
+class ActionEngine(object):
+    '''Carries out actions on files in parallel. Actions are bucketed by
+    device and every device is worked on by its own pool of 'workers'
+    threads in batches of 'batch_size' actions, so a slow disk does not
+    hold up the others.
+
+    Right before acting, every file is checked again: it is skipped if its
+    size, mtime, device or inode differ from the expected ones, or if the
+    file to be kept no longer exists or has changed as well. Every action
+    is appended to a journal of JSON lines in 'journal_dir' as soon as it
+    is carried out, one new file per run, which can be replayed by Undo.
+    In dry-run mode, files are only checked.
+    '''
+
+    def __init__(
+            self,
+            journal_dir: str | Path,
+            *,
+            workers: int = 4,
+            batch_size: int = 256
+            ) -> None:
+        if workers < 1:
+            raise ValueError("'workers' must be a positive integer")
+        self.journalDir = Path(journal_dir)
+        self.workers = workers
+        self.batchSize = batch_size
+
+    def Apply(
+            self,
+            actions: Iterable[Action],
+            kind: ActionKind,
+            *,
+            dest_dir: str | Path | None = None,
+            dry_run: bool = False
+            ) -> ActionReport:
+        '''Carries out 'kind' on files of 'actions'. Moved files are put in
+        'dest_dir' at their full path without the anchor. It raises OSError
+        if the journal cannot be created.
+        '''
+        if kind is ActionKind.MOVE and dest_dir is None:
+            raise ValueError("'dest_dir' is required to move files")
+        startTime = perf_counter()
+
+        # Bucketing actions by device...
+        buckets: dict[int, list[Action]] = {}
+        for action in actions:
+            buckets.setdefault(action.stat.dev, []).append(action)
+
+        journal = None
+        if not dry_run:
+            self.journalDir.mkdir(parents=True, exist_ok=True)
+            # Naming the journal uniquely, so runs never share one...
+            journal = _Journal(
+                self.journalDir / (
+                    f'{strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-'
+                    + f'{time_ns()}.jsonl'))
+
+        nDone = nSkipped = nFailed = nBytes = 0
+        pools = [
+            ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix=f'Actor{dev}')
+            for dev in buckets]
+        try:
+            futures = [
+                pool.submit(
+                    self._ApplyBatch,
+                    bucket[idx:idx + self.batchSize],
+                    kind,
+                    dest_dir,
+                    journal)
+                for pool, bucket in zip(pools, buckets.values())
+                for idx in range(0, len(bucket), self.batchSize)]
+            for future in as_completed(futures):
+                for action, outcome in future.result():
+                    if outcome == _DONE:
+                        nDone += 1
+                        nBytes += action.stat.size
+                    elif outcome == _SKIPPED:
+                        nSkipped += 1
+                    else:
+                        nFailed += 1
+        finally:
+            for pool in pools:
+                pool.shutdown()
+            if journal is not None:
+                journal.Close()
+
+        report = ActionReport(
+            nDone,
+            nSkipped,
+            nFailed,
+            nBytes,
+            perf_counter() - startTime,
+            None if journal is None else journal.path)
+        logging.info(f'{kind.value} {DescribeReport(report)}')
+        return report
+
+    def _MakeRecord(
+            self,
+            kind: ActionKind,
+            action: Action,
+            details: dict[str, str] | None
+            ) -> str:
+        record = {
+            'op': kind.value,
+            'path': action.path,
+            'keep': action.keep,
+            'size': action.stat.size,
+            'mtime_ns': action.stat.mtime_ns,
+            'time': time(),
+        }
+        if details is not None:
+            record.update(details)
+        return json.dumps(record) + '\n'
+
+    def _ApplyBatch(
+            self,
+            batch: list[Action],
+            kind: ActionKind,
+            dest_dir: str | Path | None,
+            journal: '_Journal | None'
+            ) -> list[tuple[Action, str]]:
+        '''Returns pairs of the action & its outcome. Every action carried
+        out is written to 'journal' right away along with its details, the
+        destination of a moved file or the method of linking. Without a
+        journal, it is a dry run.
+        '''
+        results = []
+        for action in batch:
+            details = None
+            try:
+                if not self._IsUnchanged(action):
+                    results.append((action, _SKIPPED,))
+                    continue
+                if kind is ActionKind.LINK and \
+                        not self._IsLinkable(action):
+                    results.append((action, _SKIPPED,))
+                    continue
+                if kind is ActionKind.MOVE:
+                    dest = self._GetDest(action.path, dest_dir)
+                    details = {'dest': dest}
+                if journal is None:
+                    pass
+                elif kind is ActionKind.DELETE:
+                    os.remove(action.path)
+                elif kind is ActionKind.MOVE:
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    if os.path.lexists(dest):
+                        raise FileExistsError(f"'{dest}' already exists")
+                    shutil.move(action.path, dest)
+                else:
+                    details = {'method': ReplaceWithLink(
+                        action.path,
+                        action.keep)}
+                if journal is not None:
+                    journal.Write(self._MakeRecord(kind, action, details))
+                results.append((action, _DONE,))
+            except OSError as err:
+                logging.error(
+                    f"{kind.value} '{action.path}' failed\n{str(err)}")
+                results.append((action, _FAILED,))
+        return results
+
+    def _IsUnchanged(self, action: Action) -> bool:
+        '''Determines whether both the file and the file to be kept are as
+        expected, so the kept file is still a good copy.
+        '''
+        try:
+            stat = GetStat(action.path)
+        except FileNotFoundError:
+            return False
+        if stat != action.stat:
+            return False
+        try:
+            return GetStat(action.keep) == action.keepStat
+        except OSError:
+            return False
+
+    def _IsLinkable(self, action: Action) -> bool:
+        '''Determines whether the file to be kept is on the same device, has
+        the same size and is not the same file already.
+        '''
+        keepStat = GetStat(action.keep)
+        return keepStat.dev == action.stat.dev and \
+            keepStat.size == action.stat.size and \
+            keepStat.ino != action.stat.ino
+
+    def _GetDest(self, path: str, dest_dir: str | Path) -> str:
+        parts = Path(path).parts
+        return os.path.join(dest_dir, *parts[1:])
+
+    def Undo(
+            self,
+            journal: str | Path,
+            *,
+            dry_run: bool = False
+            ) -> ActionReport:
+        '''Replays the journal backwards, moves moved files back where they
+        were and turns hardlinks back into separate copies. Deleted files
+        cannot be restored and are counted as failed. Files whose original
+        path is taken are skipped, as are reflinks, which are separate
+        files already.
+        '''
+        startTime = perf_counter()
+        with open(journal, 'rt', encoding='utf-8') as journalStream:
+            records = [json.loads(line) for line in journalStream if line]
+
+        nDone = nSkipped = nFailed = nBytes = 0
+        for record in reversed(records):
+            if record['op'] == ActionKind.LINK.value:
+                outcome = self._UndoLink(record, dry_run)
+                if outcome == _DONE:
+                    nDone += 1
+                    nBytes += record['size']
+                elif outcome == _SKIPPED:
+                    nSkipped += 1
+                else:
+                    nFailed += 1
+                continue
+            if record['op'] != ActionKind.MOVE.value:
+                nFailed += 1
+                continue
+            if os.path.lexists(record['path']) or \
+                    not os.path.exists(record['dest']):
+                nSkipped += 1
+                continue
+            try:
+                if not dry_run:
+                    os.makedirs(
+                        os.path.dirname(record['path']),
+                        exist_ok=True)
+                    shutil.move(record['dest'], record['path'])
+                nDone += 1
+                nBytes += record['size']
+            except OSError as err:
+                logging.error(
+                    f"Restoring '{record['path']}' failed\n{str(err)}")
+                nFailed += 1
+
+        return ActionReport(
+            nDone,
+            nSkipped,
+            nFailed,
+            nBytes,
+            perf_counter() - startTime,
+            Path(journal))
+
+    def _UndoLink(self, record: dict, dry_run: bool) -> str:
+        if record.get('method') != 'hardlink':
+            return _SKIPPED
+        try:
+            if not os.path.samefile(record['path'], record['keep']):
+                return _SKIPPED
+            if not dry_run:
+                _ReplaceAtomically(
+                    record['path'],
+                    lambda temp: shutil.copy2(record['keep'], temp))
+            return _DONE
+        except OSError as err:
+            logging.error(
+                f"Restoring '{record['path']}' failed\n{str(err)}")
+            return _FAILED
+
+
+class _Journal(object):
+    '''A journal file of a run, created anew. Records are written & flushed
+    one at a time from any thread, so a crash loses at most the record of
+    the action being carried out. It raises FileExistsError if the file
+    already exists.
+    '''
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._stream = open(path, 'xt', encoding='utf-8')
+        self._lock = Lock()
+
+    def Write(self, record: str) -> None:
+        with self._lock:
+            self._stream.write(record)
+            self._stream.flush()
+
+    def Close(self) -> None:
+        with self._lock:
+            os.fsync(self._stream.fileno())
+            self._stream.close()
+
+
+def _ReplaceAtomically(path: str, make) -> None:
+    '''Makes the new file by calling 'make' with a temporary name in the
+    same folder and renames it over 'path', so 'path' always refers to
+    either the old or the new file.
+    '''
+    dir_, name = os.path.split(path)
+    temp = os.path.join(dir_, f'.{name}.{os.getpid()}.dfw-tmp')
+    try:
+        make(temp)
+        os.replace(temp, path)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+
+
+def _Reflink(src: str, dst: str) -> None:
+    '''Creates 'dst' as a clone of 'src' sharing its extents. It raises
+    OSError if the file system does not support it.
+    '''
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, 'Reflinks are not supported')
+    with open(src, 'rb') as srcStream, open(dst, 'xb') as dstStream:
+        fcntl.ioctl(dstStream.fileno(), FICLONE, srcStream.fileno())
+
+
+def ReplaceWithLink(path: str, keep: str) -> str:
+    '''Atomically replaces 'path' with a reflink of 'keep' if the file
+    system supports it, otherwise with a hardlink to 'keep'. The reflink
+    gets the permissions & times of the replaced file. Returns the method
+    used, either 'reflink' or 'hardlink'.
+    '''
+    def MakeReflink(temp: str) -> None:
+        _Reflink(keep, temp)
+        shutil.copystat(path, temp)
+
+    try:
+        _ReplaceAtomically(path, MakeReflink)
+        return 'reflink'
+    except OSError as err:
+        if err.errno not in _NO_REFLINK_ERRNOS:
+            raise
+    _ReplaceAtomically(path, lambda temp: os.link(keep, temp))
+    return 'hardlink'
@@ -0,0 +1,90 @@
+# Copyright (c) 2022, Megacodist
+# All rights reserved.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Measures the throughput of the verification stage against the number
+of hashing workers on a synthetic corpus. Run it from the root of the
+repository:
+
+    python benchmarks/bench_hashing.py --groups 64 --size-mb 16
+"""
+
+import argparse
+from pathlib import Path
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fingerprint import HashScheduler, VerifyLevel  # noqa: E402
+
+
+def MakeCorpus(
+        dir: Path,
+        n_groups: int,
+        size: int
+        ) -> list[list[Path]]:
+    '''Writes 'n_groups' pairs of identical files of 'size' bytes into
+    'dir' and returns the groups of paths.
+    '''
+    groups = []
+    for groupIdx in range(n_groups):
+        # Every group gets its own content, but the same for all members...
+        block = groupIdx.to_bytes(8, 'little') * (1 << 13)
+        content = (block * (size // len(block) + 1))[:size]
+        paths = [
+            dir / f'file{groupIdx}.bin',
+            dir / f'file{groupIdx} (1).bin']
+        for path in paths:
+            path.write_bytes(content)
+        groups.append(paths)
+    return groups
+
+
+def Measure(
+        groups: list[list[Path]],
+        workers: int,
+        use_processes: bool
+        ) -> float:
+    '''Returns the seconds taken to fully verify all groups.'''
+    with HashScheduler(workers, use_processes=use_processes) as scheduler:
+        startTime = perf_counter()
+        for _ in scheduler.VerifyGroups(groups, VerifyLevel.FULL):
+            pass
+        return perf_counter() - startTime
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--groups', type=int, default=32)
+    parser.add_argument('--size-mb', type=int, default=16)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--processes', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        groups = MakeCorpus(
+            Path(tempDir),
+            args.groups,
+            args.size_mb * (1 << 20))
+        totalMB = 2 * args.groups * args.size_mb
+
+        # Warming up the page cache so all runs read from memory...
+        Measure(groups, 1, False)
+
+        print(f'{"workers":>8}  {"seconds":>8}  {"MB/s":>8}  {"speedup":>8}')
+        baseline = None
+        for workers in args.workers:
+            seconds = Measure(groups, workers, args.processes)
+            if baseline is None:
+                baseline = seconds
+            print(
+                f'{workers:>8}  {seconds:>8.3f}  {totalMB / seconds:>8.1f}'
+                + f'  {baseline / seconds:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
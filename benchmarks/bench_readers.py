@@ -0,0 +1,89 @@
+# Copyright (c) 2022, Megacodist
+# All rights reserved.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Compares the CPU time per GB and the allocations of the fingerprinting
+read path against a naive read()/bytes loop. Run it from the root of the
+repository:
+
+    python benchmarks/bench_readers.py --files 8 --size-mb 64
+"""
+
+import argparse
+import hashlib
+from pathlib import Path
+import sys
+import tempfile
+from time import process_time
+import tracemalloc
+from typing import Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fingerprint import FULL_CHUNK_SIZE, GetFullDigest  # noqa: E402
+
+
+def NaiveDigest(path: Path) -> bytes:
+    hasher = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as fileStream:
+        while True:
+            chunk = fileStream.read(FULL_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.digest()
+
+
+def Measure(
+        func: Callable[[Path], bytes],
+        paths: list[Path]
+        ) -> tuple[float, int]:
+    '''Returns the CPU seconds (measured with tracing off) and the peak
+    of traced memory over all calls.
+    '''
+    startTime = process_time()
+    for path in paths:
+        func(path)
+    seconds = process_time() - startTime
+
+    tracemalloc.start()
+    for path in paths:
+        func(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=8)
+    parser.add_argument('--size-mb', type=int, default=64)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        paths = []
+        block = bytes(range(256)) * (1 << 12)
+        for fileIdx in range(args.files):
+            path = Path(tempDir, f'file{fileIdx}.bin')
+            with open(path, 'wb') as fileStream:
+                for _ in range(args.size_mb):
+                    fileStream.write(block)
+            paths.append(path)
+        totalGB = args.files * args.size_mb / 1024
+
+        # Warming up the page cache so all runs read from memory...
+        for path in paths:
+            NaiveDigest(path)
+
+        print(f'{"reader":>10}  {"CPU s/GB":>9}  {"peak KiB":>9}')
+        for name, func in (('naive', NaiveDigest), ('mmap', GetFullDigest)):
+            seconds, peak = Measure(func, paths)
+            print(
+                f'{name:>10}  {seconds / totalGB:>9.3f}'
+                + f'  {peak / 1024:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
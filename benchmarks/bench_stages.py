@@ -0,0 +1,333 @@
+# Copyright (c) 2022, Megacodist
+# All rights reserved.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Measures the time & peak memory of every stage of finding duplicates on
+synthetic corpora written by corpus.py, and compares them with a saved
+baseline to catch regressions. Run it from the root of the repository:
+
+    python benchmarks/bench_stages.py --files 1000 100000 1000000
+    python benchmarks/bench_stages.py --files 1000 --save-baseline
+
+Peak memory is measured by tracemalloc in a second run of each stage, so
+it counts Python allocations only, not those of Tk. Tree view stages are
+skipped without a display. The first run after writing a corpus reads it
+from disk, so compare warm runs. It exits with 1 if any stage regressed
+beyond the tolerance.
+"""
+
+import argparse
+from collections import namedtuple
+import gc
+import json
+import os
+from pathlib import Path
+import platform
+import sys
+import tempfile
+from time import perf_counter
+import tracemalloc
+from typing import Any, Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from corpus import MakeCorpus  # noqa: E402
+from fingerprint import HashScheduler, VerifyLevel  # noqa: E402
+from finder_core import ScanFolders  # noqa: E402
+from report import ExportReport, GetTemplate, RenderPage  # noqa: E402
+from utils import (  # noqa: E402
+    FindTruncated, GetCommonAffix, IsDuplicatePostfix, ReportDuplicates,
+    SplitExt, VerifyReport)
+
+
+_BENCH_DIR = Path(__file__).resolve().parent
+_RES_DIR = _BENCH_DIR.parent / 'res'
+
+# Differences below these are noise, whatever the tolerance...
+_MIN_SECONDS_DELTA = 0.05
+_MIN_MB_DELTA = 1.0
+
+
+# A stage runs 'func' on the outputs of earlier stages and its output is
+# kept under 'name'. 'cleanup' releases an output, if needed...
+Stage = namedtuple('Stage', 'name, func, cleanup', defaults=(None,))
+
+Measurement = namedtuple('Measurement', 'seconds, peakMB')
+
+
+def _Scan(ctx: dict[str, Any]) -> Any:
+    return ScanFolders([ctx['root']], subfolders=True)
+
+
+def _GroupByName(ctx: dict[str, Any]) -> Any:
+    return ReportDuplicates(ctx['scan'], VerifyLevel.NAME)
+
+
+def _MatchPostfixes(ctx: dict[str, Any]) -> Any:
+    # Comparing stems of neighboring names the way the first versions of
+    # ReportDuplicates did...
+    stems = sorted(SplitExt(file.name)[0] for file in ctx['scan'])
+    nDuplicates = 0
+    for first, next_ in zip(stems, stems[1:]):
+        prefix = GetCommonAffix(first, next_)
+        if IsDuplicatePostfix(next_[prefix.stop:]):
+            nDuplicates += 1
+    return nDuplicates
+
+
+def _Verify(ctx: dict[str, Any]) -> Any:
+    allDuplicates, allSimilars = ctx['group']
+    with HashScheduler() as scheduler:
+        return VerifyReport(
+            allDuplicates,
+            allSimilars,
+            VerifyLevel.FULL,
+            scheduler)
+
+
+def _FindTruncated(ctx: dict[str, Any]) -> Any:
+    with HashScheduler() as scheduler:
+        return FindTruncated(ctx['verify'][1], scheduler=scheduler)
+
+
+def _RenderPage(ctx: dict[str, Any]) -> Any:
+    allDuplicates, _ = ctx['verify']
+    allSimilars, allTruncated = ctx['truncated']
+    template = GetTemplate(_RES_DIR, 'report.html')
+    return len(RenderPage(
+        template,
+        allDuplicates,
+        allSimilars,
+        allTruncated,
+        0,
+        200))
+
+
+def _ExportReport(ctx: dict[str, Any]) -> Any:
+    allDuplicates, _ = ctx['verify']
+    allSimilars, allTruncated = ctx['truncated']
+    template = GetTemplate(_RES_DIR, 'report.html')
+    with tempfile.TemporaryDirectory() as tempDir:
+        file = Path(tempDir, 'report.html')
+        ExportReport(file, template, allDuplicates, allSimilars, allTruncated)
+        return file.stat().st_size
+
+
+def _AddFolder(ctx: dict[str, Any]) -> Any:
+    from TreeviewFS import TreeviewFS
+    tree = TreeviewFS(ctx['tk'], lazy=True)
+    tree.AddFolder(ctx['root'], subfolders=True)
+    while tree.GetScanProgress()[0]:
+        ctx['tk'].update()
+    return tree
+
+
+def _GetFileDirList(ctx: dict[str, Any]) -> Any:
+    return ctx['treeview'].GetFileDirList()
+
+
+STAGES = [
+    Stage('scan', _Scan),
+    Stage('group', _GroupByName),
+    Stage('postfix', _MatchPostfixes),
+    Stage('verify', _Verify),
+    Stage('truncated', _FindTruncated),
+    Stage('render_page', _RenderPage),
+    Stage('export', _ExportReport),
+    Stage('treeview', _AddFolder, lambda tree: tree.destroy()),
+    Stage('file_dir_list', _GetFileDirList),
+]
+
+# Stages which need a display...
+_TK_STAGES = {'treeview', 'file_dir_list'}
+
+
+def Measure(
+        func: Callable[[dict[str, Any]], Any],
+        ctx: dict[str, Any],
+        cleanup: Callable[[Any], None] | None,
+        trace_memory: bool
+        ) -> tuple[Any, Measurement]:
+    '''Runs the stage & returns the pair of its output and measurement.
+    If 'trace_memory' is true, the stage runs a second time under
+    tracemalloc for its peak memory.
+    '''
+    gc.collect()
+    startTime = perf_counter()
+    output = func(ctx)
+    seconds = perf_counter() - startTime
+
+    peakMB = None
+    if trace_memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            traced = func(ctx)
+            peakMB = tracemalloc.get_traced_memory()[1] / (1 << 20)
+        finally:
+            tracemalloc.stop()
+        if cleanup is not None:
+            cleanup(traced)
+        del traced
+    return output, Measurement(seconds, peakMB)
+
+
+def GetCorpus(corpus_dir: Path, n_files: int, seed: int) -> Path:
+    '''Returns the root of the corpus of 'n_files' files in 'corpus_dir',
+    writing it only if it does not exist yet.
+    '''
+    root = corpus_dir / f'corpus-{n_files}-{seed}'
+    marker = corpus_dir / f'corpus-{n_files}-{seed}.json'
+    if not marker.exists():
+        print(f'Writing a corpus of {n_files:,} files...', file=sys.stderr)
+        stats = MakeCorpus(root, n_files, seed=seed)
+        marker.write_text(json.dumps(stats._asdict()), encoding='utf-8')
+    return root
+
+
+def RunAll(
+        root: Path,
+        trace_memory: bool
+        ) -> dict[str, Measurement | None]:
+    '''Runs all stages on the corpus & returns their measurements, None
+    for skipped stages.
+    '''
+    ctx: dict[str, Any] = {'root': root}
+    try:
+        import tkinter as tk
+        ctx['tk'] = tk.Tk()
+        ctx['tk'].withdraw()
+    except Exception as err:
+        print(f'Skipping tree view stages: {err}', file=sys.stderr)
+
+    results = {}
+    try:
+        for stage in STAGES:
+            if stage.name in _TK_STAGES and 'tk' not in ctx:
+                results[stage.name] = None
+                continue
+            ctx[stage.name], results[stage.name] = Measure(
+                stage.func,
+                ctx,
+                stage.cleanup,
+                trace_memory)
+    finally:
+        if 'tk' in ctx:
+            ctx['tk'].destroy()
+    return results
+
+
+def Compare(
+        results: dict[str, Measurement | None],
+        baseline: dict[str, dict[str, float]] | None,
+        tolerance: float
+        ) -> list[str]:
+    '''Prints the results next to the baseline & returns names of stages
+    which regressed.
+    '''
+    regressions = []
+    print(
+        f'{"stage":<14}{"seconds":>10}{"baseline":>10}'
+        + f'{"peak MB":>10}{"baseline":>10}')
+    for name, result in results.items():
+        if result is None:
+            print(f'{name:<14}{"skipped":>10}')
+            continue
+        base = (baseline or {}).get(name)
+        baseSeconds = base['seconds'] if base else None
+        baseMB = base['peak_mb'] if base else None
+        isRegressed = False
+        if baseSeconds is not None and \
+                result.seconds > baseSeconds * (1 + tolerance) and \
+                result.seconds - baseSeconds > _MIN_SECONDS_DELTA:
+            isRegressed = True
+        if baseMB is not None and result.peakMB is not None and \
+                result.peakMB > baseMB * (1 + tolerance) and \
+                result.peakMB - baseMB > _MIN_MB_DELTA:
+            isRegressed = True
+        if isRegressed:
+            regressions.append(name)
+        print(
+            f'{name:<14}{result.seconds:>10.3f}'
+            + f'{_Format(baseSeconds, ".3f"):>10}'
+            + f'{_Format(result.peakMB, ".1f"):>10}'
+            + f'{_Format(baseMB, ".1f"):>10}'
+            + ('  REGRESSED' if isRegressed else ''))
+    return regressions
+
+
+def _Round(value: float | None, digits: int) -> float | None:
+    return None if value is None else round(value, digits)
+
+
+def _Format(value: float | None, spec: str) -> str:
+    return '-' if value is None else format(value, spec)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, nargs='+', default=[1000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--corpus-dir',
+        type=Path,
+        default=Path(tempfile.gettempdir()) / 'odf-bench',
+        help='folder keeping corpora between runs (default: %(default)s)')
+    parser.add_argument(
+        '--baseline',
+        type=Path,
+        default=_BENCH_DIR / 'baseline.json')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--no-memory', action='store_true')
+    args = parser.parse_args()
+
+    baselines = {}
+    if args.baseline.exists():
+        baselines = json.loads(args.baseline.read_text(encoding='utf-8'))
+    allResults = baselines.get('results', {})
+
+    regressions = []
+    for nFiles in args.files:
+        root = GetCorpus(args.corpus_dir, nFiles, args.seed)
+        print(f'\n{nFiles:,} files')
+        results = RunAll(root, not args.no_memory)
+        regressions.extend(
+            f'{name} @ {nFiles:,}'
+            for name in Compare(
+                results,
+                allResults.get(str(nFiles)),
+                args.tolerance))
+        if args.save_baseline:
+            allResults[str(nFiles)] = {
+                name: {
+                    'seconds': round(result.seconds, 4),
+                    'peak_mb': _Round(result.peakMB, 2)}
+                for name, result in results.items()
+                if result is not None}
+
+    if args.save_baseline:
+        baselines = {
+            'machine': {
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'cpus': os.cpu_count(),
+            },
+            'results': allResults,
+        }
+        args.baseline.write_text(
+            json.dumps(baselines, indent=2) + '\n',
+            encoding='utf-8')
+        print(f'\nBaseline saved to {args.baseline}')
+    elif regressions:
+        print(f'\nRegressed: {", ".join(regressions)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
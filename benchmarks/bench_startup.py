@@ -0,0 +1,109 @@
+# Copyright (c) 2022, Megacodist
+# All rights reserved.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Measures the startup time of the application: from spawning a fresh
+interpreter to the first paint of the main window. Every run is a new
+process, so imports are never cached in memory. Run it from the root of
+the repository:
+
+    python benchmarks/bench_startup.py --runs 10
+    python benchmarks/bench_startup.py --cold
+
+'--cold' removes the icon atlas before every run, measuring the first
+launch after res/*.png changed. Saved settings are neither read nor
+written. Without a display, it prints only the import time.
+"""
+
+import argparse
+import os
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+from time import perf_counter
+
+
+_REPO_DIR = Path(__file__).resolve().parent.parent
+_ICONS_CACHE = ('icons.png', 'icons.json',)
+
+# The child prints 'STARTUP imported constructed painted' in seconds since
+# it started running Python code, or 'NODISPLAY imported' on TclError...
+_CHILD = '''
+from time import perf_counter
+startTime = perf_counter()
+import sys
+sys.path.insert(0, sys.argv[1])
+from pathlib import Path
+import tkinter as tk
+from dup_finder_win import DupFinderWin
+imported = perf_counter() - startTime
+try:
+    win = DupFinderWin(appDir=Path(sys.argv[1]))
+except tk.TclError:
+    print('NODISPLAY', imported)
+    sys.exit(0)
+constructed = perf_counter() - startTime
+win.wait_visibility()
+win.update_idletasks()
+painted = perf_counter() - startTime
+print('STARTUP', imported, constructed, painted)
+win.destroy()
+'''
+
+
+def RunOnce(cold: bool) -> tuple[float, list[float], bool]:
+    '''Launches the application once & returns a tuple of the wall time
+    until it exited, the times it reported and whether it had a display.
+    '''
+    if cold:
+        for name in _ICONS_CACHE:
+            (_REPO_DIR / 'cache' / name).unlink(missing_ok=True)
+    startTime = perf_counter()
+    output = subprocess.run(
+        [sys.executable, '-c', _CHILD, str(_REPO_DIR)],
+        capture_output=True,
+        text=True,
+        check=True).stdout
+    wallTime = perf_counter() - startTime
+    for line in output.splitlines():
+        tag, *times = line.split()
+        if tag in ('STARTUP', 'NODISPLAY',):
+            return wallTime, [float(time) for time in times], \
+                tag == 'STARTUP'
+    raise RuntimeError(f'Unexpected output of the child\n{output}')
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--cold', action='store_true')
+    args = parser.parse_args()
+
+    # Warming the page cache & the icon atlas up, unless cold...
+    RunOnce(args.cold)
+    wallTimes = []
+    allTimes = []
+    hasDisplay = True
+    for _ in range(args.runs):
+        wallTime, times, hasDisplay = RunOnce(args.cold)
+        wallTimes.append(wallTime)
+        allTimes.append(times)
+
+    labels = ['import', 'construct', 'first paint']
+    if not hasDisplay:
+        print('No display: skipping the window', file=sys.stderr)
+    print(f'median of {args.runs} runs, {os.cpu_count()} CPUs')
+    for idx, label in enumerate(labels[:len(allTimes[0])]):
+        median = statistics.median(times[idx] for times in allTimes)
+        print(f'{label:<14}{median * 1000:>10.1f} ms')
+    print(f'{"process":<14}{statistics.median(wallTimes) * 1000:>10.1f} ms')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
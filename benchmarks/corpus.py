@@ -0,0 +1,173 @@
+# Copyright (c) 2022, Megacodist
+# All rights reserved.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Writes a synthetic corpus resembling an Opera downloads share: files of
+realistic names & sizes spread over a tree of folders, some downloaded more
+than once as 'name (1).ext', 'name_2.ext' or 'name - copy.ext'. Copies are
+mostly identical, some are truncated like interrupted downloads and some
+have different content. Files are sparse: only a header identifying their
+content is written, so a million files take little space. Run it from the
+root of the repository:
+
+    python benchmarks/corpus.py /tmp/corpus --files 100000
+"""
+
+import argparse
+from collections import namedtuple
+import math
+import os
+from pathlib import Path
+import random
+
+
+# Words making up base names of downloads...
+_WORDS = (
+    'setup', 'report', 'invoice', 'photo', 'IMG', 'video', 'lecture',
+    'python', 'ubuntu', 'driver', 'manual', 'song', 'backup', 'data',
+    'final', 'draft', 'scan', 'thesis', 'slides', 'update', 'archive',
+    'game', 'patch', 'release', 'notes', 'chapter', 'episode', 'movie',)
+# Extensions by how often they are downloaded...
+_EXTS = (
+    ('.pdf', 20), ('.zip', 15), ('.jpg', 15), ('.exe', 10), ('.mp4', 8),
+    ('.docx', 8), ('.png', 8), ('.mp3', 6), ('.iso', 2), ('.tar.gz', 4),
+    ('.txt', 4),)
+# Patterns of names Opera & file managers give to copies...
+_COPY_PATTERNS = (
+    '{stem} ({n}){ext}',
+    '{stem}_{n}{ext}',
+    '{stem} - copy{ext}',
+    '{stem} - ({n}){ext}',)
+
+CorpusStats = namedtuple(
+    'CorpusStats',
+    'nFiles, nDirs, nCopies, nTruncated, nBytes')
+
+
+def _MakeDirs(root: Path, fanout: int, depth: int) -> list[Path]:
+    '''Creates a tree of folders 'depth' levels deep with 'fanout'
+    subfolders each and returns all of them, the root included.
+    '''
+    dirs = [root]
+    level = [root]
+    for depthIdx in range(depth):
+        nextLevel = []
+        for dir_ in level:
+            for idx in range(fanout):
+                subdir = dir_ / f'folder{depthIdx}_{idx}'
+                subdir.mkdir(parents=True, exist_ok=True)
+                nextLevel.append(subdir)
+        dirs.extend(nextLevel)
+        level = nextLevel
+    return dirs
+
+
+def _WriteFile(path: Path, header: bytes, size: int) -> None:
+    '''Writes 'header' at the start of the file and extends it to 'size'
+    bytes without allocating the rest.
+    '''
+    fd = os.open(path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, header[:size])
+        if size > len(header):
+            os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+
+def MakeCorpus(
+        root: str | Path,
+        n_files: int,
+        *,
+        seed: int = 0,
+        copy_ratio: float = 0.2,
+        fanout: int = 8,
+        depth: int = 2,
+        median_size: int = 16 * (1 << 10),
+        max_size: int = 8 * (1 << 20)
+        ) -> CorpusStats:
+    '''Writes about 'n_files' files into 'root'. A 'copy_ratio' fraction of
+    downloads gets one to three copies, 80% identical, 10% truncated & 10%
+    with different content. Sizes follow a log-normal distribution around
+    'median_size' up to 'max_size'. Folders are 'depth' levels of 'fanout'
+    subfolders, and downloads favor a few of them like real shares do. The
+    same 'seed' always writes the same corpus.
+    '''
+    rng = random.Random(seed)
+    root = Path(root)
+    dirs = _MakeDirs(root, fanout, depth)
+    exts = [ext for ext, _ in _EXTS]
+    extWeights = [weight for _, weight in _EXTS]
+    # Favoring a few folders (Zipf-like)...
+    dirWeights = [1 / (idx + 1) for idx in range(len(dirs))]
+    mu = math.log(median_size)
+
+    nFiles = nCopies = nTruncated = nBytes = 0
+    contentIdx = 0
+    while nFiles < n_files:
+        dir_ = rng.choices(dirs, dirWeights)[0]
+        stem = ' '.join(rng.sample(_WORDS, rng.randint(1, 3)))
+        stem = f'{stem} {contentIdx}'
+        ext = rng.choices(exts, extWeights)[0]
+        size = min(max_size, max(1, int(rng.lognormvariate(mu, 1.5))))
+        header = contentIdx.to_bytes(8, 'little') * 8
+        contentIdx += 1
+        _WriteFile(dir_ / f'{stem}{ext}', header, size)
+        nFiles += 1
+        nBytes += size
+        if rng.random() >= copy_ratio:
+            continue
+
+        for n in range(1, rng.randint(1, 3) + 1):
+            if nFiles >= n_files:
+                break
+            pattern = rng.choice(_COPY_PATTERNS)
+            name = pattern.format(stem=stem, n=n, ext=ext)
+            # Copies mostly land in the same folder...
+            copyDir = dir_ if rng.random() < 0.9 else rng.choice(dirs)
+            kind = rng.random()
+            if kind < 0.8:
+                copyHeader, copySize = header, size
+            elif kind < 0.9 and size > 1:
+                copyHeader, copySize = header, rng.randint(1, size - 1)
+                nTruncated += 1
+            else:
+                copyHeader = contentIdx.to_bytes(8, 'little') * 8
+                copySize = size
+                contentIdx += 1
+            _WriteFile(copyDir / name, copyHeader, copySize)
+            nFiles += 1
+            nCopies += 1
+            nBytes += copySize
+    return CorpusStats(nFiles, len(dirs), nCopies, nTruncated, nBytes)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('root', type=Path)
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--copy-ratio', type=float, default=0.2)
+    parser.add_argument('--fanout', type=int, default=8)
+    parser.add_argument('--depth', type=int, default=2)
+    args = parser.parse_args()
+
+    stats = MakeCorpus(
+        args.root,
+        args.files,
+        seed=args.seed,
+        copy_ratio=args.copy_ratio,
+        fanout=args.fanout,
+        depth=args.depth)
+    print(
+        f'{stats.nFiles:,} files in {stats.nDirs:,} folders, '
+        + f'{stats.nCopies:,} copies ({stats.nTruncated:,} truncated), '
+        + f'{stats.nBytes / (1 << 30):.2f} GiB apparent size')
+
+
+if __name__ == '__main__':
+    main()
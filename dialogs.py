@@ -5,15 +5,24 @@
 # LICENSE file in the root directory of this source tree.
 
 from collections import namedtuple
-from jinja2 import FileSystemLoader, Environment
 import logging
 import re
+from threading import Thread
 import tkinter as tk
+from tkinter import filedialog
+from tkinter import messagebox
 from tkinter import ttk
 from tkinterweb import HtmlFrame
 from typing import Any, Iterable
+from urllib.parse import parse_qs
 
-from utils import AppSettings
+from actions import (
+    Action, ActionEngine, ActionKind, DescribeReport, PlanActions)
+from fingerprint import FileStat
+from fingerprint_cache import FingerprintCache
+from metrics import Span
+from report import CountPages, ExportReport, GetTemplate, RenderPage
+from utils import AppSettings, FormatSize, NameDirPair
 
 
 TitlePathPair = namedtuple(
@@ -131,11 +140,20 @@ class LicenseDialog(tk.Toplevel):
 
 
 class ResultDialog(tk.Toplevel):
+    '''Shows the report of duplicates a page of groups at a time, so large
+    reports are shown right away. The full report can be exported to an
+    HTML file.
+    '''
+
     def __init__(
             self,
             template_dir: list[str],
             template_name: str,
-            context: dict[str, Any]
+            context: dict[str, Any],
+            cache_dir: str | None = None,
+            engine: ActionEngine | None = None,
+            fp_cache: FingerprintCache | None = None,
+            stats: dict[str, FileStat] | None = None
             ) -> None:
 
         super().__init__()
@@ -151,6 +169,71 @@ class ResultDialog(tk.Toplevel):
         self._templateDir = template_dir
         self._templateName = template_name
         self._context = context
+        # The engine carrying out choices, and the attributes files had
+        # when they were verified, which are checked before acting. Files
+        # not in 'stats' are looked up in the cache of fingerprints...
+        self._engine = engine
+        self._fpCache = fp_cache
+        self._stats = stats
+        self._applyThread: Thread | None = None
+        self._applyResult = None
+        self._exportThread: Thread | None = None
+        self._exportResult: OSError | None = None
+        with Span('report.template'):
+            self._template = GetTemplate(
+                template_dir,
+                template_name,
+                cache_dir)
+        self._pageSize: int = settings['RD_PAGE_SIZE']
+        self._page = 0
+        self._nPages = CountPages(
+            context['allDuplicates'],
+            context['allSimilars'],
+            context.get('allTruncated', []),
+            self._pageSize)
+
+        # Pages frame -----------------------------------
+        self.frm_pages = ttk.Frame(
+            self)
+        self.frm_pages.pack(
+            side='bottom',
+            fill='x',
+            padx=2,
+            pady=2)
+
+        #
+        self.btn_export = ttk.Button(
+            self.frm_pages,
+            text='Export...',
+            command=self._ExportReport)
+        self.btn_export.pack(
+            side='right',
+            padx=2)
+
+        #
+        self.btn_prevPage = ttk.Button(
+            self.frm_pages,
+            text='< Previous',
+            command=self._ShowPrevPage)
+        self.btn_prevPage.pack(
+            side='left',
+            padx=2)
+
+        #
+        self.lbl_page = ttk.Label(
+            self.frm_pages)
+        self.lbl_page.pack(
+            side='left',
+            padx=2)
+
+        #
+        self.btn_nextPage = ttk.Button(
+            self.frm_pages,
+            text='Next >',
+            command=self._ShowNextPage)
+        self.btn_nextPage.pack(
+            side='left',
+            padx=2)
 
         #
         self.html_report = HtmlFrame(
@@ -174,6 +257,7 @@ class ResultDialog(tk.Toplevel):
             'RD_X': 200,
             'RD_Y': 200,
             'RD_STATE': 'normal',
+            'RD_PAGE_SIZE': 200,
         }
         return AppSettings().Read(defaults)
 
@@ -183,9 +267,147 @@ class ResultDialog(tk.Toplevel):
             data: str,
             method: str
             ) -> None:
+        # Ignoring submits while changes are being applied...
+        if self._applyThread is not None and self._applyThread.is_alive():
+            return
         # Processing user choice...
-        print(url, data, method)
+        fields = parse_qs(data)
+        choice = fields.get('choice', ['none'])[0]
+        if choice == 'none' or self._engine is None:
+            self._Close()
+            return
+        groups = []
+        if choice in ('both', 'duplicates'):
+            groups.extend(self._context['allDuplicates'])
+        if choice in ('both', 'similars'):
+            groups.extend(self._context['allSimilars'])
+        if choice == 'truncated':
+            groups.extend(self._context.get('allTruncated', []))
+        kind = ActionKind(fields.get('action', ['delete'])[0])
+        if kind is ActionKind.LINK and choice != 'duplicates':
+            # Only files with identical content can share their data...
+            messagebox.showerror(
+                title='Error',
+                message='Only duplicates can be replaced with links.',
+                parent=self)
+            return
+        if kind is ActionKind.DELETE and \
+                choice not in ('duplicates', 'truncated',):
+            # Similar files are matched by their names only...
+            messagebox.showerror(
+                title='Error',
+                message=(
+                    'Similar files are not verified to be duplicates, so '
+                    + 'they cannot be deleted.'),
+                parent=self)
+            return
+        dryRun = 'dryrun' in fields
+
+        # Planning actions in a worker thread, as files of the groups may
+        # need to be stat'd...
+        self._applyResult = None
+        self._applyThread = Thread(
+            target=self._PlanWorker,
+            args=(groups, kind,),
+            name='ActionPlanner',
+            daemon=True)
+        self.config(cursor='watch')
+        self._applyThread.start()
+        self.after(100, self._PollPlan, kind, dryRun)
+
+    def _PlanWorker(
+            self,
+            groups: list[list[NameDirPair]],
+            kind: ActionKind
+            ) -> None:
+        try:
+            self._applyResult = PlanActions(
+                groups,
+                kind,
+                self._stats,
+                self._fpCache)
+        except OSError as err:
+            logging.error(f'Planning changes failed\n{str(err)}')
+            self._applyResult = err
+
+    def _PollPlan(self, kind: ActionKind, dry_run: bool) -> None:
+        if self._applyThread.is_alive():
+            self.after(100, self._PollPlan, kind, dry_run)
+            return
+        self._applyThread = None
+        self.config(cursor='')
+        if isinstance(self._applyResult, Exception):
+            messagebox.showerror(
+                title='Error',
+                message=str(self._applyResult),
+                parent=self)
+            return
+        actions = self._applyResult
+        if not dry_run:
+            # Sizes are those files had when they were verified...
+            nBytes = sum(action.stat.size for action in actions)
+            if not messagebox.askyesno(
+                    title='Confirm',
+                    message=(
+                        f'{kind.value.capitalize()} {len(actions):,} files '
+                        + f'({FormatSize(nBytes)})?'),
+                    parent=self):
+                return
+        destDir = None
+        if kind is ActionKind.MOVE:
+            destDir = filedialog.askdirectory(
+                parent=self,
+                title='Browse for a folder to move files to')
+            if not destDir:
+                return
+
+        # Carrying out the choice in a worker thread...
+        self._applyResult = None
+        self._applyThread = Thread(
+            target=self._ApplyWorker,
+            args=(actions, kind, destDir, dry_run,),
+            name='ActionEngine',
+            daemon=True)
+        self.config(cursor='watch')
+        self._applyThread.start()
+        self.after(100, self._PollApply)
+
+    def _ApplyWorker(
+            self,
+            actions: list[Action],
+            kind: ActionKind,
+            dest_dir: str | None,
+            dry_run: bool
+            ) -> None:
+        try:
+            self._applyResult = self._engine.Apply(
+                actions,
+                kind,
+                dest_dir=dest_dir,
+                dry_run=dry_run)
+        except OSError as err:
+            logging.error(f'Applying changes failed\n{str(err)}')
+            self._applyResult = err
+
+    def _PollApply(self) -> None:
+        if self._applyThread.is_alive():
+            self.after(100, self._PollApply)
+            return
+        self._applyThread = None
+        self.config(cursor='')
+        if isinstance(self._applyResult, Exception):
+            messagebox.showerror(
+                title='Error',
+                message=str(self._applyResult),
+                parent=self)
+            return
+        messagebox.showinfo(
+            title='Done',
+            message=DescribeReport(self._applyResult),
+            parent=self)
+        self._Close()
 
+    def _Close(self) -> None:
         # Updating application settings of Result Dialog (RD)...
         settings = {}
         # Getting the geometry of the Result Dialog (RD)...
@@ -213,12 +435,80 @@ class ResultDialog(tk.Toplevel):
 
         self.destroy()
 
+    def _ShowPrevPage(self) -> None:
+        if self._page > 0:
+            self._page -= 1
+            self._RenderResult()
+
+    def _ShowNextPage(self) -> None:
+        if self._page < self._nPages - 1:
+            self._page += 1
+            self._RenderResult()
+
     def _RenderResult(self) -> None:
-        fsLoader = FileSystemLoader(searchpath=self._templateDir)
-        env = Environment(loader=fsLoader)
-        tmplt = env.get_template(name=self._templateName)
-        result_ = tmplt.render(**self._context)
-
-        self.html_report.load_html(
-            html_source=result_,
-            base_url=self._templateDir)
+        '''Renders & shows the current page of the report.'''
+        with Span('report.render'):
+            result_ = RenderPage(
+                self._template,
+                self._context['allDuplicates'],
+                self._context['allSimilars'],
+                self._context.get('allTruncated', []),
+                self._page,
+                self._pageSize)
+        with Span('report.load_html'):
+            self.html_report.load_html(
+                html_source=result_,
+                base_url=self._templateDir)
+
+        # Updating page controls...
+        self.lbl_page['text'] = f'Page {self._page + 1} of {self._nPages}'
+        self.btn_prevPage['state'] = (
+            tk.NORMAL if self._page > 0 else tk.DISABLED)
+        self.btn_nextPage['state'] = (
+            tk.NORMAL if self._page < self._nPages - 1 else tk.DISABLED)
+
+    def _ExportReport(self) -> None:
+        file = filedialog.asksaveasfilename(
+            parent=self,
+            title='Export the report',
+            defaultextension='.html',
+            filetypes=[('HTML files', '*.html'), ('All files', '*.*')])
+        if not file:
+            return
+
+        # Exporting in a worker thread, as large reports take a while...
+        self._exportResult = None
+        self._exportThread = Thread(
+            target=self._ExportWorker,
+            args=(file,),
+            name='ReportExporter',
+            daemon=True)
+        self.btn_export['state'] = tk.DISABLED
+        self.config(cursor='watch')
+        self._exportThread.start()
+        self.after(100, self._PollExport)
+
+    def _ExportWorker(self, file: str) -> None:
+        try:
+            ExportReport(
+                file,
+                self._template,
+                self._context['allDuplicates'],
+                self._context['allSimilars'],
+                self._context.get('allTruncated', []))
+        except OSError as err:
+            logging.error(f"Exporting the report failed\n{str(err)}")
+            self._exportResult = err
+
+    def _PollExport(self) -> None:
+        if self._exportThread.is_alive():
+            self.after(100, self._PollExport)
+            return
+        self._exportThread = None
+        self.btn_export['state'] = tk.NORMAL
+        self.config(cursor='')
+        if self._exportResult is not None:
+            messagebox.showerror(
+                title='Error',
+                message=str(self._exportResult),
+                parent=self)
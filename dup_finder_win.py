@@ -7,23 +7,31 @@
 import logging
 from pathlib import Path
 import re
+from threading import Thread
 from tkinter import filedialog
 from tkinter import messagebox
 import tkinter as tk
 from tkinter import ttk
-from typing import Any
-
-import PIL.Image
-import PIL.ImageTk
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
-
-from dialogs import TitlePathPair, LicenseDialog, ResultDialog
-from utils import ReportDuplicates, AppSettings
+from typing import Any, TYPE_CHECKING
+
+from actions import ActionEngine
+from fingerprint import HashScheduler
+from fingerprint_cache import FingerprintCache
+from icons import LoadIcons
+from metrics import LogMetrics, ProfileRun, Span
+from utils import NameDirPair, FindTruncated, VerifyReport, AppSettings
 from TreeviewFS import TreeviewFS
 
+# Modules importing watchdog, tkinterweb & jinja2 are imported when their
+# features are first used, so the window shows up sooner...
+if TYPE_CHECKING:
+    from fs_watch import FolderWatcher
+
 
 class DupFinderWin(tk.Tk):
+    # The interval of applying file system changes in milliseconds...
+    WATCH_POLL_MS = 250
+
     def __init__(
             self,
             appDir: Path,
@@ -33,6 +41,14 @@ class DupFinderWin(tk.Tk):
         # Reading Duplicate Finder Window (DFW) settings...
         settings = self._ReadSettings()
         self._lastDir = settings['DFW_LAST_DIR']
+        self._excludes = settings['DFW_EXCLUDES']
+        self._lazyTree = settings['DFW_LAZY_TREE']
+        self._treePageSize = settings['DFW_TREE_PAGE_SIZE']
+        # Writing a profile of every search into the 'profiles' folder...
+        self._profile = settings['DFW_PROFILE']
+        self._nativeReport = tk.BooleanVar(
+            self,
+            value=settings['DFW_NATIVE_REPORT'])
         self.geometry(
             f"{settings['DFW_WIDTH']}x{settings['DFW_HEIGHT']}"
             + f"+{settings['DFW_X']}+{settings['DFW_Y']}")
@@ -47,8 +63,17 @@ class DupFinderWin(tk.Tk):
         self._appDir = appDir
         self._dirs: list[str] = []
         self._columnMinWidth: int = 300 - 25
-        self._fsHandler = None
-        self._observers: list[Observer] = []
+        # Watchers of added folders keeping the tree view up to date...
+        self._watchers: list['FolderWatcher'] = []
+        self._fpCache = FingerprintCache(appDir / 'fingerprints.db')
+        self._hashScheduler = HashScheduler(
+            workers=settings['DFW_HASH_WORKERS'],
+            cache=self._fpCache)
+        self._actionEngine = ActionEngine(
+            appDir / 'journal',
+            workers=settings['DFW_ACTION_WORKERS'])
+        self._findThread: Thread | None = None
+        self._findResult = None
 
         # Defining of resources...
         self.img_browse = None
@@ -65,9 +90,14 @@ class DupFinderWin(tk.Tk):
         self.btn_browse = None
         self.btn_duplicate = None
         self.btn_license = None
+        self.chkbtn_nativeReport = None
         self.vscrlbr_files = None
         self.hscrlbr_files = None
         self.trvw_files = None
+        self.frm_scan = None
+        self.lbl_scan = None
+        self.prgrsbr_scan = None
+        self.btn_cancelScan = None
 
         self._LoadResources()
         self._InitializeGUI()
@@ -76,47 +106,33 @@ class DupFinderWin(tk.Tk):
         # self.wait_visibility()
         self.trvw_files.bind(
             '<<TreeviewSelect>>',
-            self._OnItemSelectionChanged)
+            self._OnItemSelectionChanged,
+            add='+')
         self.txt_fsPath.bind(
             '<Button-1>',
             self._OnPathClicked
         )
+        self.trvw_files.bind(
+            '<<ScanProgress>>',
+            self._OnScanProgress)
         self.protocol('WM_DELETE_WINDOW', self._OnClosing)
+        self.after(self.WATCH_POLL_MS, self._ApplyFSChanges)
 
     def _LoadResources(self) -> None:
         '''Loads resources using the the GUI.'''
 
-        # Loading images...
-        # Loading 'browse.png'...
-        self.img_browse = self._appDir / 'res/browse.png'
-        self.img_browse = PIL.Image.open(self.img_browse)
-        self.img_browse = self.img_browse.resize(size=(24, 24,))
-        self.img_browse = PIL.ImageTk.PhotoImage(image=self.img_browse)
-        # Loading 'folder.png'...
-        self.img_folder = self._appDir / 'res/folder.png'
-        self.img_folder = PIL.Image.open(self.img_folder)
-        self.img_folder = self.img_folder.resize(size=(24, 24,))
-        self.img_folder = PIL.ImageTk.PhotoImage(image=self.img_folder)
-        # Loading 'file.png'...
-        self.img_file = self._appDir / 'res/file.png'
-        self.img_file = PIL.Image.open(self.img_file)
-        self.img_file = self.img_file.resize(size=(24, 24,))
-        self.img_file = PIL.ImageTk.PhotoImage(image=self.img_file)
-        # Loading 'unknown.png'...
-        self.img_unknown = self._appDir / 'res/unknown.png'
-        self.img_unknown = PIL.Image.open(self.img_unknown)
-        self.img_unknown = self.img_unknown.resize(size=(24, 24,))
-        self.img_unknown = PIL.ImageTk.PhotoImage(image=self.img_unknown)
-        # Loading 'duplicate.png'...
-        self.img_duplicate = self._appDir / 'res/duplicate.png'
-        self.img_duplicate = PIL.Image.open(self.img_duplicate)
-        self.img_duplicate = self.img_duplicate.resize(size=(24, 24,))
-        self.img_duplicate = PIL.ImageTk.PhotoImage(image=self.img_duplicate)
-        # Loading 'license.png'...
-        self.img_license = self._appDir / 'res/license.png'
-        self.img_license = PIL.Image.open(self.img_license)
-        self.img_license = self.img_license.resize(size=(24, 24,))
-        self.img_license = PIL.ImageTk.PhotoImage(image=self.img_license)
+        # Loading images from the icon atlas...
+        icons = LoadIcons(
+            self,
+            self._appDir / 'res',
+            self._appDir / 'cache',
+            ('browse', 'folder', 'file', 'unknown', 'duplicate', 'license',))
+        self.img_browse = icons['browse']
+        self.img_folder = icons['folder']
+        self.img_file = icons['file']
+        self.img_unknown = icons['unknown']
+        self.img_duplicate = icons['duplicate']
+        self.img_license = icons['license']
 
     def _InitializeGUI(self) -> None:
         '''Initializes the GUI of this window with Tcl/Tk widgets.'''
@@ -161,6 +177,16 @@ class DupFinderWin(tk.Tk):
             side=tk.LEFT
         )
 
+        # Choosing between the HTML report & the native result view...
+        self.chkbtn_nativeReport = ttk.Checkbutton(
+            master=self.frm_toolbar,
+            text='Native report',
+            variable=self._nativeReport
+        )
+        self.chkbtn_nativeReport.pack(
+            side=tk.RIGHT
+        )
+
         # File system path frame --------------------------------
         self.frm_fsPath = ttk.Frame(
             self
@@ -181,6 +207,45 @@ class DupFinderWin(tk.Tk):
             fill='x'
         )
 
+        # Scan progress frame -----------------------------------
+        # It is shown only while folders are being scanned...
+        self.frm_scan = ttk.Frame(
+            self
+        )
+
+        #
+        self.btn_cancelScan = ttk.Button(
+            self.frm_scan,
+            text='Cancel',
+            command=self._CancelScans
+        )
+        self.btn_cancelScan.pack(
+            side='right',
+            padx=2
+        )
+
+        #
+        self.prgrsbr_scan = ttk.Progressbar(
+            self.frm_scan,
+            mode='indeterminate',
+            length=120
+        )
+        self.prgrsbr_scan.pack(
+            side='right',
+            padx=2
+        )
+
+        #
+        self.lbl_scan = ttk.Label(
+            self.frm_scan
+        )
+        self.lbl_scan.pack(
+            side='left',
+            fill='x',
+            expand=1,
+            padx=2
+        )
+
         # Folders & files frame -----------------------------------
         self.frm_files = ttk.Frame(
             self
@@ -205,6 +270,9 @@ class DupFinderWin(tk.Tk):
             self.frm_files,
             img_folder=self.img_folder,
             img_file=self.img_file,
+            excludes=self._excludes,
+            lazy=self._lazyTree,
+            page_size=self._treePageSize,
             show='tree headings',
             selectmode='browse',
             xscrollcommand=self.hscrlbr_files.set,
@@ -264,6 +332,7 @@ class DupFinderWin(tk.Tk):
                 folder,
                 subfolders=subfolders
             )
+            self._WatchFolder(folder, subfolders)
             '''except Exception as err:
                 if len(err.args):
                     msg = '\n'.join(err.args)
@@ -272,6 +341,61 @@ class DupFinderWin(tk.Tk):
                     message=msg
                 )'''
 
+    def _WatchFolder(self, folder: str, subfolders: bool) -> None:
+        for watcher in self._watchers:
+            if watcher.dir == Path(folder) and \
+                    watcher.subfolders >= subfolders:
+                # The folder is already being watched...
+                return
+        from fs_watch import FolderWatcher
+        watcher = FolderWatcher(folder, subfolders=subfolders)
+        try:
+            watcher.Start()
+        except OSError as err:
+            logging.error(f"Watching '{folder}' failed\n{str(err)}")
+            return
+        self._watchers.append(watcher)
+
+    def _ApplyFSChanges(self) -> None:
+        '''Applies changes of watched folders to the tree view, and so to
+        the live duplicate index, and reschedules itself.
+        '''
+        for watcher in list(self._watchers):
+            if not self.trvw_files.HasFolder(watcher.dir):
+                # The folder has been removed from the tree view...
+                watcher.Stop()
+                self._watchers.remove(watcher)
+                continue
+            for path in watcher.GetChanges():
+                try:
+                    self.trvw_files.SyncPath(
+                        path,
+                        watcher.subfolders,
+                        watcher.dir)
+                except OSError as err:
+                    logging.error(
+                        f"Applying changes of '{path}' failed\n{str(err)}")
+        self.after(self.WATCH_POLL_MS, self._ApplyFSChanges)
+
+    def _OnScanProgress(self, event: tk.Event) -> None:
+        nScans, nFiles = self.trvw_files.GetScanProgress()
+        if nScans:
+            if not self.frm_scan.winfo_ismapped():
+                self.frm_scan.pack(
+                    side='bottom',
+                    fill='x',
+                    before=self.frm_fsPath
+                )
+                self.prgrsbr_scan.start()
+            self.lbl_scan['text'] = (
+                f'Scanning {nScans} folder(s): {nFiles:,} files found')
+        elif self.frm_scan.winfo_ismapped():
+            self.prgrsbr_scan.stop()
+            self.frm_scan.pack_forget()
+
+    def _CancelScans(self) -> None:
+        self.trvw_files.CancelScans()
+
     def _OnItemSelectionChanged(self, event: tk.Event):
         # Checking selected item...
         selectedItemID = self.trvw_files.selection()
@@ -304,6 +428,17 @@ class DupFinderWin(tk.Tk):
             'DFW_Y': 200,
             'DFW_LAST_DIR': None,
             'DFW_STATE': 'normal',
+            'DFW_HASH_WORKERS': 4,
+            'DFW_ACTION_WORKERS': 8,
+            'DFW_EXCLUDES': [
+                '$RECYCLE.BIN',
+                'System Volume Information',
+                '.git',
+            ],
+            'DFW_LAZY_TREE': True,
+            'DFW_TREE_PAGE_SIZE': 1000,
+            'DFW_NATIVE_REPORT': False,
+            'DFW_PROFILE': False,
         }
         return AppSettings().Read(defaults)
 
@@ -338,11 +473,18 @@ class DupFinderWin(tk.Tk):
         # Getting other Duplicate Finder Window (DFW) settings...
         settings['DFW_LAST_DIR'] = self._lastDir
         settings['DFW_STATE'] = self.state()
+        settings['DFW_NATIVE_REPORT'] = self._nativeReport.get()
 
         AppSettings().Update(settings)
+        self.trvw_files.CancelScans()
+        for watcher in self._watchers:
+            watcher.Stop()
+        self._hashScheduler.Close()
+        self._fpCache.Close()
         self.destroy()
 
     def _ShowLicense(self) -> None:
+        from dialogs import TitlePathPair, LicenseDialog
         titlePathPairs = []
         titlePathPairs.append(
             TitlePathPair(
@@ -361,16 +503,99 @@ class DupFinderWin(tk.Tk):
         lcnsDlg.mainloop()
 
     def _FindDuplicates(self) -> None:
-        filesList = self.trvw_files.GetFileDirList()
-        allDuplicates, allSimilars = ReportDuplicates(filesList)
+        if self._findThread is not None:
+            # A search is already in progress...
+            return
+
+        # Reading the current groups of the live index & verifying them in
+        # a worker thread not to block the GUI...
+        with Span('group'):
+            allDuplicates, allSimilars = \
+                self.trvw_files.GetDuplicateGroups()
+        self._findResult = None
+        self._findThread = Thread(
+            target=self._FindDuplicatesWorker,
+            args=(allDuplicates, allSimilars,),
+            name='DuplicateFinder',
+            daemon=True)
+        self.btn_duplicate['state'] = tk.DISABLED
+        self.config(cursor='watch')
+        self._findThread.start()
+        self.after(100, self._PollFindDuplicates)
+
+    def _FindDuplicatesWorker(
+            self,
+            allDuplicates: list[list[NameDirPair]],
+            allSimilars: list[list[NameDirPair]]
+            ) -> None:
+        try:
+            with ProfileRun(
+                    self._appDir / 'profiles',
+                    'find',
+                    self._profile):
+                # Keeping the attributes files had when they were verified
+                # to check them before acting...
+                stats = {}
+                with Span('verify'):
+                    allDuplicates, allSimilars = VerifyReport(
+                        allDuplicates,
+                        allSimilars,
+                        scheduler=self._hashScheduler,
+                        stats=stats)
+                with Span('truncated'):
+                    allSimilars, allTruncated = FindTruncated(
+                        allSimilars,
+                        scheduler=self._hashScheduler,
+                        stats=stats)
+            self._findResult = (
+                allDuplicates,
+                allSimilars,
+                allTruncated,
+                stats,)
+        except Exception as err:
+            logging.error(f'Finding duplicates failed\n{str(err)}')
+            self._findResult = err
+
+    def _PollFindDuplicates(self) -> None:
+        if self._findThread.is_alive():
+            self.after(100, self._PollFindDuplicates)
+            return
+
+        self._findThread = None
+        self.btn_duplicate['state'] = tk.NORMAL
+        self.config(cursor='')
+        if isinstance(self._findResult, Exception):
+            LogMetrics('Find duplicates')
+            messagebox.showerror(
+                title='Error',
+                message=str(self._findResult))
+            return
+
+        allDuplicates, allSimilars, allTruncated, stats = self._findResult
+        if self._nativeReport.get():
+            # The native view stays responsive with very large results...
+            from result_view import ResultView
+            with Span('report'):
+                ResultView(allDuplicates, allSimilars, allTruncated)
+            LogMetrics('Find duplicates')
+            return
+
         context = {
             'allDuplicates': allDuplicates,
-            'allSimilars': allSimilars
+            'allSimilars': allSimilars,
+            'allTruncated': allTruncated
         }
 
-        resultDlg = ResultDialog(
-            template_dir=str(self._appDir / 'res'),
-            template_name='report.html',
-            context=context
-        )
+        from dialogs import ResultDialog
+        with Span('report'):
+            resultDlg = ResultDialog(
+                template_dir=str(self._appDir / 'res'),
+                template_name='report.html',
+                context=context,
+                cache_dir=str(self._appDir / 'cache'),
+                engine=self._actionEngine,
+                fp_cache=self._fpCache,
+                stats=stats
+            )
+        LogMetrics('Find duplicates')
         resultDlg.mainloop()
@@ -0,0 +1,231 @@
+# Copyright (c) 2022, Megacodist
+# All rights reserved.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+__doc__ = """This module offers a compact table of files for millions of
+them. Names & folders are interned in string tables and every file is a
+row of array-backed columns, so a file costs a few dozen bytes instead of
+a tuple & its strings. Rows are read through light views with 'name' &
+'dir' like NameDirPair. It exposes the following types:
+
+FileTable
+FileRow
+"""
+
+from array import array
+import os
+from typing import Any, Iterable, Iterator
+
+from fingerprint import FileStat, GetStats, HashScheduler
+
+
+# The size of a row not stat'd yet...
+_UNKNOWN = -2
+
+
+class FileRow(object):
+    '''A view of a row of a FileTable. It offers 'name' & 'dir' like
+    NameDirPair, so it can be used wherever they are, and 'size', 'mtime',
+    'inode' & 'stat', which are stat'd on first access and kept in the
+    table. A file which cannot be stat'd has a size of -1 & a 'stat' of
+    None. 'knownStat' gives the stat only if it has been taken already.
+    Views of the same row are equal.
+    '''
+
+    __slots__ = ('table', 'idx',)
+
+    def __init__(self, table: 'FileTable', idx: int) -> None:
+        self.table = table
+        self.idx = idx
+
+    @property
+    def name(self) -> str:
+        table = self.table
+        return table.names[table.nameIdxs[self.idx]]
+
+    @property
+    def dir(self) -> str:
+        table = self.table
+        return table.dirs[table.dirIdxs[self.idx]]
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.dir, self.name)
+
+    @property
+    def size(self) -> int:
+        if self.table.sizes[self.idx] == _UNKNOWN:
+            self.table.Stat((self.idx,))
+        return self.table.sizes[self.idx]
+
+    @property
+    def mtime(self) -> int:
+        '''The modification time in nanoseconds.'''
+        if self.table.sizes[self.idx] == _UNKNOWN:
+            self.table.Stat((self.idx,))
+        return self.table.mtimes[self.idx]
+
+    @property
+    def inode(self) -> int:
+        if self.table.sizes[self.idx] == _UNKNOWN:
+            self.table.Stat((self.idx,))
+        return self.table.inodes[self.idx]
+
+    @property
+    def stat(self) -> FileStat | None:
+        table = self.table
+        idx = self.idx
+        if table.sizes[idx] == _UNKNOWN:
+            table.Stat((idx,))
+        if table.sizes[idx] < 0:
+            return None
+        return FileStat(
+            table.sizes[idx],
+            table.mtimes[idx],
+            table.devs[idx],
+            table.inodes[idx])
+
+    @property
+    def knownStat(self) -> FileStat | None:
+        '''The 'stat' of the file if it has been stat'd already, otherwise
+        None. The file is never stat'd by it.
+        '''
+        if self.table.sizes[self.idx] == _UNKNOWN:
+            return None
+        return self.stat
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, FileRow):
+            return NotImplemented
+        return self.table is other.table and self.idx == other.idx
+
+    def __hash__(self) -> int:
+        return hash((id(self.table), self.idx,))
+
+    def __repr__(self) -> str:
+        return f'FileRow(name={self.name!r}, dir={self.dir!r})'
+
+
+class FileTable(object):
+    '''Keeps files as rows of columns: indices into the tables of names
+    & folders, and size, mtime, device & inode. Files are added a folder
+    at a time. Attributes are not stat'd when files are added but on
+    first access, or for many rows at once by Stat, so only files which
+    need them pay for it.
+    '''
+
+    def __init__(self) -> None:
+        # Interned names & folders along with their indices. The index of
+        # names is only needed while adding files...
+        self.names: list[str] = []
+        self.dirs: list[str] = []
+        self._nameIdxs: dict[str, int] | None = {}
+        self._dirIdxs: dict[str, int] = {}
+        # Columns of rows...
+        self.nameIdxs = array('I')
+        self.dirIdxs = array('I')
+        self.sizes = array('q')
+        self.mtimes = array('q')
+        self.devs = array('Q')
+        self.inodes = array('Q')
+
+    def __len__(self) -> int:
+        return len(self.nameIdxs)
+
+    def __getitem__(self, idx: int) -> FileRow:
+        if idx < 0:
+            idx += len(self.nameIdxs)
+        if not 0 <= idx < len(self.nameIdxs):
+            raise IndexError('row index out of range')
+        return FileRow(self, idx)
+
+    def __iter__(self) -> Iterator[FileRow]:
+        for idx in range(len(self.nameIdxs)):
+            yield FileRow(self, idx)
+
+    def GetDirIdx(self, dir: str) -> int | None:
+        '''Returns the index of 'dir' in the table of folders or None if no
+        file of it has been added.
+        '''
+        return self._dirIdxs.get(dir)
+
+    def AddDir(self, dir: str, names: Iterable[str]) -> range:
+        '''Adds files of 'names' in the folder 'dir' and returns the range
+        of their rows.
+        '''
+        dirIdx = self._dirIdxs.get(dir)
+        if dirIdx is None:
+            dirIdx = len(self.dirs)
+            self.dirs.append(dir)
+            self._dirIdxs[dir] = dirIdx
+        start = len(self.nameIdxs)
+        nameIdxs = self._nameIdxs
+        if nameIdxs is None:
+            nameIdxs = {name: idx for idx, name in enumerate(self.names)}
+            self._nameIdxs = nameIdxs
+        for name in names:
+            nameIdx = nameIdxs.get(name)
+            if nameIdx is None:
+                nameIdx = len(self.names)
+                self.names.append(name)
+                nameIdxs[name] = nameIdx
+            self.nameIdxs.append(nameIdx)
+        n = len(self.nameIdxs) - start
+        self.dirIdxs.extend(array('I', (dirIdx,)) * n)
+        self.sizes.extend(array('q', (_UNKNOWN,)) * n)
+        self.mtimes.extend(array('q', (0,)) * n)
+        self.devs.extend(array('Q', (0,)) * n)
+        self.inodes.extend(array('Q', (0,)) * n)
+        return range(start, start + n)
+
+    def Compact(self) -> None:
+        '''Releases the index of names, which takes about as much memory as
+        the columns, once all files are added. It is rebuilt if more files
+        are added.
+        '''
+        self._nameIdxs = None
+
+    def GetPath(self, idx: int) -> str:
+        return os.path.join(
+            self.dirs[self.dirIdxs[idx]],
+            self.names[self.nameIdxs[idx]])
+
+    def Stat(
+            self,
+            rows: Iterable[int],
+            scheduler: HashScheduler | None = None
+            ) -> None:
+        '''Reads size, mtime, device & inode of the rows which have not
+        been stat'd yet from the file system, in parallel on the pool of
+        'scheduler' if provided. The size of a file which cannot be stat'd
+        becomes -1.
+        '''
+        rows = [idx for idx in rows if self.sizes[idx] == _UNKNOWN]
+        paths = [self.GetPath(idx) for idx in rows]
+        if scheduler is None:
+            results = enumerate(GetStats(paths))
+        else:
+            results = scheduler.StatFiles(paths)
+        for pathIdx, stat_ in results:
+            idx = rows[pathIdx]
+            if stat_ is None:
+                self.sizes[idx] = -1
+                continue
+            self.sizes[idx] = stat_.size
+            self.mtimes[idx] = stat_.mtime_ns
+            self.devs[idx] = stat_.dev
+            self.inodes[idx] = stat_.ino
+
+
+def GetSize(file: Any) -> int:
+    '''Returns the size of the file, or -1 if it cannot be stat'd. Sizes
+    of FileRow views are taken from their table, others are stat'd.
+    '''
+    if isinstance(file, FileRow):
+        return file.size
+    try:
+        return os.stat(os.path.join(file.dir, file.name)).st_size
+    except OSError:
+        return -1
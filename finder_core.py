@@ -0,0 +1,140 @@
+# Copyright (c) 2022, Megacodist
+# All rights reserved.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+__doc__ = """This module offers the pipeline of finding duplicates without
+any GUI, so it can be imported by both the application window & the command
+line. It never imports Tk, PIL, jinja2 or tkinterweb. It exposes the
+following types:
+
+FindResult(allDuplicates=XXX, allSimilars=XXX, allTruncated=XXX, nFiles=XXX)
+"""
+
+from collections import namedtuple
+from pathlib import Path
+from typing import Any, Iterable
+
+from file_table import FileRow, FileTable, GetSize
+from fingerprint import HashScheduler, VerifyLevel
+from fs_scan import FolderScanner
+from metrics import Count, Span
+from utils import FindTruncated, GroupTable, NameDirPair, VerifyReport
+
+
+FindResult = namedtuple(
+    'FindResult',
+    'allDuplicates, allSimilars, allTruncated, nFiles')
+
+
+def ScanFolders(
+        dirs: Iterable[str | Path],
+        subfolders: bool = False,
+        excludes: Iterable[str] = (),
+        workers: int = 8
+        ) -> FileTable:
+    '''Returns the table of all files of 'dirs', and of their subfolders if
+    'subfolders' is true. Subfolders matching any glob pattern of 'excludes'
+    are skipped. Files found through more than one folder are listed once.
+    It raises OSError if a folder cannot be read.
+    '''
+    table = FileTable()
+    for dir in dirs:
+        scanner = FolderScanner(
+            dir,
+            subfolders=subfolders,
+            excludes=excludes,
+            workers=workers)
+        scanner.Start()
+        scanner.Join()
+        if scanner.error is not None:
+            raise scanner.error
+        batches, _ = scanner.GetBatches()
+        # A scanner lists a folder once, so folders listed by an earlier
+        # one are skipped...
+        nKnownDirs = len(table.dirs)
+        for batch in batches:
+            dir_ = str(batch.dir)
+            dirIdx = table.GetDirIdx(dir_)
+            if dirIdx is None or dirIdx >= nKnownDirs:
+                table.AddDir(dir_, batch.names)
+    table.Compact()
+    return table
+
+
+def GroupFiles(
+        table: FileTable
+        ) -> tuple[list[list[FileRow]], list[list[FileRow]]]:
+    '''Returns the pair of name-based 'allDuplicates' and 'allSimilars' of
+    the files of the table.
+    '''
+    return GroupTable(table)
+
+
+def FindDuplicates(
+        dirs: Iterable[str | Path],
+        subfolders: bool = False,
+        level: VerifyLevel = VerifyLevel.FULL,
+        excludes: Iterable[str] = (),
+        scheduler: HashScheduler | None = None
+        ) -> FindResult:
+    '''Scans, groups & verifies files of 'dirs' in one go, and finds
+    truncated duplicates among similars.
+    '''
+    with Span('scan'):
+        table = ScanFolders(dirs, subfolders, excludes)
+    Count('scan.files', len(table))
+    with Span('group'):
+        allDuplicates, allSimilars = GroupFiles(table)
+    with Span('verify'):
+        allDuplicates, allSimilars = VerifyReport(
+            allDuplicates,
+            allSimilars,
+            level,
+            scheduler)
+    with Span('truncated'):
+        allSimilars, allTruncated = FindTruncated(
+            allSimilars,
+            level,
+            scheduler)
+    return FindResult(
+        allDuplicates,
+        allSimilars,
+        allTruncated,
+        len(table))
+
+
+def GetGroupsSizes(
+        groups: Iterable[list[NameDirPair]]
+        ) -> list[list[int]]:
+    '''Returns sizes of files of the groups in the same structure. The size
+    of a file which cannot be read is -1.
+    '''
+    return [[GetSize(file) for file in group] for group in groups]
+
+
+def GetReclaimable(sizes: list[int]) -> int:
+    '''Returns the bytes freed by removing all files of a group but the
+    first one, which is kept. For truncated groups, it is the size of the
+    truncated copies.
+    '''
+    return sum(size for size in sizes[1:] if size > 0)
+
+
+def ResultToDict(result: FindResult, level: VerifyLevel) -> dict[str, Any]:
+    '''Returns a JSON-serializable form of the result with groups as lists
+    of full paths.
+    '''
+    def ToPaths(groups: list[list[NameDirPair]]) -> list[list[str]]:
+        return [
+            [str(Path(file.dir, file.name)) for file in group]
+            for group in groups]
+
+    return {
+        'level': level.value,
+        'files': result.nFiles,
+        'duplicates': ToPaths(result.allDuplicates),
+        'similars': ToPaths(result.allSimilars),
+        'truncated': ToPaths(result.allTruncated),
+    }
@@ -0,0 +1,633 @@
+# Copyright (c) 2022, Megacodist
+# All rights reserved.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+__doc__ = """This module offers content verification of duplicate candidates.
+Candidates are split in tiers, from the cheapest to the most expensive:
+
+⬤ by size (st_size)
+⬤ by a partial digest of the head & tail blocks
+⬤ by a full content digest
+
+so most files are never read in full. For a quick triage of huge files, a
+sampled digest of a few blocks can replace the last two tiers. Hashing is
+parallelized by a worker pool, and files are memory-mapped so their content
+is fed to the digests without copying. The pool also finds truncated
+copies, files whose content is a prefix of a larger file. It exposes the
+following types:
+
+VerifyLevel
+HashScheduler
+"""
+
+from collections import deque, namedtuple
+from concurrent.futures import (
+    FIRST_COMPLETED, Future, ThreadPoolExecutor, wait)
+from enum import Enum, IntEnum
+import hashlib
+import logging
+import mmap
+import os
+from pathlib import Path
+import stat
+import threading
+from typing import (
+    BinaryIO, Hashable, Iterable, Iterator, Sequence, TYPE_CHECKING)
+
+from metrics import Count
+
+if TYPE_CHECKING:
+    from fingerprint_cache import FingerprintCache
+
+# The size of head & tail blocks used for the partial digest...
+PARTIAL_BLOCK_SIZE = 4096
+# The size of chunks to read for the full digest...
+FULL_CHUNK_SIZE = 1 << 20
+# The size of slices of a memory-mapped file fed to the digest at once...
+MAP_CHUNK_SIZE = 8 * (1 << 20)
+# The number & size of blocks used for the sampled digest...
+SAMPLE_BLOCKS = 16
+SAMPLE_BLOCK_SIZE = 64 * (1 << 10)
+# The number of files stat'd by one job of the pool...
+STAT_BATCH_SIZE = 64
+
+# Keeps reusable read buffers, one per thread...
+_threadLocal = threading.local()
+
+
+FileStat = namedtuple(
+    'FileStat',
+    'size, mtime_ns, dev, ino')
+
+
+class VerifyLevel(Enum):
+    '''Specifies how duplicate candidates are verified.'''
+    NAME = 'name'
+    '''Name-based only, no file is opened.'''
+    SAMPLED = 'sampled'
+    '''Size, then a digest of SAMPLE_BLOCKS blocks at fixed offsets: the
+    head, the tail & evenly spaced in between. At most 1 MiB is read per
+    file whatever its size, so it is meant for triage. Files smaller than
+    the blocks are hashed in full and are exact. For larger files, bytes
+    between the blocks are never compared. So two files of the same size
+    which differ only there are reported as duplicates, for example
+    preallocated downloads which stopped halfway, or disk images & media
+    edited in place. Verify with FULL before deleting anything.'''
+    FULL = 'full'
+    '''Size, then partial digest, then full content digest.'''
+
+
+def _NewHasher() -> 'hashlib._Hash':
+    return hashlib.blake2b(digest_size=20)
+
+
+def _GetBuffer(size: int) -> memoryview:
+    '''Returns a reusable buffer of at least 'size' bytes owned by the
+    calling thread.
+    '''
+    buffer = getattr(_threadLocal, 'buffer', None)
+    if buffer is None or len(buffer) < size:
+        buffer = memoryview(bytearray(size))
+        _threadLocal.buffer = buffer
+    return buffer
+
+
+def _UpdateByReading(
+        hasher: 'hashlib._Hash',
+        fileStream: BinaryIO,
+        chunk_size: int,
+        limit: int | None = None
+        ) -> None:
+    '''Feeds the file from its current position into 'hasher' through a
+    reusable buffer, up to 'limit' bytes if specified.
+    '''
+    buffer = _GetBuffer(chunk_size)[:chunk_size]
+    remaining = limit
+    while remaining is None or remaining > 0:
+        view = buffer if remaining is None or remaining >= chunk_size \
+            else buffer[:remaining]
+        nRead = fileStream.readinto(view)
+        if not nRead:
+            break
+        hasher.update(view[:nRead])
+        if remaining is not None:
+            remaining -= nRead
+
+
+def _UpdateByMapping(
+        hasher: 'hashlib._Hash',
+        fileStream: BinaryIO,
+        size: int,
+        chunk_size: int
+        ) -> bool:
+    '''Feeds the whole file into 'hasher' by memory-mapping it, without
+    copying its content. Returns False if the file cannot be mapped, in
+    which case 'hasher' is left untouched.
+    '''
+    try:
+        mapped = mmap.mmap(fileStream.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # Empty & special files cannot be mapped...
+        return False
+    with mapped:
+        if len(mapped) != size:
+            return False
+        with memoryview(mapped) as view:
+            for offset in range(0, size, chunk_size):
+                with view[offset:offset + chunk_size] as chunk:
+                    hasher.update(chunk)
+    return True
+
+
+def GetPartialDigest(
+        path: str | Path,
+        size: int,
+        block_size: int = PARTIAL_BLOCK_SIZE
+        ) -> bytes:
+    '''Returns the digest of the head & tail blocks of the file. If the file
+    is not larger than two blocks, the digest covers the whole content.
+    '''
+    hasher = _NewHasher()
+    with open(path, 'rb', buffering=0) as fileStream:
+        _UpdateByReading(hasher, fileStream, block_size, block_size)
+        if size > block_size:
+            fileStream.seek(max(block_size, size - block_size))
+            _UpdateByReading(hasher, fileStream, block_size, block_size)
+    return hasher.digest()
+
+
+def GetFullDigest(
+        path: str | Path,
+        chunk_size: int = FULL_CHUNK_SIZE
+        ) -> bytes:
+    '''Returns the digest of the whole content of the file. Regular files
+    are memory-mapped and hashed without copying; files which cannot be
+    mapped or which change while being hashed are read through a reusable
+    buffer instead.
+    '''
+    with open(path, 'rb', buffering=0) as fileStream:
+        statBefore = os.fstat(fileStream.fileno())
+        hasher = _NewHasher()
+        if statBefore.st_size > 0 and stat.S_ISREG(statBefore.st_mode):
+            isMapped = _UpdateByMapping(
+                hasher,
+                fileStream,
+                statBefore.st_size,
+                MAP_CHUNK_SIZE)
+            if isMapped:
+                statAfter = os.fstat(fileStream.fileno())
+                if (statAfter.st_size == statBefore.st_size
+                        and statAfter.st_mtime_ns == statBefore.st_mtime_ns):
+                    return hasher.digest()
+                # The file changed while being hashed, starting over...
+                hasher = _NewHasher()
+                fileStream.seek(0)
+        _UpdateByReading(hasher, fileStream, chunk_size)
+    return hasher.digest()
+
+
+def GetSampledDigest(
+        path: str | Path,
+        size: int,
+        n_blocks: int = SAMPLE_BLOCKS,
+        block_size: int = SAMPLE_BLOCK_SIZE
+        ) -> bytes:
+    '''Returns the digest of the size of the file and 'n_blocks' blocks at
+    deterministic offsets: the head, the tail & evenly spaced in between.
+    If the file is not larger than the blocks, the digest covers the whole
+    content.
+    '''
+    hasher = _NewHasher()
+    hasher.update(size.to_bytes(8, 'little'))
+    with open(path, 'rb', buffering=0) as fileStream:
+        if size <= n_blocks * block_size or n_blocks < 2:
+            _UpdateByReading(hasher, fileStream, FULL_CHUNK_SIZE)
+        else:
+            step = (size - block_size) // (n_blocks - 1)
+            for blockIdx in range(n_blocks):
+                # Placing the last block at the very end, as the step is
+                # rounded down...
+                if blockIdx == n_blocks - 1:
+                    fileStream.seek(size - block_size)
+                else:
+                    fileStream.seek(blockIdx * step)
+                _UpdateByReading(hasher, fileStream, block_size, block_size)
+    return hasher.digest()
+
+
+def IsPrefix(
+        path: str | Path,
+        of_path: str | Path,
+        chunk_size: int = FULL_CHUNK_SIZE,
+        block_size: int = PARTIAL_BLOCK_SIZE
+        ) -> bool:
+    '''Determines whether the whole content of 'path' is the start of the
+    content of 'of_path', like a download interrupted halfway. The head &
+    tail blocks of 'path' are compared first and then the rest chunk by
+    chunk, so reading stops at the first difference.
+    '''
+    with open(path, 'rb', buffering=0) as smallStream, \
+            open(of_path, 'rb', buffering=0) as largeStream:
+        size = os.fstat(smallStream.fileno()).st_size
+        if size > os.fstat(largeStream.fileno()).st_size:
+            return False
+        # Comparing the head & tail blocks...
+        offsets = [0]
+        if size > block_size:
+            offsets.append(max(block_size, size - block_size))
+        for offset in offsets:
+            smallStream.seek(offset)
+            largeStream.seek(offset)
+            n = min(block_size, size - offset)
+            if smallStream.read(n) != largeStream.read(n):
+                return False
+        if size <= 2 * block_size:
+            return True
+
+        # Comparing the middle...
+        smallStream.seek(block_size)
+        largeStream.seek(block_size)
+        remaining = size - 2 * block_size
+        while remaining > 0:
+            n = min(chunk_size, remaining)
+            smallChunk = smallStream.read(n)
+            if not smallChunk or smallChunk != largeStream.read(n):
+                return False
+            remaining -= len(smallChunk)
+    return True
+
+
+def GetStat(path: str | Path) -> FileStat:
+    '''Returns the attributes of the file which identify its content.'''
+    stat_ = os.stat(path)
+    return FileStat(
+        stat_.st_size,
+        stat_.st_mtime_ns,
+        stat_.st_dev,
+        stat_.st_ino)
+
+
+def GetStats(paths: Iterable[str | Path]) -> list[FileStat | None]:
+    '''Returns the FileStat of every file of 'paths' in the same order,
+    None for files which cannot be stat'd.
+    '''
+    stats = []
+    for path in paths:
+        try:
+            stats.append(GetStat(path))
+        except OSError:
+            stats.append(None)
+    return stats
+
+
+def _Bucket(
+        items: Iterable[tuple[int, Hashable]]
+        ) -> list[list[int]]:
+    '''Groups indices by their keys and returns only groups with two or
+    more members.
+    '''
+    buckets: dict[Hashable, list[int]] = {}
+    for idx, key in items:
+        buckets.setdefault(key, []).append(idx)
+    return [bucket for bucket in buckets.values() if len(bucket) > 1]
+
+
+class _Stage(IntEnum):
+    SIZE = 0
+    PARTIAL = 1
+    SAMPLED = 2
+    FULL = 3
+    DONE = 4
+
+
+# Maps verification levels to their stages...
+_PIPELINES = {
+    VerifyLevel.SAMPLED: (_Stage.SIZE, _Stage.SAMPLED,),
+    VerifyLevel.FULL: (_Stage.SIZE, _Stage.PARTIAL, _Stage.FULL,),
+}
+
+# Maps stages to columns of the fingerprint cache...
+_CACHE_COLUMNS = {
+    _Stage.PARTIAL: 'partial',
+    _Stage.SAMPLED: 'sampled',
+    _Stage.FULL: 'full',
+}
+
+
+class _GroupState(object):
+    '''Keeps track of the verification of a group of candidates.'''
+
+    def __init__(
+            self,
+            index: int,
+            paths: Sequence[str | Path],
+            stages: Sequence[_Stage] = _PIPELINES[VerifyLevel.FULL],
+            known_stats: Sequence[FileStat | None] | None = None
+            ) -> None:
+        self.index = index
+        self.paths = paths
+        self.stages = stages
+        # Stats of files already known to the caller, None for files which
+        # cannot be read...
+        self.knownStats = known_stats
+        self.stage = _Stage.SIZE
+        self.stats: dict[int, FileStat] = {}
+        self.keys: dict[int, Hashable] = {}
+        self.pending = 0
+        self.subgroups: list[list[int]] = \
+            [list(range(len(paths)))] if len(paths) > 1 else []
+        self.identicals: list[list[int]] = []
+
+
+class HashScheduler(object):
+    '''Verifies groups of duplicate candidates in parallel. File chunks are
+    streamed into hashlib digests by a pool of 'workers' threads (or
+    processes if 'use_processes' is true). At most 'max_bytes_in_flight'
+    bytes and JOBS_PER_WORKER jobs per worker are scheduled at any time, so
+    neither huge files nor swarms of small ones pile up in the pool. If
+    'cache' is provided, digests of unchanged files are taken from it
+    instead of being computed. Use it as a context manager or call Close
+    when done; the cache is not closed by it.
+    '''
+
+    # The number of jobs scheduled per worker at any time. Waiting on the
+    # futures costs time in proportion to their number...
+    JOBS_PER_WORKER = 4
+
+    def __init__(
+            self,
+            workers: int | None = None,
+            *,
+            use_processes: bool = False,
+            max_bytes_in_flight: int = 256 * (1 << 20),
+            cache: 'FingerprintCache | None' = None
+            ) -> None:
+        if workers is None:
+            workers = min(8, os.cpu_count() or 1)
+        if workers < 1:
+            raise ValueError("'workers' must be a positive integer")
+        if use_processes:
+            # Importing multiprocessing only when needed, as it is slow...
+            from concurrent.futures import ProcessPoolExecutor
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix='Hasher')
+        self.workers = workers
+        self.maxBytesInFlight = max_bytes_in_flight
+        self.maxJobsInFlight = self.JOBS_PER_WORKER * workers
+        self.cache = cache
+
+    def __enter__(self) -> 'HashScheduler':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.Close()
+
+    def Close(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        if self.cache is not None:
+            self.cache.Flush()
+
+    def VerifyGroups(
+            self,
+            groups: Iterable[Sequence[str | Path]],
+            level: VerifyLevel = VerifyLevel.FULL,
+            stats: Iterable[Sequence[FileStat | None]] | None = None
+            ) -> Iterator[tuple[int, list[list[int]]]]:
+        '''Verifies every group of paths and yields a pair of the index of
+        the group in 'groups' and its sets of identical files, each as a
+        list of indices into the group. Pairs are yielded in the order
+        groups finish, not the order they were given. If 'stats' of files
+        are provided in the same structure as 'groups', files are not
+        stat'd again; None stands for a file which cannot be read.
+        '''
+        if level is VerifyLevel.NAME:
+            for idx, paths in enumerate(groups):
+                yield idx, _GroupState(idx, paths).subgroups
+            return
+        if stats is None:
+            states = [
+                _GroupState(idx, paths, _PIPELINES[level])
+                for idx, paths in enumerate(groups)]
+        else:
+            states = [
+                _GroupState(idx, paths, _PIPELINES[level], groupStats)
+                for idx, (paths, groupStats) in enumerate(zip(groups, stats))]
+
+        # Every job is (cost, state, file index, function, arguments)...
+        jobs = deque()
+        futures: dict[Future, tuple] = {}
+        inFlight = 0
+        for state in states:
+            self._QueueStage(state, jobs)
+            if state.stage is _Stage.DONE:
+                yield state.index, state.identicals
+
+        while jobs or futures:
+            # Submitting jobs as long as the budget allows...
+            while jobs and len(futures) < self.maxJobsInFlight and (
+                    inFlight + jobs[0][0] <= self.maxBytesInFlight
+                    or not futures):
+                job = jobs.popleft()
+                futures[self._executor.submit(job[3], *job[4])] = job
+                inFlight += job[0]
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                cost, state, fileIdx, _, _ = futures.pop(future)
+                inFlight -= cost
+                try:
+                    state.keys[fileIdx] = future.result()
+                except OSError as err:
+                    logging.error(f'Verifying a file failed\n{str(err)}')
+                else:
+                    stageName = state.stage.name.lower()
+                    Count(f'hash.{stageName}.files')
+                    if cost:
+                        Count(f'hash.{stageName}.bytes', cost)
+                    if self.cache is not None and \
+                            state.stage is not _Stage.SIZE:
+                        self.cache.Put(
+                            state.paths[fileIdx],
+                            state.stats[fileIdx],
+                            _CACHE_COLUMNS[state.stage],
+                            state.keys[fileIdx])
+                state.pending -= 1
+                if state.pending == 0:
+                    self._FinishStage(state)
+                    self._QueueStage(state, jobs)
+                    if state.stage is _Stage.DONE:
+                        yield state.index, state.identicals
+
+    def CheckPrefixes(
+            self,
+            pairs: Iterable[tuple[str | Path, str | Path, int]]
+            ) -> Iterator[tuple[int, bool]]:
+        '''Checks triples of a path, a larger path & the size of the first
+        one with IsPrefix and yields pairs of the index of the triple in
+        'pairs' and the result, in the order checks finish. Files which
+        cannot be read are logged & yield False.
+        '''
+        jobs = deque(enumerate(pairs))
+        futures: dict[Future, tuple[int, int]] = {}
+        inFlight = 0
+        while jobs or futures:
+            # Submitting jobs as long as the budget allows...
+            while jobs and len(futures) < self.maxJobsInFlight and (
+                    inFlight + jobs[0][1][2] <= self.maxBytesInFlight
+                    or not futures):
+                idx, (path, ofPath, size) = jobs.popleft()
+                future = self._executor.submit(IsPrefix, path, ofPath)
+                futures[future] = (idx, size,)
+                inFlight += size
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx, size = futures.pop(future)
+                inFlight -= size
+                Count('prefix.files')
+                try:
+                    yield idx, future.result()
+                except OSError as err:
+                    logging.error(f'Comparing a file failed\n{str(err)}')
+                    yield idx, False
+
+    def StatFiles(
+            self,
+            paths: Sequence[str | Path]
+            ) -> Iterator[tuple[int, FileStat | None]]:
+        '''Stats the files on the pool, STAT_BATCH_SIZE files per job, and
+        yields pairs of the index of the path in 'paths' and its FileStat,
+        or None if it cannot be stat'd, in the order jobs finish.
+        '''
+        jobs = deque(range(0, len(paths), STAT_BATCH_SIZE))
+        futures: dict[Future, int] = {}
+        while jobs or futures:
+            while jobs and len(futures) < self.maxJobsInFlight:
+                start = jobs.popleft()
+                future = self._executor.submit(
+                    GetStats,
+                    paths[start:start + STAT_BATCH_SIZE])
+                futures[future] = start
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                start = futures.pop(future)
+                stats = future.result()
+                Count('stat.files', len(stats))
+                for idx, stat_ in enumerate(stats, start):
+                    yield idx, stat_
+
+    def _QueueStage(self, state: _GroupState, jobs: deque) -> None:
+        '''Queues the jobs of the current stage of the group or marks it
+        as done if there is nothing left to verify.
+        '''
+        while True:
+            if state.stage is _Stage.FULL:
+                # Partial digests have already covered small files...
+                subgroups = []
+                for subgroup in state.subgroups:
+                    size = state.stats[subgroup[0]].size
+                    if size <= 2 * PARTIAL_BLOCK_SIZE:
+                        state.identicals.append(subgroup)
+                    else:
+                        subgroups.append(subgroup)
+                state.subgroups = subgroups
+            if not state.subgroups:
+                state.stage = _Stage.DONE
+                return
+
+            state.keys = {}
+            for subgroup in state.subgroups:
+                for idx in subgroup:
+                    job = self._MakeJob(state, idx)
+                    if job is not None:
+                        jobs.append(job)
+                        state.pending += 1
+            if state.pending:
+                return
+            # All keys of this stage are known or in the cache...
+            self._FinishStage(state)
+
+    def _MakeJob(self, state: _GroupState, idx: int) -> tuple | None:
+        '''Returns the job of the current stage for the file or None if its
+        key is already known or has been found in the cache.
+        '''
+        path = state.paths[idx]
+        if state.stage is _Stage.SIZE:
+            if state.knownStats is None:
+                return (0, state, idx, GetStat, (path,))
+            if state.knownStats[idx] is not None:
+                state.keys[idx] = state.knownStats[idx]
+            return None
+
+        if self.cache is not None:
+            digest = self.cache.Get(
+                path,
+                state.stats[idx],
+                _CACHE_COLUMNS[state.stage])
+            if digest is not None:
+                state.keys[idx] = digest
+                return None
+
+        size = state.stats[idx].size
+        if state.stage is _Stage.PARTIAL:
+            return (
+                min(size, 2 * PARTIAL_BLOCK_SIZE),
+                state,
+                idx,
+                GetPartialDigest,
+                (path, size,))
+        if state.stage is _Stage.SAMPLED:
+            return (
+                min(size, SAMPLE_BLOCKS * SAMPLE_BLOCK_SIZE),
+                state,
+                idx,
+                GetSampledDigest,
+                (path, size,))
+        return (size, state, idx, GetFullDigest, (path,))
+
+    def _FinishStage(self, state: _GroupState) -> None:
+        '''Splits the sub-groups of the group by the keys of the
+        current stage and moves the group to the next stage.
+        '''
+        if state.stage is _Stage.SIZE:
+            state.stats = state.keys
+            state.keys = {
+                idx: stat_.size
+                for idx, stat_ in state.stats.items()}
+        subgroups = []
+        for subgroup in state.subgroups:
+            subgroups.extend(_Bucket(
+                (idx, state.keys[idx])
+                for idx in subgroup
+                if idx in state.keys))
+        state.subgroups = subgroups
+        stageIdx = state.stages.index(state.stage) + 1
+        if stageIdx < len(state.stages):
+            state.stage = state.stages[stageIdx]
+        else:
+            # The last stage proves content identical...
+            state.identicals.extend(subgroups)
+            state.subgroups = []
+            state.stage = _Stage.DONE
+
+
+def SplitIdentical(
+        paths: Sequence[str | Path],
+        level: VerifyLevel = VerifyLevel.FULL,
+        scheduler: HashScheduler | None = None
+        ) -> list[list[int]]:
+    '''Splits 'paths' into sets of files with identical content and returns
+    a list of them, each as a list of indices into 'paths'. Files which are
+    not proven identical to any other are not included in the result.
+    '''
+    if scheduler is None:
+        with HashScheduler() as scheduler:
+            return SplitIdentical(paths, level, scheduler)
+    for _, identicals in scheduler.VerifyGroups([paths], level):
+        return identicals
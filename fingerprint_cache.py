@@ -0,0 +1,215 @@
+# Copyright (c) 2022, Megacodist
+# All rights reserved.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+__doc__ = """This module offers a persistent cache of file fingerprints
+between sessions of the application, so unchanged files are never read
+twice. It exposes the following types:
+
+FingerprintCache
+"""
+
+import logging
+from pathlib import Path
+import sqlite3
+from threading import Lock
+from time import time_ns
+
+from fingerprint import FileStat
+from metrics import Count
+
+
+# Columns of digests...
+_DIGEST_COLUMNS = ('partial', 'sampled', 'full',)
+
+
+class FingerprintCache(object):
+    '''Stores partial, sampled & full digests of files in a SQLite
+    database in WAL mode. Entries are keyed by the path and are valid only
+    as long as size, mtime_ns, device & inode of the file are unchanged.
+    Writes are batched into one transaction per 'batch_size' entries and
+    the least recently used entries are evicted beyond 'max_entries'. It
+    is safe to be used from multiple threads. Call Close when done.
+    '''
+
+    def __init__(
+            self,
+            file: str | Path,
+            *,
+            max_entries: int = 1_000_000,
+            batch_size: int = 1000
+            ) -> None:
+        self.file = file
+        self.maxEntries = max_entries
+        self.batchSize = batch_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        # Pending writes as (path, stat, column, digest)...
+        self._toPut: list[tuple[str, FileStat, str, bytes]] = []
+        # Pending recency updates as path...
+        self._toTouch: list[str] = []
+
+        self._conn = sqlite3.connect(
+            str(file),
+            check_same_thread=False,
+            isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                dev INTEGER NOT NULL,
+                ino INTEGER NOT NULL,
+                partial BLOB,
+                sampled BLOB,
+                full BLOB,
+                last_used INTEGER NOT NULL)''')
+        # Migrating databases created before sampled digests...
+        columns = {
+            row[1]
+            for row in self._conn.execute('PRAGMA table_info(fingerprints)')}
+        if 'sampled' not in columns:
+            self._conn.execute(
+                'ALTER TABLE fingerprints ADD COLUMN sampled BLOB')
+        self._conn.execute('''
+            CREATE INDEX IF NOT EXISTS fingerprints_last_used
+            ON fingerprints (last_used)''')
+
+    def __enter__(self) -> 'FingerprintCache':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.Close()
+
+    def Get(
+            self,
+            path: str | Path,
+            stat: FileStat,
+            column: str
+            ) -> bytes | None:
+        '''Returns the cached digest of 'column', either 'partial',
+        'sampled' or 'full', of the file or None if it is not cached or the
+        file has changed since.
+        '''
+        if column not in _DIGEST_COLUMNS:
+            raise ValueError(
+                "'column' must be either 'partial', 'sampled' or 'full'")
+        path = str(path)
+        with self._lock:
+            row = self._conn.execute(
+                f'SELECT {column} FROM fingerprints WHERE path = ? AND '
+                + 'size = ? AND mtime_ns = ? AND dev = ? AND ino = ?',
+                (path, *stat,)).fetchone()
+            if row is None or row[0] is None:
+                self.misses += 1
+                Count('cache.misses')
+                return None
+            self.hits += 1
+            Count('cache.hits')
+            self._toTouch.append(path)
+            if len(self._toTouch) >= self.batchSize:
+                self._Flush()
+            return row[0]
+
+    def GetStat(self, path: str | Path) -> FileStat | None:
+        '''Returns the attributes of the file when its digests were cached
+        or None if the file is not cached.
+        '''
+        with self._lock:
+            # Pending entries may be newer...
+            if self._toPut:
+                self._Flush()
+            row = self._conn.execute(
+                'SELECT size, mtime_ns, dev, ino FROM fingerprints WHERE '
+                + 'path = ?',
+                (str(path),)).fetchone()
+        return None if row is None else FileStat(*row)
+
+    def Put(
+            self,
+            path: str | Path,
+            stat: FileStat,
+            column: str,
+            digest: bytes
+            ) -> None:
+        '''Caches the digest of 'column', either 'partial', 'sampled' or
+        'full', of the file. The entry is written with the next batch.
+        '''
+        if column not in _DIGEST_COLUMNS:
+            raise ValueError(
+                "'column' must be either 'partial', 'sampled' or 'full'")
+        with self._lock:
+            self._toPut.append((str(path), stat, column, digest,))
+            if len(self._toPut) >= self.batchSize:
+                self._Flush()
+
+    def Flush(self) -> None:
+        '''Writes all pending entries to the database.'''
+        with self._lock:
+            self._Flush()
+
+    def Close(self) -> None:
+        '''Writes pending entries, evicts the least recently used entries
+        beyond the size cap & closes the database.
+        '''
+        with self._lock:
+            if self._conn is None:
+                return
+            try:
+                self._Flush()
+                self._Evict()
+            except sqlite3.Error as err:
+                logging.error(f'Closing fingerprint cache failed\n{str(err)}')
+            finally:
+                self._conn.close()
+                self._conn = None
+
+    def _Flush(self) -> None:
+        if not (self._toPut or self._toTouch):
+            return
+        now = time_ns()
+        try:
+            self._conn.execute('BEGIN')
+            for path, stat, column, digest in self._toPut:
+                # Keeping other digests only if the file is unchanged...
+                others = ''.join(
+                    f'{other} = CASE WHEN size = excluded.size AND '
+                    + 'mtime_ns = excluded.mtime_ns AND dev = excluded.dev '
+                    + f'AND ino = excluded.ino THEN {other} ELSE NULL END, '
+                    for other in _DIGEST_COLUMNS
+                    if other != column)
+                self._conn.execute(
+                    'INSERT INTO fingerprints (path, size, mtime_ns, dev, '
+                    + f'ino, {column}, last_used) VALUES (?, ?, ?, ?, ?, ?, '
+                    + '?) ON CONFLICT (path) DO UPDATE SET '
+                    + others
+                    + 'size = excluded.size, mtime_ns = excluded.mtime_ns, '
+                    + 'dev = excluded.dev, ino = excluded.ino, '
+                    + f'{column} = excluded.{column}, '
+                    + 'last_used = excluded.last_used',
+                    (path, *stat, digest, now,))
+            self._conn.executemany(
+                'UPDATE fingerprints SET last_used = ? WHERE path = ?',
+                ((now, path,) for path in self._toTouch))
+            self._conn.execute('COMMIT')
+        except sqlite3.Error as err:
+            logging.error(f'Writing fingerprint cache failed\n{str(err)}')
+            if self._conn.in_transaction:
+                self._conn.execute('ROLLBACK')
+        finally:
+            self._toPut.clear()
+            self._toTouch.clear()
+
+    def _Evict(self) -> None:
+        count = self._conn.execute(
+            'SELECT COUNT(*) FROM fingerprints').fetchone()[0]
+        if count > self.maxEntries:
+            self._conn.execute(
+                'DELETE FROM fingerprints WHERE path IN (SELECT path FROM '
+                + 'fingerprints ORDER BY last_used LIMIT ?)',
+                (count - self.maxEntries,))
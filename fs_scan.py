@@ -0,0 +1,190 @@
+# Copyright (c) 2022, Megacodist
+# All rights reserved.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+__doc__ = """This module offers scanning of folders in the file system off
+the GUI thread. It exposes the following types:
+
+ScanBatch(dir=XXX, names=XXX)
+FolderScanner
+"""
+
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from fnmatch import fnmatch
+import logging
+import os
+from pathlib import Path
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
+from typing import Iterable
+
+
+ScanBatch = namedtuple(
+    'ScanBatch',
+    'dir, names')
+
+
+def ContainsFile(dir: str | Path) -> bool:
+    '''Determines whether the folder directly contains at least one file.
+    It stops at the first file found.
+    '''
+    with os.scandir(dir) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file():
+                    return True
+            except OSError:
+                pass
+    return False
+
+
+class FolderScanner(object):
+    '''Scans a folder for files in the background. Found file names are
+    queued in batches of 'batch_size', one or more batches per folder,
+    which must be collected by calling GetBatches, typically by polling
+    from the GUI thread. Directory entry types are taken from os.scandir,
+    so no extra stat is made per file on most platforms.
+
+    If 'subfolders' is true, the whole subtree is walked by a pool of
+    'workers' threads. Subfolders whose names match any of the glob
+    patterns of 'excludes' are pruned without being listed, and every
+    folder is visited once by its (st_dev, st_ino), so symbolic link
+    loops are not followed.
+    '''
+
+    def __init__(
+            self,
+            dir: str | Path,
+            *,
+            subfolders: bool = False,
+            excludes: Iterable[str] = (),
+            workers: int = 8,
+            batch_size: int = 1000
+            ) -> None:
+        self.dir = Path(dir)
+        self.subfolders = subfolders
+        self.excludes = tuple(excludes)
+        self.workers = workers
+        self.batchSize = batch_size
+        self.nFiles = 0
+        self.nFolders = 0
+        self.error: OSError | None = None
+        self._batches: Queue[ScanBatch] = Queue()
+        self._cancelled = Event()
+        self._countLock = Lock()
+        self._thread = Thread(
+            target=self._Scan,
+            name='FolderScanner',
+            daemon=True)
+
+    def Start(self) -> None:
+        self._thread.start()
+
+    def Cancel(self) -> None:
+        '''Requests the worker threads to stop as soon as possible.'''
+        self._cancelled.set()
+
+    def IsCancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def Join(self, timeout: float | None = None) -> None:
+        '''Waits for the scan to finish.'''
+        self._thread.join(timeout)
+
+    def GetBatches(self) -> tuple[list[ScanBatch], bool]:
+        '''Returns a pair of all batches found so far and a boolean that
+        specifies whether the scan has finished, in which case no more
+        batches will be found.
+        '''
+        # Checking the worker before draining the queue, so the last
+        # batches are never missed...
+        isDone = not self._thread.is_alive()
+        batches = []
+        while True:
+            try:
+                batches.append(self._batches.get_nowait())
+            except Empty:
+                break
+        return batches, isDone
+
+    def _Scan(self) -> None:
+        if not self.subfolders:
+            try:
+                self._ScanDir(self.dir)
+            except OSError as err:
+                logging.error(f"Scanning '{self.dir}' failed\n{str(err)}")
+                self.error = err
+            return
+
+        # Walking the subtree by fanning folders out to the pool...
+        try:
+            rootStat = os.stat(self.dir)
+        except OSError as err:
+            logging.error(f"Scanning '{self.dir}' failed\n{str(err)}")
+            self.error = err
+            return
+        visited = {(rootStat.st_dev, rootStat.st_ino,)}
+        with ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix='FolderWalker') as pool:
+            pending = {pool.submit(self._ScanDir, self.dir)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        subdirs = future.result()
+                    except OSError as err:
+                        logging.error(f'Scanning a folder failed\n{str(err)}')
+                        continue
+                    if self._cancelled.is_set():
+                        continue
+                    for subdir, id_ in subdirs:
+                        if id_ not in visited:
+                            visited.add(id_)
+                            pending.add(pool.submit(self._ScanDir, subdir))
+
+    def _ScanDir(self, dir: Path) -> list[tuple[Path, tuple[int, int]]]:
+        '''Queues files of the folder in batches and returns subfolders to
+        be walked, if required, as pairs of the path and (st_dev, st_ino).
+        '''
+        names = []
+        subdirs = []
+        with os.scandir(dir) as entries:
+            for entry in entries:
+                if self._cancelled.is_set():
+                    break
+                try:
+                    if entry.is_file():
+                        names.append(entry.name)
+                        if len(names) >= self.batchSize:
+                            self._PutBatch(dir, names)
+                            names = []
+                    elif self.subfolders and entry.is_dir():
+                        if self._IsExcluded(entry.name):
+                            continue
+                        # DirEntry.stat leaves st_dev & st_ino zero on
+                        # Windows, so the folder is stat'd by its path...
+                        stat_ = os.stat(entry.path)
+                        subdirs.append((
+                            Path(entry.path),
+                            (stat_.st_dev, stat_.st_ino,),))
+                except OSError:
+                    continue
+        if names:
+            self._PutBatch(dir, names)
+        with self._countLock:
+            self.nFolders += 1
+        return subdirs
+
+    def _PutBatch(self, dir: Path, names: list[str]) -> None:
+        self._batches.put(ScanBatch(dir, names))
+        with self._countLock:
+            self.nFiles += len(names)
+
+    def _IsExcluded(self, name: str) -> bool:
+        return any(
+            fnmatch(name, pattern)
+            for pattern in self.excludes)
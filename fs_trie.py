@@ -0,0 +1,249 @@
+# Copyright (c) 2022, Megacodist
+# All rights reserved.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+__doc__ = """This module offers an in-memory trie of folders & files which
+mirrors the hierarchy shown by TreeviewFS, so lookups never need to query
+the widget. Nodes also keep which of their children are inserted in the
+widget, since large folders are populated lazily. It exposes the
+following types:
+
+FSNode
+"""
+
+from bisect import bisect_left
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from file_table import FileTable
+from utils import NameDirPair, SplitExt
+
+
+# Batches of fewer new files are inserted one at a time, as moving items of
+# the lists costs much less than building them anew...
+_MIN_MERGE_SIZE = 64
+
+
+def GetFolderKey(part: str) -> tuple[str, str]:
+    '''Returns the sort key of a folder by the first part of its text.'''
+    return (part.lower(), part,)
+
+
+def GetFileKey(name: str) -> tuple[str, str, str]:
+    '''Returns the sort key of a file by its name. Files are sorted by
+    stem, so duplicates like 'XXXX (1).ext' follow 'XXXX.ext'.
+    '''
+    lowerName = name.lower()
+    return (SplitExt(lowerName)[0], lowerName, name,)
+
+
+class FSNode(object):
+    '''Represents a folder item of the tree. The text of a folder item is
+    one or more parts of a path, so chains of folders with a single child
+    are kept in one node. Folder & file children are kept sorted along
+    with their keys, so insertion points are found by bisection.
+    '''
+
+    __slots__ = (
+        'parts',
+        'iid',
+        'parent',
+        'folders',
+        'folderKeys',
+        'files',
+        'fileKeys',
+        'fileIids',
+        'isPopulated',
+        'nShown',
+        'limit',
+        'moreIid',
+        'placeholderIid',
+    )
+
+    def __init__(
+            self,
+            parts: tuple[str, ...],
+            iid: str | None = None,
+            parent: 'FSNode | None' = None
+            ) -> None:
+        self.parts = parts
+        self.iid = iid
+        self.parent = parent
+        self.folders: list[FSNode] = []
+        self.folderKeys: list[tuple[str, str]] = []
+        self.files: list[str] = []
+        self.fileKeys: list[tuple[str, str, str]] = []
+        # Maps file names to their items in the tree view...
+        self.fileIids: dict[str, str] = {}
+        # Whether children of the node have been inserted in the tree
+        # view. Only the first 'nShown' files, at most about 'limit', are
+        # inserted and the rest is represented by a 'load more' item...
+        self.isPopulated = False
+        self.nShown = 0
+        self.limit = 0
+        self.moreIid: str | None = None
+        # The dummy child making an unpopulated item expandable...
+        self.placeholderIid: str | None = None
+
+    @property
+    def text(self) -> str:
+        return str(Path(*self.parts)) if self.parts else ''
+
+    def GetRoot(self) -> 'FSNode':
+        '''Returns the topmost ancestor of the node.'''
+        node = self
+        while node.parent is not None:
+            node = node.parent
+        return node
+
+    def GetPath(self) -> Path:
+        '''Returns the full path of the folder.'''
+        parts = []
+        node = self
+        while node is not None:
+            parts.append(node.text)
+            node = node.parent
+        parts.reverse()
+        return Path(*parts)
+
+    def FindFolder(self, part: str) -> 'FSNode | None':
+        '''Returns the folder child whose text starts with 'part' or None
+        if there is no such child.
+        '''
+        key = GetFolderKey(part)
+        idx = bisect_left(self.folderKeys, key)
+        if idx < len(self.folderKeys) and self.folderKeys[idx] == key:
+            return self.folders[idx]
+        return None
+
+    def InsertFolder(self, node: 'FSNode') -> int:
+        '''Inserts 'node' among folder children at its sorted position and
+        returns the position.
+        '''
+        key = GetFolderKey(node.parts[0])
+        idx = bisect_left(self.folderKeys, key)
+        self.folderKeys.insert(idx, key)
+        self.folders.insert(idx, node)
+        node.parent = self
+        return idx
+
+    def RemoveFolder(self, node: 'FSNode') -> int:
+        '''Removes 'node' from folder children and returns its former
+        position.
+        '''
+        idx = self.folders.index(node)
+        del self.folders[idx]
+        del self.folderKeys[idx]
+        node.parent = None
+        return idx
+
+    def ReplaceFolder(self, old: 'FSNode', new: 'FSNode') -> int:
+        '''Puts 'new' in place of 'old' among folder children. Both must
+        have the same first part. Returns the position.
+        '''
+        idx = self.folders.index(old)
+        self.folders[idx] = new
+        old.parent = None
+        new.parent = self
+        return idx
+
+    def FindFile(self, name: str) -> int | None:
+        '''Returns the position of the file among file children or None
+        if there is no such file.
+        '''
+        key = GetFileKey(name)
+        idx = bisect_left(self.fileKeys, key)
+        if idx < len(self.fileKeys) and self.fileKeys[idx] == key:
+            return idx
+        return None
+
+    def AddFile(self, name: str) -> int | None:
+        '''Adds the file at its sorted position among file children and
+        returns the position. If the file already exists, returns None.
+        '''
+        key = GetFileKey(name)
+        idx = bisect_left(self.fileKeys, key)
+        if idx < len(self.fileKeys) and self.fileKeys[idx] == key:
+            return None
+        self.fileKeys.insert(idx, key)
+        self.files.insert(idx, name)
+        return idx
+
+    def AddFiles(self, names: Iterable[str]) -> list[str]:
+        '''Adds the files to file children and returns the names of those
+        which did not exist, in sorted order. Large batches are sorted and
+        merged into the children at once, as inserting them one at a time
+        would be quadratic for large folders.
+        '''
+        newKeys = sorted({GetFileKey(name) for name in names})
+        if len(newKeys) < _MIN_MERGE_SIZE:
+            return [
+                key[2]
+                for key in newKeys
+                if self.AddFile(key[2]) is not None]
+        oldKeys = self.fileKeys
+        oldFiles = self.files
+        fileKeys = []
+        files = []
+        added = []
+        start = 0
+        for key in newKeys:
+            idx = bisect_left(oldKeys, key, start)
+            fileKeys.extend(oldKeys[start:idx])
+            files.extend(oldFiles[start:idx])
+            start = idx
+            if idx < len(oldKeys) and oldKeys[idx] == key:
+                continue
+            fileKeys.append(key)
+            files.append(key[2])
+            added.append(key[2])
+        if added:
+            fileKeys.extend(oldKeys[start:])
+            files.extend(oldFiles[start:])
+            self.fileKeys = fileKeys
+            self.files = files
+        return added
+
+    def RemoveFile(self, name: str) -> int:
+        '''Removes the file from file children and returns its former
+        position.
+        '''
+        idx = bisect_left(self.fileKeys, GetFileKey(name))
+        del self.fileKeys[idx]
+        del self.files[idx]
+        self.fileIids.pop(name, None)
+        return idx
+
+    def IterNodes(self) -> Iterator['FSNode']:
+        '''Iterates over this node and all its descendant folders.'''
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.folders))
+
+    def CollectFiles(
+            self,
+            path: str,
+            filesList: list[NameDirPair]
+            ) -> None:
+        '''Appends all files of this node & its descendants to 'filesList'.
+        'path' is the full path of this node.
+        '''
+        for name in self.files:
+            filesList.append(NameDirPair(name=name, dir=path))
+        for folder in self.folders:
+            folder.CollectFiles(
+                str(Path(path, folder.text)),
+                filesList)
+
+    def CollectTable(self, path: str, table: FileTable) -> None:
+        '''Adds all files of this node & its descendants to 'table'.
+        'path' is the full path of this node.
+        '''
+        if self.files:
+            table.AddDir(path, self.files)
+        for folder in self.folders:
+            folder.CollectTable(str(Path(path, folder.text)), table)
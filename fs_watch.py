@@ -0,0 +1,99 @@
+# Copyright (c) 2022, Megacodist
+# All rights reserved.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+__doc__ = """This module offers watching folders for changes of their files
+in the file system. It exposes the following types:
+
+FolderWatcher
+"""
+
+from pathlib import Path
+from threading import Lock
+from time import monotonic
+
+from watchdog.events import (
+    EVENT_TYPE_CREATED, EVENT_TYPE_DELETED, EVENT_TYPE_MODIFIED,
+    EVENT_TYPE_MOVED, FileSystemEvent, FileSystemEventHandler)
+from watchdog.observers import Observer
+
+
+class _CoalescingHandler(FileSystemEventHandler):
+    '''Records paths of files & folders which have been created, deleted or
+    moved along with the time of their last event.
+    '''
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._lock = Lock()
+        self._pending: dict[str, float] = {}
+
+    def on_any_event(self, event: FileSystemEvent) -> None:
+        now = monotonic()
+        with self._lock:
+            if event.event_type in (EVENT_TYPE_CREATED, EVENT_TYPE_DELETED):
+                self._pending[event.src_path] = now
+            elif event.event_type == EVENT_TYPE_MOVED:
+                self._pending[event.src_path] = now
+                self._pending[event.dest_path] = now
+            elif event.event_type == EVENT_TYPE_MODIFIED:
+                # Writing to a pending file postpones it...
+                if event.src_path in self._pending:
+                    self._pending[event.src_path] = now
+
+    def PopSettled(self, quiet_s: float) -> list[str]:
+        '''Returns & forgets paths without any event for 'quiet_s' seconds.
+        '''
+        deadline = monotonic() - quiet_s
+        with self._lock:
+            settled = [
+                path
+                for path, time_ in self._pending.items()
+                if time_ <= deadline]
+            for path in settled:
+                del self._pending[path]
+        return settled
+
+
+class FolderWatcher(object):
+    '''Watches a folder, and its subfolders if 'subfolders' is true, with a
+    watchdog observer. Instead of individual events, GetChanges returns the
+    paths that have changed, each path once and only after 'quiet_s'
+    seconds without any further event. So a burst, like a download being
+    retried, results in one change whose outcome is the current state of
+    the path in the file system. Call Stop when done.
+    '''
+
+    def __init__(
+            self,
+            dir: str | Path,
+            *,
+            subfolders: bool = False,
+            quiet_s: float = 0.5
+            ) -> None:
+        self.dir = Path(dir)
+        self.subfolders = subfolders
+        self.quietS = quiet_s
+        self._handler = _CoalescingHandler()
+        self._observer = Observer()
+        self._observer.schedule(
+            self._handler,
+            str(self.dir),
+            recursive=subfolders)
+
+    def Start(self) -> None:
+        self._observer.start()
+
+    def Stop(self) -> None:
+        '''Stops watching & waits for the observer thread to finish.'''
+        self._observer.stop()
+        if self._observer.is_alive():
+            self._observer.join()
+
+    def GetChanges(self) -> list[str]:
+        '''Returns paths of files & folders which have been created, deleted
+        or moved since the last call and have settled down since.
+        '''
+        return self._handler.PopSettled(self.quietS)
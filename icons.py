@@ -0,0 +1,116 @@
+# Copyright (c) 2022, Megacodist
+# All rights reserved.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+__doc__ = """This module offers loading icons of the application from an
+atlas, a single PNG of all icons already resized, which Tk loads natively
+without PIL. The atlas is baked by PIL only when a source image changes,
+so the usual launch neither imports PIL nor resizes any image.
+"""
+
+import json
+import logging
+from pathlib import Path
+import tkinter as tk
+from typing import Iterable
+
+
+# Names of files of the atlas & its manifest...
+_ATLAS_NAME = 'icons.png'
+_MANIFEST_NAME = 'icons.json'
+
+
+def _GetSources(
+        res_dir: Path,
+        names: Iterable[str]
+        ) -> dict[str, list[int]]:
+    '''Returns the size & mtime_ns of source images of icons by name.'''
+    sources = {}
+    for name in names:
+        stat_ = (res_dir / f'{name}.png').stat()
+        sources[name] = [stat_.st_size, stat_.st_mtime_ns]
+    return sources
+
+
+def _BakeAtlas(
+        res_dir: Path,
+        cache_dir: Path,
+        names: list[str],
+        size: int
+        ) -> None:
+    '''Resizes source images of icons into one row of 'size' pixels high
+    and writes the atlas & its manifest into 'cache_dir'.
+    '''
+    # Importing PIL only when the atlas is out of date, as it is slow...
+    import PIL.Image
+
+    atlas = PIL.Image.new('RGBA', (size * len(names), size,))
+    for idx, name in enumerate(names):
+        with PIL.Image.open(res_dir / f'{name}.png') as image:
+            icon = image.convert('RGBA').resize(size=(size, size,))
+        atlas.paste(icon, (idx * size, 0,))
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    atlas.save(cache_dir / _ATLAS_NAME)
+    manifest = {
+        'size': size,
+        'names': names,
+        'sources': _GetSources(res_dir, names),
+    }
+    (cache_dir / _MANIFEST_NAME).write_text(
+        json.dumps(manifest),
+        encoding='utf-8')
+
+
+def _IsUpToDate(
+        res_dir: Path,
+        cache_dir: Path,
+        names: list[str],
+        size: int
+        ) -> bool:
+    try:
+        manifest = json.loads(
+            (cache_dir / _MANIFEST_NAME).read_text(encoding='utf-8'))
+        return (cache_dir / _ATLAS_NAME).exists() and \
+            manifest['size'] == size and \
+            manifest['names'] == names and \
+            manifest['sources'] == _GetSources(res_dir, names)
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def LoadIcons(
+        master: tk.Misc,
+        res_dir: str | Path,
+        cache_dir: str | Path,
+        names: Iterable[str],
+        size: int = 24
+        ) -> dict[str, tk.PhotoImage]:
+    '''Returns icons of 'size' pixels by name, out of 'NAME.png' files in
+    'res_dir'. The atlas in 'cache_dir' is baked again if any of the files
+    has changed since. It raises OSError if a source image is missing.
+    '''
+    res_dir = Path(res_dir)
+    cache_dir = Path(cache_dir)
+    names = list(names)
+    if not _IsUpToDate(res_dir, cache_dir, names, size):
+        logging.info('Baking the icon atlas')
+        _BakeAtlas(res_dir, cache_dir, names, size)
+
+    # Slicing the atlas into icons...
+    atlas = tk.PhotoImage(master=master, file=str(cache_dir / _ATLAS_NAME))
+    icons = {}
+    for idx, name in enumerate(names):
+        icon = tk.PhotoImage(master=master, width=size, height=size)
+        icon.tk.call(
+            icon,
+            'copy',
+            atlas,
+            '-from',
+            idx * size,
+            0,
+            (idx + 1) * size,
+            size)
+        icons[name] = icon
+    return icons
@@ -0,0 +1,175 @@
+# Copyright (c) 2022, Megacodist
+# All rights reserved.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+__doc__ = """This module offers lightweight instrumentation of phases of
+finding duplicates: spans timing a phase & counters of files, bytes and
+cache hits. They are collected process-wide from any thread and written to
+the log at the end of a run:
+
+    with Span('verify'):
+        ...
+    Count('hash.full.bytes', size)
+    LogMetrics('Find duplicates')
+
+Counters named 'XXX.hits' & 'XXX.misses' are also reported as hit rates.
+It also offers opt-in profiling of a run with cProfile & tracemalloc. It
+exposes the following types:
+
+ProfileRun
+"""
+
+from contextlib import contextmanager
+import cProfile
+import logging
+from pathlib import Path
+from threading import Lock
+from time import perf_counter, strftime
+import tracemalloc
+from typing import Iterator
+
+
+# Spans as name to (count, seconds) & counters as name to value...
+_spans: dict[str, list[float]] = {}
+_counters: dict[str, int] = {}
+_lock = Lock()
+
+
+@contextmanager
+def Span(name: str) -> Iterator[None]:
+    '''Times the enclosed code as a span of 'name'. Spans of the same name
+    are added up.
+    '''
+    startTime = perf_counter()
+    try:
+        yield
+    finally:
+        AddSpan(name, perf_counter() - startTime)
+
+
+def AddSpan(name: str, seconds: float) -> None:
+    '''Adds a span of 'name' measured elsewhere, like across callbacks.'''
+    with _lock:
+        span = _spans.setdefault(name, [0, 0.0])
+        span[0] += 1
+        span[1] += seconds
+
+
+def Count(name: str, n: int = 1) -> None:
+    '''Adds 'n' to the counter of 'name'.'''
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def GetMetrics() -> tuple[dict[str, tuple[int, float]], dict[str, int]]:
+    '''Returns the pair of spans, as name to (count, seconds), & counters
+    collected so far.
+    '''
+    with _lock:
+        spans = {name: tuple(span) for name, span in _spans.items()}
+        return spans, dict(_counters)
+
+
+def ResetMetrics() -> None:
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+
+def FormatMetrics(
+        spans: dict[str, tuple[int, float]],
+        counters: dict[str, int]
+        ) -> str:
+    '''Returns spans & counters as lines of text.'''
+    # Importing here as utils depends on modules using this one...
+    from utils import FormatSize
+
+    lines = []
+    for name, (count, seconds) in spans.items():
+        times = f' ({count} times)' if count > 1 else ''
+        lines.append(f'{name}: {seconds:.3f} s{times}')
+    for name, value in sorted(counters.items()):
+        if name.endswith('.bytes'):
+            lines.append(f'{name}: {FormatSize(value)}')
+        else:
+            lines.append(f'{name}: {value:,}')
+    for name in sorted(counters):
+        if not name.endswith('.hits'):
+            continue
+        prefix = name[:-len('.hits')]
+        total = counters[name] + counters.get(f'{prefix}.misses', 0)
+        if total:
+            lines.append(
+                f'{prefix} hit rate: {counters[name] / total:.1%}')
+    return '\n'.join(lines)
+
+
+def LogMetrics(title: str, reset: bool = True) -> None:
+    '''Writes spans & counters collected so far to the log under 'title'
+    and clears them if 'reset' is true.
+    '''
+    with _lock:
+        spans = {name: tuple(span) for name, span in _spans.items()}
+        counters = dict(_counters)
+        if reset:
+            _spans.clear()
+            _counters.clear()
+    if spans or counters:
+        logging.info(f'{title}\n{FormatMetrics(spans, counters)}')
+
+
+class ProfileRun(object):
+    '''Profiles the enclosed code with cProfile and writes the statistics
+    & a tracemalloc snapshot into 'dir' as 'NAME-YYYYmmdd-HHMMSS.prof' and
+    'NAME-YYYYmmdd-HHMMSS.tracemalloc'. cProfile only sees the thread
+    entering it. If 'enabled' is false, it does nothing, so it can wrap
+    runs unconditionally:
+
+        with ProfileRun(appDir / 'profiles', 'find', settings['PROFILE']):
+            ...
+
+    Statistics are read by pstats.Stats & snapshots by
+    tracemalloc.Snapshot.load.
+    '''
+
+    def __init__(
+            self,
+            dir: str | Path,
+            name: str,
+            enabled: bool = True
+            ) -> None:
+        self.dir = Path(dir)
+        self.name = name
+        self.enabled = enabled
+        self._profile: cProfile.Profile | None = None
+        self._isTracing = False
+
+    def __enter__(self) -> 'ProfileRun':
+        if self.enabled:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._isTracing = True
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        return self
+
+    def __exit__(self, *args) -> None:
+        if self._profile is None:
+            return
+        self._profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        if self._isTracing:
+            tracemalloc.stop()
+            self._isTracing = False
+        stem = f'{self.name}-{strftime("%Y%m%d-%H%M%S")}'
+        try:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            self._profile.dump_stats(str(self.dir / f'{stem}.prof'))
+            snapshot.dump(str(self.dir / f'{stem}.tracemalloc'))
+            logging.info(f"Profile of '{self.name}' written to {self.dir}")
+        except OSError as err:
+            logging.error(f'Writing the profile failed\n{str(err)}')
+        finally:
+            self._profile = None
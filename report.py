@@ -0,0 +1,164 @@
+# Copyright (c) 2022, Megacodist
+# All rights reserved.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+__doc__ = """This module offers rendering the report of duplicates out of a
+Jinja template, either a page of groups at a time or streamed to a file.
+The template receives 'allDuplicates', 'allTruncated' & 'allSimilars' of
+the page, along with 'nDuplicates', 'nTruncated' & 'nSimilars', the total
+numbers of groups.
+"""
+
+import logging
+from pathlib import Path
+from threading import Lock
+from typing import Any, Iterator
+
+from jinja2 import (
+    Environment, FileSystemBytecodeCache, FileSystemLoader, Template)
+
+from utils import NameDirPair
+
+
+# Environments by template & cache folders, so templates are compiled once
+# per session...
+_envs: dict[tuple[str, str | None], Environment] = {}
+_envsLock = Lock()
+
+
+def GetEnvironment(
+        template_dir: str | Path,
+        cache_dir: str | Path | None = None
+        ) -> Environment:
+    '''Returns the shared environment loading templates from
+    'template_dir'. If 'cache_dir' is provided, compiled templates are also
+    stored there and reused by later sessions. A template is compiled
+    again only when its file changes: the environment checks the mtime of
+    the file & the cache checks a checksum of its source.
+    '''
+    key = (
+        str(template_dir),
+        None if cache_dir is None else str(cache_dir),)
+    with _envsLock:
+        env = _envs.get(key)
+        if env is None:
+            bytecodeCache = None
+            if cache_dir is not None:
+                try:
+                    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+                    bytecodeCache = FileSystemBytecodeCache(str(cache_dir))
+                except OSError as err:
+                    logging.error(
+                        f'Creating template cache failed\n{str(err)}')
+            env = Environment(
+                loader=FileSystemLoader(searchpath=str(template_dir)),
+                bytecode_cache=bytecodeCache,
+                auto_reload=True)
+            _envs[key] = env
+        return env
+
+
+def GetTemplate(
+        template_dir: str | Path,
+        template_name: str,
+        cache_dir: str | Path | None = None
+        ) -> Template:
+    '''Returns the template from the shared environment of 'template_dir'.
+    '''
+    env = GetEnvironment(template_dir, cache_dir)
+    return env.get_template(name=template_name)
+
+
+def CountPages(
+        allDuplicates: list[list[NameDirPair]],
+        allSimilars: list[list[NameDirPair]],
+        allTruncated: list[list[NameDirPair]],
+        page_size: int
+        ) -> int:
+    '''Returns the number of pages of 'page_size' groups, at least one.'''
+    nGroups = len(allDuplicates) + len(allSimilars) + len(allTruncated)
+    return max(1, -(-nGroups // page_size))
+
+
+def GetPageContext(
+        allDuplicates: list[list[NameDirPair]],
+        allSimilars: list[list[NameDirPair]],
+        allTruncated: list[list[NameDirPair]],
+        page: int,
+        page_size: int
+        ) -> dict[str, Any]:
+    '''Returns the context of the zero-based 'page' of the report. Pages
+    hold 'page_size' groups: duplicates first, then truncated duplicates &
+    then similars.
+    '''
+    context = {
+        'nDuplicates': len(allDuplicates),
+        'nTruncated': len(allTruncated),
+        'nSimilars': len(allSimilars),
+    }
+    start = page * page_size
+    stop = start + page_size
+    for key, groups in (
+            ('allDuplicates', allDuplicates),
+            ('allTruncated', allTruncated),
+            ('allSimilars', allSimilars),):
+        context[key] = groups[max(0, start):max(0, stop)]
+        start -= len(groups)
+        stop -= len(groups)
+    return context
+
+
+def RenderPage(
+        template: Template,
+        allDuplicates: list[list[NameDirPair]],
+        allSimilars: list[list[NameDirPair]],
+        allTruncated: list[list[NameDirPair]],
+        page: int,
+        page_size: int
+        ) -> str:
+    '''Renders the zero-based 'page' of the report.'''
+    context = GetPageContext(
+        allDuplicates,
+        allSimilars,
+        allTruncated,
+        page,
+        page_size)
+    return ''.join(template.generate(**context))
+
+
+def GenerateReport(
+        template: Template,
+        allDuplicates: list[list[NameDirPair]],
+        allSimilars: list[list[NameDirPair]],
+        allTruncated: list[list[NameDirPair]]
+        ) -> Iterator[str]:
+    '''Yields the full report piece by piece.'''
+    return template.generate(
+        allDuplicates=allDuplicates,
+        allSimilars=allSimilars,
+        allTruncated=allTruncated,
+        nDuplicates=len(allDuplicates),
+        nSimilars=len(allSimilars),
+        nTruncated=len(allTruncated))
+
+
+def ExportReport(
+        file: str | Path,
+        template: Template,
+        allDuplicates: list[list[NameDirPair]],
+        allSimilars: list[list[NameDirPair]],
+        allTruncated: list[list[NameDirPair]]
+        ) -> None:
+    '''Streams the full report to 'file' as it is rendered, so the whole
+    document is never held in memory. It raises OSError if writing fails.
+    '''
+    chunks = GenerateReport(
+        template,
+        allDuplicates,
+        allSimilars,
+        allTruncated)
+    with open(file, 'wt', encoding='utf-8') as reportStream:
+        for chunk in chunks:
+            reportStream.write(chunk)
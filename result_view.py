@@ -0,0 +1,440 @@
+# Copyright (c) 2022, Megacodist
+# All rights reserved.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+__doc__ = """This module offers a native view of the report of duplicates
+which stays responsive with hundreds of thousands of files. It exposes the
+following types:
+
+ResultView
+"""
+
+import logging
+from pathlib import Path
+import re
+from threading import Thread
+import tkinter as tk
+from tkinter import ttk
+from tkinter.font import nametofont
+from typing import Any
+
+from finder_core import GetGroupsSizes, GetReclaimable
+from utils import AppSettings, FormatSize, NameDirPair
+
+
+class ResultView(tk.Toplevel):
+    '''Shows groups of duplicates, truncated duplicates & similars in a
+    ttk.Treeview along with sizes of files & reclaimable bytes of groups,
+    the bytes freed by removing all files but the first. Groups can be
+    expanded to their files and sorted by clicking on column headings.
+
+    The tree view is virtualized: it has only as many items as rows fit in
+    it, and scrolling fills those items with other rows of the result. So
+    the cost of showing & scrolling does not depend on the number of files.
+    '''
+
+    # The number of rows scrolled by a mouse wheel notch...
+    WHEEL_ROWS = 3
+
+    def __init__(
+            self,
+            allDuplicates: list[list[NameDirPair]],
+            allSimilars: list[list[NameDirPair]],
+            allTruncated: list[list[NameDirPair]]
+            ) -> None:
+        super().__init__()
+        self.title('Report')
+
+        # Loading Result View (RV) settings...
+        settings = self._ReadSettings()
+        self.geometry(
+            f'{settings["RV_WIDTH"]}x{settings["RV_HEIGHT"]}'
+            + f'+{settings["RV_X"]}+{settings["RV_Y"]}')
+        self.state(settings['RV_STATE'])
+
+        # The model of the view...
+        self._groups = allDuplicates + allTruncated + allSimilars
+        self._nDuplicates = len(allDuplicates)
+        self._nTruncated = len(allTruncated)
+        self._nFiles = sum(len(group) for group in self._groups)
+        self._sizes: list[list[int]] | None = None
+        self._reclaimables: list[int] | None = None
+        self._sizesThread: Thread | None = None
+        # Order of groups in the view and the groups showing their files...
+        self._order = list(range(len(self._groups)))
+        self._sortKey = None
+        self._isReversed = False
+        self._expanded: set[int] = set()
+        # Rows as pairs of the group index and the file index, -1 for the
+        # row of the group itself...
+        self._rows: list[tuple[int, int]] = []
+        self._top = 0
+        self._selectedRow: int | None = None
+        # Items of the tree view, one per visible row...
+        self._items: list[str] = []
+
+        # Defining the style of rows...
+        font = nametofont('TkDefaultFont')
+        self._rowHeight = font.metrics('linespace') + 6
+        self._style = ttk.Style(self)
+        self._style.configure('Result.Treeview', rowheight=self._rowHeight)
+
+        self._InitializeGUI()
+        self._BuildRows()
+
+        # Getting sizes of files in the background...
+        self._sizesThread = Thread(
+            target=self._GetSizes,
+            name='SizeReader',
+            daemon=True)
+        self._sizesThread.start()
+        self.after(100, self._PollSizes)
+
+        self.protocol('WM_DELETE_WINDOW', self._OnClosing)
+
+    def _InitializeGUI(self) -> None:
+        #
+        self.lbl_summary = ttk.Label(
+            self)
+        self.lbl_summary.pack(
+            side='bottom',
+            fill='x',
+            padx=2,
+            pady=2)
+
+        #
+        self.lbl_path = ttk.Label(
+            self)
+        self.lbl_path.pack(
+            side='bottom',
+            fill='x',
+            padx=2)
+
+        #
+        self.vscrlbr_result = ttk.Scrollbar(
+            self,
+            orient='vertical',
+            command=self._OnScroll)
+        self.vscrlbr_result.pack(
+            side='right',
+            fill='y')
+
+        #
+        self.trvw_result = ttk.Treeview(
+            self,
+            style='Result.Treeview',
+            columns=('size', 'reclaimable', 'kind', 'dir',),
+            selectmode='browse',
+            height=1)
+        self.trvw_result.pack(
+            fill='both',
+            expand=1)
+        headings = (
+            ('#0', 'Name', 300, self._GetNameKey),
+            ('size', 'Size', 90, self._GetSizeKey),
+            ('reclaimable', 'Reclaimable', 100, self._GetReclaimableKey),
+            ('kind', 'Kind', 80, None),
+            ('dir', 'Folder', 300, None),)
+        for column, text, width, key in headings:
+            if key is None:
+                self.trvw_result.heading(column, text=text, anchor=tk.W)
+            else:
+                self.trvw_result.heading(
+                    column,
+                    text=text,
+                    anchor=tk.W,
+                    command=lambda key=key: self._SortBy(key))
+            self.trvw_result.column(column, width=width, anchor=tk.W)
+        self.trvw_result.tag_configure('file', foreground='gray25')
+
+        # Binding events...
+        self.trvw_result.bind('<Configure>', self._OnResized)
+        self.trvw_result.bind('<<TreeviewSelect>>', self._OnItemSelected)
+        self.trvw_result.bind('<Double-1>', self._OnDoubleClicked)
+        self.trvw_result.bind('<Return>', self._ToggleSelected)
+        self.trvw_result.bind('<space>', self._ToggleSelected)
+        self.trvw_result.bind('<MouseWheel>', self._OnMouseWheel)
+        self.trvw_result.bind('<Button-4>', self._OnMouseWheel)
+        self.trvw_result.bind('<Button-5>', self._OnMouseWheel)
+        for key, nRows in (('<Up>', -1), ('<Down>', 1),):
+            self.trvw_result.bind(
+                key,
+                lambda _, nRows=nRows: self._MoveSelection(nRows))
+        for key, nPages in (('<Prior>', -1), ('<Next>', 1),):
+            self.trvw_result.bind(
+                key,
+                lambda _, nPages=nPages: self._MoveSelection(
+                    nPages * len(self._items)))
+        self.trvw_result.bind(
+            '<Home>',
+            lambda _: self._MoveSelection(-len(self._rows)))
+        self.trvw_result.bind(
+            '<End>',
+            lambda _: self._MoveSelection(len(self._rows)))
+
+    def _ReadSettings(self) -> dict[str, Any]:
+        # Considering Result View (RV) default settings...
+        defaults = {
+            'RV_WIDTH': 900,
+            'RV_HEIGHT': 600,
+            'RV_X': 200,
+            'RV_Y': 200,
+            'RV_STATE': 'normal',
+        }
+        return AppSettings().Read(defaults)
+
+    def _OnClosing(self) -> None:
+        settings = {}
+
+        # Getting the geometry of the Result View (RV)...
+        w_h_x_y = self.winfo_geometry()
+        GEOMETRY_REGEX = r"""
+            (?P<width>\d+)    # The width of the window
+            x(?P<height>\d+)  # The height of the window
+            \+(?P<x>\d+)      # The x-coordinate of the window
+            \+(?P<y>\d+)      # The y-coordinate of the window"""
+        match = re.search(
+            GEOMETRY_REGEX,
+            w_h_x_y,
+            re.VERBOSE)
+        if match:
+            settings['RV_WIDTH'] = int(match.group('width'))
+            settings['RV_HEIGHT'] = int(match.group('height'))
+            settings['RV_X'] = int(match.group('x'))
+            settings['RV_Y'] = int(match.group('y'))
+        else:
+            logging.error('Cannot get the geometry of Result View.')
+
+        # Getting other Result View (RV) settings...
+        settings['RV_STATE'] = self.state()
+
+        AppSettings().Update(settings)
+        self.destroy()
+
+    def _GetSizes(self) -> None:
+        sizes = GetGroupsSizes(self._groups)
+        self._reclaimables = [GetReclaimable(group) for group in sizes]
+        self._sizes = sizes
+
+    def _PollSizes(self) -> None:
+        if not self.winfo_exists():
+            # The view has been closed in the meantime...
+            return
+        if self._sizesThread.is_alive():
+            self.after(100, self._PollSizes)
+            return
+        self._sizesThread = None
+
+        # Showing the largest reclaimable groups first...
+        self._isReversed = False
+        self._SortBy(self._GetReclaimableKey)
+
+    def _GetNameKey(self, groupIdx: int) -> str:
+        return self._groups[groupIdx][0].name.lower()
+
+    def _GetSizeKey(self, groupIdx: int) -> int:
+        if self._sizes is None:
+            return 0
+        return -sum(size for size in self._sizes[groupIdx] if size > 0)
+
+    def _GetReclaimableKey(self, groupIdx: int) -> int:
+        if self._reclaimables is None:
+            return 0
+        return -self._reclaimables[groupIdx]
+
+    def _SortBy(self, key) -> None:
+        '''Sorts groups by 'key', a function of the group index. Sorting by
+        the same key again reverses the order.
+        '''
+        if key == self._sortKey:
+            self._isReversed = not self._isReversed
+        else:
+            self._isReversed = False
+        self._sortKey = key
+        selected = self._GetSelectedPair()
+        self._order.sort(key=key, reverse=self._isReversed)
+        self._BuildRows(selected)
+
+    def _BuildRows(self, selected: tuple[int, int] | None = None) -> None:
+        '''Lays out rows from the order of groups & expanded groups, and
+        keeps 'selected', a pair of group & file indices, selected.
+        '''
+        rows = []
+        for groupIdx in self._order:
+            rows.append((groupIdx, -1,))
+            if groupIdx in self._expanded:
+                rows.extend(
+                    (groupIdx, fileIdx,)
+                    for fileIdx in range(len(self._groups[groupIdx])))
+        self._rows = rows
+        self._selectedRow = None
+        if selected in rows:
+            self._selectedRow = rows.index(selected)
+        self._Render()
+        self._ShowSummary()
+
+    def _GetSelectedPair(self) -> tuple[int, int] | None:
+        if self._selectedRow is None:
+            return None
+        return self._rows[self._selectedRow]
+
+    def _OnResized(self, event: tk.Event) -> None:
+        # Creating as many items as rows fit, leaving room for headings...
+        nRows = (event.height - self._rowHeight - 4) // self._rowHeight
+        nRows = max(1, nRows)
+        while len(self._items) < nRows:
+            self._items.append(self.trvw_result.insert('', 'end'))
+        if len(self._items) > nRows:
+            self.trvw_result.delete(*self._items[nRows:])
+            del self._items[nRows:]
+        self._Render()
+
+    def _ScrollTo(self, top: int) -> None:
+        top = max(0, min(top, len(self._rows) - len(self._items)))
+        if top != self._top:
+            self._top = top
+            self._Render()
+
+    def _OnScroll(self, *args) -> None:
+        if args[0] == 'moveto':
+            self._ScrollTo(int(float(args[1]) * len(self._rows)))
+        elif args[0] == 'scroll':
+            nRows = int(args[1])
+            if args[2] == 'pages':
+                nRows *= len(self._items)
+            self._ScrollTo(self._top + nRows)
+
+    def _OnMouseWheel(self, event: tk.Event) -> str:
+        if event.num == 4 or event.delta > 0:
+            self._ScrollTo(self._top - self.WHEEL_ROWS)
+        else:
+            self._ScrollTo(self._top + self.WHEEL_ROWS)
+        return 'break'
+
+    def _Render(self) -> None:
+        '''Fills items of the tree view with the visible rows.'''
+        self._top = max(0, min(self._top, len(self._rows) - len(self._items)))
+        selectedItem = None
+        for itemIdx, item in enumerate(self._items):
+            rowIdx = self._top + itemIdx
+            if rowIdx >= len(self._rows):
+                self.trvw_result.item(item, text='', values=(), tags=())
+                continue
+            if rowIdx == self._selectedRow:
+                selectedItem = item
+            groupIdx, fileIdx = self._rows[rowIdx]
+            group = self._groups[groupIdx]
+            kind = self._GetKind(groupIdx)
+            if fileIdx < 0:
+                marker = '-' if groupIdx in self._expanded else '+'
+                if self._sizes is None:
+                    size, reclaimable = '...', '...'
+                else:
+                    size = FormatSize(sum(
+                        size for size in self._sizes[groupIdx] if size > 0))
+                    reclaimable = FormatSize(self._reclaimables[groupIdx])
+                self.trvw_result.item(
+                    item,
+                    text=f'{marker} {group[0].name} ({len(group)} files)',
+                    values=(size, reclaimable, kind, group[0].dir,),
+                    tags=())
+            else:
+                file = group[fileIdx]
+                size = '...' if self._sizes is None else \
+                    FormatSize(self._sizes[groupIdx][fileIdx])
+                self.trvw_result.item(
+                    item,
+                    text=f'      {file.name}',
+                    values=(size, '', '', file.dir,),
+                    tags=('file',))
+
+        # Updating the selection & the scroll bar...
+        if selectedItem is None:
+            self.trvw_result.selection_set(())
+        elif self.trvw_result.selection() != (selectedItem,):
+            self.trvw_result.selection_set(selectedItem)
+            self.trvw_result.focus(selectedItem)
+        if self._rows:
+            self.vscrlbr_result.set(
+                self._top / len(self._rows),
+                (self._top + len(self._items)) / len(self._rows))
+        else:
+            self.vscrlbr_result.set(0, 1)
+
+    def _OnItemSelected(self, event: tk.Event) -> None:
+        selection = self.trvw_result.selection()
+        if not selection or selection[0] not in self._items:
+            return
+        rowIdx = self._top + self._items.index(selection[0])
+        if rowIdx < len(self._rows):
+            self._selectedRow = rowIdx
+            self._ShowPath()
+
+    def _MoveSelection(self, nRows: int) -> str:
+        if self._rows:
+            if self._selectedRow is None:
+                rowIdx = self._top
+            else:
+                rowIdx = self._selectedRow + nRows
+            rowIdx = max(0, min(rowIdx, len(self._rows) - 1))
+            self._selectedRow = rowIdx
+            # Scrolling the selected row into view...
+            if rowIdx < self._top:
+                self._top = rowIdx
+            elif rowIdx >= self._top + len(self._items):
+                self._top = rowIdx - len(self._items) + 1
+            self._Render()
+            self._ShowPath()
+        return 'break'
+
+    def _OnDoubleClicked(self, event: tk.Event) -> str:
+        item = self.trvw_result.identify_row(event.y)
+        if item in self._items:
+            rowIdx = self._top + self._items.index(item)
+            if rowIdx < len(self._rows):
+                self._selectedRow = rowIdx
+                self._ToggleSelected()
+        return 'break'
+
+    def _ToggleSelected(self, event: tk.Event | None = None) -> str:
+        '''Expands or collapses the group of the selected row.'''
+        selected = self._GetSelectedPair()
+        if selected is not None:
+            groupIdx = selected[0]
+            if groupIdx in self._expanded:
+                self._expanded.remove(groupIdx)
+            else:
+                self._expanded.add(groupIdx)
+            self._BuildRows((groupIdx, -1,))
+        return 'break'
+
+    def _ShowPath(self) -> None:
+        selected = self._GetSelectedPair()
+        if selected is None:
+            self.lbl_path['text'] = ''
+            return
+        groupIdx, fileIdx = selected
+        file = self._groups[groupIdx][max(0, fileIdx)]
+        self.lbl_path['text'] = str(Path(file.dir, file.name))
+
+    def _GetKind(self, groupIdx: int) -> str:
+        if groupIdx < self._nDuplicates:
+            return 'Duplicate'
+        if groupIdx < self._nDuplicates + self._nTruncated:
+            return 'Truncated'
+        return 'Similar'
+
+    def _ShowSummary(self) -> None:
+        nSimilars = len(self._groups) - self._nDuplicates - self._nTruncated
+        text_ = (
+            f'{self._nDuplicates:,} duplicate, '
+            + f'{self._nTruncated:,} truncated & '
+            + f'{nSimilars:,} similar groups, '
+            + f'{self._nFiles:,} files')
+        if self._reclaimables is not None:
+            reclaimable = sum(self._reclaimables[
+                :self._nDuplicates + self._nTruncated])
+            text_ += f', {FormatSize(reclaimable)} reclaimable by duplicates'
+        self.lbl_summary['text'] = text_
@@ -7,24 +7,45 @@
 __doc__ = """This module exposes the ollowing types:
 
 NameDirPair(name=XXX, dir=XXX)
+DuplicateIndex
 """
 
+from array import array
+import atexit
 import base64
 from collections import namedtuple
 import hashlib
 import hmac
+from io import BytesIO
+import json
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import os
 import re
 from pathlib import Path
 import pickle
 import platform
-from threading import Lock
-from time import sleep
-from typing import Any, Sequence
+from queue import Queue
+from threading import Condition, Lock, Thread
+from time import monotonic
+from typing import Any, Iterable, Sequence
 
 from megacodist.exceptions import LoopBreakException
 from megacodist.singleton import SingletonMeta
 
+from file_table import FileRow, FileTable
+from fingerprint import FileStat, HashScheduler, VerifyLevel
+from metrics import Count
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    """Unpickles settings files of old versions, which hold only builtin
+    values, refusing to load any class or function.
+    """
+
+    def find_class(self, module: str, name: str) -> Any:
+        raise pickle.UnpicklingError(f"'{module}.{name}' is not allowed")
+
 
 class AppSettings(object, metaclass=SingletonMeta):
     """Encapsulates APIs for persistence settings between different sessions
@@ -41,169 +62,348 @@ class AppSettings(object, metaclass=SingletonMeta):
     whcih contains new values for settings.
 
     Finally, AppSettings().Save() to save settings to the file.
+
+    Settings are kept as JSON. Updates are written behind by a background
+    thread once they pause for DEBOUNCE seconds, or MAX_DELAY seconds
+    after the first one, so none of the methods but Save wait for the
+    disk. Files are replaced atomically, so a crash leaves either the old
+    or the new settings.
     """
 
+    # Seconds of no updates before writing them & the longest delay...
+    DEBOUNCE = 1.0
+    MAX_DELAY = 5.0
+
     def __init__(self) -> None:
         self.settings: dict[str, Any] = {}
-        self.lock = Lock()
-        self.file = None
-
-    def Load(self, file: str | Path) -> None:
-        """Loads settings from the specified file into the
-        singleton object.
+        self.file: Path | None = None
+        self._cond = Condition(Lock())
+        # Versions of settings, increased by every update, & of the
+        # file...
+        self._version = 0
+        self._savedVersion = 0
+        self._lastUpdate = 0.0
+        self._nFlushes = 0
+        self._writer: Thread | None = None
+
+    def Load(
+            self,
+            file: str | Path,
+            legacy_file: str | Path | None = None
+            ) -> None:
+        """Loads settings from the specified JSON file into the singleton
+        object and starts writing updates behind. If the file does not
+        exist, settings are migrated from 'legacy_file', the signed pickle
+        of old versions, if given.
         """
-        # Getting hold of settings singleton object...
-        count = 0
-        while not self.lock.acquire(True, 0.25):
-            sleep(0.25)
-            count += 1
-            if count > 16:
-                logging.error(
-                    'Could not getting hold of settings singleton object')
-                return
-
-        # Reading settings from the file...
-        self.file = file
+        file = Path(file)
         try:
-            settingsFileStream = open(
-                file,
-                mode='rb')
-            raw_settings = settingsFileStream.read()
-
-            # Checking the signature...
-            try:
-                signature_ = hmac.digest(
-                    key=b'a-secret-key',
-                    msg=raw_settings[44:],
-                    digest=hashlib.sha256)
-                signature_ = base64.b64encode(signature_)
-                isOk = hmac.compare_digest(
-                    raw_settings[:44],
-                    signature_)
-                if isOk:
-                    raw_settings = base64.b64decode(raw_settings[44:])
-                    self.settings = pickle.loads(raw_settings)
-            except Exception:
-                # An error occurred checking signature of the settings file
-                # Leaving settings dictionary empty...
-                pass
-        except Exception as err:
-            # An error occurred reading the settings file
+            settings = json.loads(file.read_text(encoding='utf-8'))
+            if not isinstance(settings, dict):
+                raise ValueError('settings are not an object')
+        except FileNotFoundError:
+            settings = {}
+            if legacy_file is not None:
+                settings = self._LoadLegacy(Path(legacy_file))
+        except (OSError, ValueError) as err:
             # Leaving settings dictionary empty...
+            settings = {}
             logging.error(f'Loading settings file failed\n{str(err)}')
-        finally:
-            settingsFileStream.close()
-            self.lock.release()
+
+        with self._cond:
+            self.file = file
+            self.settings = settings
+            if self._writer is None:
+                self._writer = Thread(
+                    target=self._WriteBehind,
+                    name='AppSettingsWriter',
+                    daemon=True)
+                self._writer.start()
+
+    def _LoadLegacy(self, file: Path) -> dict[str, Any]:
+        """Returns settings of the signed pickle of old versions, or an
+        empty dictionary if it does not exist or is not valid.
+        """
+        try:
+            raw_settings = file.read_bytes()
+        except FileNotFoundError:
+            return {}
+        except OSError as err:
+            logging.error(f'Loading settings file failed\n{str(err)}')
+            return {}
+
+        # Checking the signature...
+        signature_ = hmac.digest(
+            key=b'a-secret-key',
+            msg=raw_settings[44:],
+            digest=hashlib.sha256)
+        signature_ = base64.b64encode(signature_)
+        if not hmac.compare_digest(raw_settings[:44], signature_):
+            return {}
+        try:
+            settings = _LegacyUnpickler(
+                BytesIO(base64.b64decode(raw_settings[44:]))).load()
+        except Exception as err:
+            logging.error(f'Migrating settings file failed\n{str(err)}')
+            return {}
+        return settings if isinstance(settings, dict) else {}
 
     def Save(self) -> None:
-        """Saves settings to the file."""
-        # Getting hold of settings singleton object...
-        count = 0
-        while not self.lock.acquire(True, 0.25):
-            sleep(0.25)
-            count += 1
-            if count > 16:
-                logging.error(
-                    'Could not getting hold of settings singleton object')
+        """Writes pending updates to the file & waits until they are
+        written. Settings are written even without calling it, so it is
+        only needed before exiting.
+        """
+        with self._cond:
+            if self._writer is None:
                 return
-
-        try:
-            # Turning 'settings' to bytes (pickling)...
-            binSettings = pickle.dumps(self.settings)
-            binSettings = base64.b64encode(binSettings)
-
-            # Signing the settings...
-            # signature_ will be 64 bytes long...
-            signature_ = hmac.digest(
-                key=b'a-secret-key',
-                msg=binSettings,
-                digest=hashlib.sha256)
-            # signature_ will be 86 bytes long...
-            signature_ = base64.b64encode(signature_)
-
-            # Writing settings to the file...
-            with open(self.file, mode='wb') as settingsFileStream:
-                settingsFileStream.write(signature_)
-                settingsFileStream.write(binSettings)
-        finally:
-            self.lock.release()
+            version = self._version
+            self._nFlushes += 1
+            self._cond.notify_all()
+            try:
+                while self._savedVersion < version:
+                    self._cond.wait()
+            finally:
+                self._nFlushes -= 1
 
     def Read(self, defaults: dict[str, Any]) -> dict[str, Any]:
         """Checks settings against defaults. If exists return settings
         otherwise merge defaults into the settings (fallback).
         """
-        # Getting hold of settings singleton object...
-        count = 0
-        while not self.lock.acquire(True, 0.25):
-            sleep(0.25)
-            count += 1
-            if count > 16:
-                logging.error(
-                    'Could not getting hold of settings singleton object')
-                return defaults
-
-        for key, value in defaults.items():
-            if ((key not in self.settings) or
-                    (not isinstance(self.settings[key], type(value)))):
-                self.settings[key] = value
-
-        settings_ = self.settings.copy()
-        self.lock.release()
-        return settings_
+        with self._cond:
+            for key, value in defaults.items():
+                # JSON turns tuples into lists...
+                if isinstance(value, tuple) and \
+                        isinstance(self.settings.get(key), list):
+                    self.settings[key] = tuple(self.settings[key])
+                if ((key not in self.settings) or
+                        (not isinstance(self.settings[key], type(value)))):
+                    self.settings[key] = value
+            return self.settings.copy()
 
     def Update(self, new_values: dict[str, Any]) -> None:
-        """Updates singleton object with new values."""
-        # Getting hold of settings singleton object...
-        count = 0
-        while not self.lock.acquire(True, 0.25):
-            sleep(0.25)
-            count += 1
-            if count > 16:
-                logging.error(
-                    'Could not getting hold of settings singleton object')
-                return
-
-        try:
+        """Updates singleton object with new values. They are written to
+        the file in the background.
+        """
+        with self._cond:
             for key, value in new_values.items():
                 self.settings[key] = value
-        finally:
-            self.lock.release()
+            self._version += 1
+            self._lastUpdate = monotonic()
+            self._cond.notify_all()
+
+    def _WriteBehind(self) -> None:
+        """Writes updates to the file, coalescing those in quick
+        succession. It runs in the writer thread.
+        """
+        while True:
+            with self._cond:
+                # Waiting for updates...
+                while self._savedVersion == self._version:
+                    self._cond.wait()
+                # Waiting for updates to pause, unless flushing...
+                deadline = monotonic() + self.MAX_DELAY
+                while not self._nFlushes:
+                    timeout = min(
+                        self._lastUpdate + self.DEBOUNCE,
+                        deadline) - monotonic()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                version = self._version
+                file = self.file
+                try:
+                    data = json.dumps(self.settings, indent=4)
+                except (TypeError, ValueError) as err:
+                    data = None
+                    logging.error(
+                        f'Serializing settings failed\n{str(err)}')
+
+            if data is not None:
+                try:
+                    _WriteAtomically(file, data)
+                except OSError as err:
+                    logging.error(f'Saving settings failed\n{str(err)}')
+
+            with self._cond:
+                # Saving failures are not retried, so Save never hangs...
+                self._savedVersion = version
+                self._cond.notify_all()
+
+
+def _WriteAtomically(file: Path, data: str) -> None:
+    """Writes 'data' into a temporary file next to 'file', flushes it to
+    the disk & renames it over 'file'.
+    """
+    temp = file.with_name(f'.{file.name}.{os.getpid()}.tmp')
+    try:
+        with open(temp, mode='w', encoding='utf-8') as tempStream:
+            tempStream.write(data)
+            tempStream.flush()
+            os.fsync(tempStream.fileno())
+        os.replace(temp, file)
+    except OSError:
+        temp.unlink(missing_ok=True)
+        raise
 
 
 NameDirPair = namedtuple(
     'NameDirPair',
     'name, dir')
 
+# Files of groups, either tuples or views of rows of a FileTable...
+GroupFile = NameDirPair | FileRow
+
 
-def ConfigureLogging(filepath: str | Path) -> None:
+class _RepeatFilter(logging.Filter):
+    """Lets at most 'burst' records of the same call site through in every
+    'window' seconds and counts the rest, so errors repeated for every
+    file, like permission denied, cost little during large scans. The
+    next record let through, or Flush, reports how many were suppressed.
+    """
+
+    def __init__(self, burst: int, window: float) -> None:
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._lock = Lock()
+        # Call sites as (pathname, lineno) to [start of window, number of
+        # records, example of suppressed records]...
+        self._sites: dict[tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.pathname, record.lineno,)
+        now = monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.window:
+                nSuppressed = max(0, site[1] - self.burst) if site else 0
+                self._sites[key] = [now, 1, None]
+            else:
+                site[1] += 1
+                if site[1] > self.burst:
+                    site[2] = record
+                    Count('log.suppressed')
+                    return False
+                return True
+        if nSuppressed:
+            record.msg = (
+                f'{record.getMessage()}\n({nSuppressed:,} similar messages'
+                + ' were suppressed)')
+            record.args = None
+        return True
+
+    def Flush(self) -> list[logging.LogRecord]:
+        """Returns a record for every call site with suppressed records
+        not reported yet, reporting how many.
+        """
+        records = []
+        with self._lock:
+            for nRecords, record in (
+                    (site[1], site[2],) for site in self._sites.values()):
+                if record is None or nRecords <= self.burst:
+                    continue
+                record.msg = (
+                    f'{nRecords - self.burst:,} messages like the following'
+                    + f' were suppressed\n{record.getMessage()}')
+                record.args = None
+                records.append(record)
+            self._sites.clear()
+        return records
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """Puts records into a bounded queue. Once the queue is 'high_water'
+    full, debug records are dropped & counted instead. Other records wait
+    for room only if the queue is completely full.
+    """
+
+    def __init__(self, queue_: Queue, high_water: int) -> None:
+        super().__init__(queue_)
+        self.highWater = high_water
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if record.levelno <= logging.DEBUG and \
+                self.queue.qsize() >= self.highWater:
+            Count('log.dropped')
+            return
+        self.queue.put(record)
+
+
+def ConfigureLogging(
+        filepath: str | Path,
+        level: int = logging.INFO,
+        max_bytes: int = 4 * (1 << 20),
+        backup_count: int = 3,
+        queue_size: int = 10_000,
+        ) -> None:
+    """Logs records of 'level' & above to 'filepath' from a background
+    thread, so logging never waits for the disk. Every session starts a
+    new file and earlier ones are kept as 'filepath.1' up to
+    'filepath.<backup_count>'. A file is also rotated once it reaches
+    'max_bytes'. Records are queued up to 'queue_size', debug records
+    being dropped if the queue is 80% full, and repeated records of a call
+    site are rate-limited.
+    """
     # Getting root logger...
     logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
+    logger.setLevel(level)
+
+    # Starting a new file for this session...
+    fileHandler = RotatingFileHandler(
+        filepath,
+        maxBytes=max_bytes,
+        backupCount=backup_count,
+        encoding='utf-8',
+        delay=True)
+    if os.path.isfile(filepath) and os.path.getsize(filepath):
+        fileHandler.doRollover()
 
     # Logging platform information...
-    loggerFileStream = logging.FileHandler(filepath, 'w')
-    loggerFormatter = logging.Formatter('%(message)s')
-    loggerFileStream.setFormatter(loggerFormatter)
-    logger.addHandler(loggerFileStream)
-
+    fileHandler.setFormatter(logging.Formatter('%(message)s'))
     logNote = (
         f'Operating system: {platform.system()} {platform.release()}'
         + f'(version: {platform.version()}) {platform.architecture()}')
-    logging.info(logNote)
+    fileHandler.handle(logging.makeLogRecord({'msg': logNote}))
     temp = '.'.join(platform.python_version_tuple())
     logNote = f'Python interpreter: {platform.python_implementation()} {temp}'
-    logging.info(logNote + '\n\n')
+    fileHandler.handle(logging.makeLogRecord({'msg': logNote + '\n\n'}))
 
     # Logging program events...
-    logger.removeHandler(loggerFileStream)
-    loggerFileStream = logging.FileHandler(filepath, 'a')
     loggerFormatter = logging.Formatter(
         fmt=(
             '[%(asctime)s]  %(module)s  %(threadName)s'
             + '\n%(levelname)8s: %(message)s\n\n'),
         datefmt='%Y-%m-%d  %H:%M:%S')
-    loggerFileStream.setFormatter(loggerFormatter)
-    logger.addHandler(loggerFileStream)
+    fileHandler.setFormatter(loggerFormatter)
+    queue_ = Queue(queue_size)
+    queueHandler = _DroppingQueueHandler(queue_, int(queue_size * 0.8))
+    repeatFilter = _RepeatFilter(burst=10, window=60.0)
+    queueHandler.addFilter(repeatFilter)
+    listener = QueueListener(queue_, fileHandler, respect_handler_level=True)
+    logger.addHandler(queueHandler)
+    listener.start()
+
+    def StopLogging() -> None:
+        logger.removeHandler(queueHandler)
+        listener.stop()
+        for record in repeatFilter.Flush():
+            fileHandler.handle(record)
+        fileHandler.close()
+
+    atexit.register(StopLogging)
+
+
+def FormatSize(size: int) -> str:
+    '''Returns the size in a human-readable form like '1.5 MiB'.'''
+    if size < 0:
+        return '?'
+    if size < 1024:
+        return f'{size} B'
+    for unit in ('KiB', 'MiB', 'GiB', 'TiB'):
+        size /= 1024
+        if size < 1024:
+            break
+    return f'{size:.1f} {unit}'
 
 
 def GetCommonAffix(
@@ -250,58 +450,528 @@ def GetCommonAffix(
         return slice(startIndex, index)
 
 
-def ReportDuplicates(
-        filesList: list[NameDirPair]
-        ) -> tuple[list[list[NameDirPair], list[NameDirPair]]]:
+class DuplicateIndex(object):
+    '''Keeps files grouped by their canonical names, so duplicate &
+    similar groups can be read at any time without indexing all files
+    again. Files are added & removed one at a time, for example as they
+    appear or disappear in the file system. The original file (no postfix)
+    of a group, if any, is always kept at the beginning of the group. A
+    group is a duplicate group only if it has an original file, so series
+    like 'IMG_0001.jpg' & 'IMG_0002.jpg' are not taken for copies.
 
-    duplicates = []
-    allDuplicates = []
-    similars = []
-    allSimilars = []
+    Every file is kept as a NameDirPair, so the index costs far more memory
+    per file than a FileTable. The application window still groups through
+    it, while the command line groups a FileTable by GroupTable.
+    '''
 
-    i = 0
-    while i < len(filesList):
-        if duplicates:
-            duplicates = []
-        if similars:
+    def __init__(self) -> None:
+        self._groups: dict[tuple[str, str], list[NameDirPair]] = {}
+        # Groups with more than one file, in the order they reached two
+        # files...
+        self._duplicates: dict[tuple[str, str], list[NameDirPair]] = {}
+        # Maps canonical stems to keys of their groups. Stems are sorted to
+        # find similar names only when needed, as sorting on every add
+        # would make adding many files quadratic. None means stems have
+        # changed since...
+        self._stemKeys: dict[str, list[tuple[str, str]]] = {}
+        self._sortedStems: list[str] | None = []
+        self._nFiles = 0
+
+    def __len__(self) -> int:
+        return self._nFiles
+
+    def Add(self, file: NameDirPair) -> None:
+        '''Adds the file to the group of its canonical name.'''
+        stem, ext = SplitExt(file.name)
+        self._Add(file, (SplitDuplicatePostfix(stem)[0], ext,))
+
+    def AddMany(self, files: Iterable[NameDirPair]) -> None:
+        '''Adds all files, matching repeated stems only once.'''
+        files = list(files)
+        stemsExts = [SplitExt(file.name) for file in files]
+        bases = SplitDuplicatePostfixes(stem for stem, _ in stemsExts)
+        for file, (_, ext), (base, _) in zip(files, stemsExts, bases):
+            self._Add(file, (base, ext,))
+
+    def Remove(self, file: NameDirPair) -> None:
+        '''Removes the file from the index. It raises ValueError if the
+        file is not in the index.
+        '''
+        stem, ext = SplitExt(file.name)
+        key = (SplitDuplicatePostfix(stem)[0], ext,)
+        group = self._groups.get(key)
+        if group is None:
+            raise ValueError(f"'{file.name}' is not in the index")
+        group.remove(file)
+        self._nFiles -= 1
+        if len(group) == 1:
+            del self._duplicates[key]
+        elif not group:
+            del self._groups[key]
+            keys = self._stemKeys[key[0]]
+            keys.remove(key)
+            if not keys:
+                del self._stemKeys[key[0]]
+                self._sortedStems = None
+
+    def GetDuplicates(self) -> list[list[NameDirPair]]:
+        '''Returns a copy of the current groups of files with the same
+        canonical name, headed by an original file.
+        '''
+        return [
+            list(group)
+            for key, group in self._duplicates.items()
+            if _IsOriginal(group[0].name, key)]
+
+    def GetSimilars(self) -> list[list[NameDirPair]]:
+        '''Returns groups of files whose canonical stems start with the
+        canonical stem of another file, headed by that file.
+        '''
+        # In the sorted list of canonical stems, all such names
+        # immediately follow the stem...
+        allSimilars = []
+        if self._sortedStems is None:
+            self._sortedStems = sorted(self._stemKeys)
+        sortedStems = self._sortedStems
+        i = 0
+        while i < len(sortedStems):
+            stem = sortedStems[i]
+            j = i + 1
             similars = []
-        j = i + 1
-        firstFileNoExt = Path(filesList[i].name).stem
-        lenFirstFileNoExt = len(firstFileNoExt)
-        try:
-            while True:
-                nextFileNoExt = Path(filesList[j].name).stem
-                _, commonPrefixIndex, _ = GetCommonAffix(
-                    firstFileNoExt,
-                    nextFileNoExt
-                ).indices(lenFirstFileNoExt)
+            while j < len(sortedStems) and sortedStems[j].startswith(stem):
+                for key in self._stemKeys[sortedStems[j]]:
+                    similars.extend(self._groups[key])
+                j += 1
+            if similars:
+                similars.insert(0, self._groups[self._stemKeys[stem][0]][0])
+                allSimilars.append(similars)
+            i = j
+        return allSimilars
+
+    def _Add(self, file: NameDirPair, key: tuple[str, str]) -> None:
+        group = self._groups.get(key)
+        if group is None:
+            self._groups[key] = [file]
+            keys = self._stemKeys.get(key[0])
+            if keys is None:
+                self._stemKeys[key[0]] = [key]
+                self._sortedStems = None
+            else:
+                keys.append(key)
+        else:
+            if _IsOriginal(file.name, key):
+                # Keeping the original file (no postfix) at the beginning...
+                group.insert(0, file)
+            else:
+                group.append(file)
+            if len(group) == 2:
+                self._duplicates[key] = group
+        self._nFiles += 1
+
+
+def _IsOriginal(name: str, key: tuple[str, str]) -> bool:
+    '''Determines whether the file name is its canonical name 'key' itself,
+    without any duplicate postfix.
+    '''
+    return len(name) == len(key[0]) + len(key[1])
 
-                if commonPrefixIndex < lenFirstFileNoExt:
-                    break
 
-                isDupPosfix = IsDuplicatePostfix(
-                    nextFileNoExt[commonPrefixIndex:])
+def GroupTable(
+        table: FileTable
+        ) -> tuple[list[list[FileRow]], list[list[FileRow]]]:
+    '''Returns the pair of name-based 'allDuplicates' and 'allSimilars' of
+    the files of the table, the same groups in the same order as
+    DuplicateIndex gives. Canonical names are found once per distinct name
+    and views are made only for files in groups.
+    '''
+    # Finding canonical names of distinct names. Keys are numbered in the
+    # order of their first file...
+    stemsExts = [SplitExt(name) for name in table.names]
+    bases = SplitDuplicatePostfixes(stem for stem, _ in stemsExts)
+    keyIdxs: dict[tuple[str, str], int] = {}
+    nameKeys = array('l')
+    isOriginals = bytearray()
+    for name, (_, ext), (base, _) in zip(table.names, stemsExts, bases):
+        nameKeys.append(keyIdxs.setdefault((base, ext,), len(keyIdxs)))
+        isOriginals.append(len(name) == len(base) + len(ext))
+    del stemsExts, bases
+    rowKeys = array('l', [nameKeys[nameIdx] for nameIdx in table.nameIdxs])
+    counts = [0] * len(keyIdxs)
+    for keyIdx in rowKeys:
+        counts[keyIdx] += 1
+
+    # Finding similar stems the way DuplicateIndex.GetSimilars does...
+    stemKeys: dict[str, list[int]] = {}
+    for (stem, _), keyIdx in keyIdxs.items():
+        stemKeys.setdefault(stem, []).append(keyIdx)
+    del keyIdxs
+    sortedStems = sorted(stemKeys)
+    similarKeys: list[tuple[int, list[int]]] = []
+    i = 0
+    while i < len(sortedStems):
+        stem = sortedStems[i]
+        j = i + 1
+        followers = []
+        while j < len(sortedStems) and sortedStems[j].startswith(stem):
+            followers.extend(stemKeys[sortedStems[j]])
+            j += 1
+        if followers:
+            similarKeys.append((stemKeys[stem][0], followers,))
+        i = j
+    del stemKeys, sortedStems
+
+    # Collecting rows of keys in groups only...
+    isNeeded = bytearray(int(count > 1) for count in counts)
+    for head, followers in similarKeys:
+        isNeeded[head] = 1
+        for keyIdx in followers:
+            isNeeded[keyIdx] = 1
+    keyRows: dict[int, list[int]] = {}
+    for row, keyIdx in enumerate(rowKeys):
+        if isNeeded[keyIdx]:
+            keyRows.setdefault(keyIdx, []).append(row)
+
+    def GetGroup(keyIdx: int) -> list[FileRow]:
+        # Originals (no postfix) come first, the last added at the top...
+        rows = keyRows[keyIdx]
+        nameIdxs = table.nameIdxs
+        return [
+            FileRow(table, row)
+            for row in reversed(rows)
+            if isOriginals[nameIdxs[row]]] + [
+            FileRow(table, row)
+            for row in rows
+            if not isOriginals[nameIdxs[row]]]
+
+    # Duplicate groups need an original file & are ordered by their second
+    # file...
+    dupKeys = sorted(
+        (
+            keyIdx
+            for keyIdx, count in enumerate(counts)
+            if count > 1 and any(
+                isOriginals[table.nameIdxs[row]]
+                for row in keyRows[keyIdx])),
+        key=lambda keyIdx: keyRows[keyIdx][1])
+    allDuplicates = [GetGroup(keyIdx) for keyIdx in dupKeys]
+    allSimilars = []
+    for head, followers in similarKeys:
+        similars = [GetGroup(head)[0]]
+        for keyIdx in followers:
+            similars.extend(GetGroup(keyIdx))
+        allSimilars.append(similars)
+    return allDuplicates, allSimilars
 
-                if isDupPosfix:
-                    duplicates.append(filesList[j])
-                else:
-                    similars.append(filesList[j])
 
-                j += 1
-        except IndexError:
-            pass
+def ReportDuplicates(
+        table: FileTable,
+        level: VerifyLevel = VerifyLevel.FULL,
+        scheduler: HashScheduler | None = None
+        ) -> tuple[list[list[FileRow]], list[list[FileRow]]]:
+    '''Returns a pair of 'allDuplicates' and 'allSimilars' out of the
+    files of 'table'. Name-based duplicate candidates are verified according to
+    'level' as VerifyReport does.
+    '''
+    allDuplicates, allSimilars = GroupTable(table)
+    return VerifyReport(allDuplicates, allSimilars, level, scheduler)
+
+
+def VerifyReport(
+        allDuplicates: list[list[GroupFile]],
+        allSimilars: list[list[GroupFile]],
+        level: VerifyLevel = VerifyLevel.FULL,
+        scheduler: HashScheduler | None = None,
+        stats: dict[str, FileStat] | None = None
+        ) -> tuple[list[list[GroupFile]], list[list[GroupFile]]]:
+    '''Verifies name-based duplicate groups according to 'level' and
+    returns the pair of 'allDuplicates' and 'allSimilars': only groups
+    whose content is proven identical remain in 'allDuplicates', and
+    name-only matches are moved to 'allSimilars'. Verification runs on
+    'scheduler' if provided, otherwise on a temporary one. If 'stats' is
+    provided, the FileStat every file had when it was verified is put in
+    it by path.
+    '''
+    if level is not VerifyLevel.NAME:
+        isOwnScheduler = scheduler is None
+        if isOwnScheduler:
+            scheduler = HashScheduler()
+        try:
+            allDuplicates, unverified = _VerifyDuplicates(
+                allDuplicates,
+                level,
+                scheduler,
+                stats)
         finally:
-            if duplicates:
-                duplicates.insert(0, filesList[i])
-                allDuplicates.append(duplicates)
-            if similars:
-                similars.insert(0, filesList[i])
-                allSimilars.append(similars)
-        i = j
+            if isOwnScheduler:
+                scheduler.Close()
+        allSimilars = allSimilars + unverified
 
     return allDuplicates, allSimilars
 
 
+def _VerifyDuplicates(
+        allDuplicates: list[list[GroupFile]],
+        level: VerifyLevel,
+        scheduler: HashScheduler,
+        stats: dict[str, FileStat] | None = None
+        ) -> tuple[list[list[GroupFile]], list[list[GroupFile]]]:
+    '''Splits name-based duplicate groups into groups with identical
+    content and groups of name-only matches. Stats of files are put in
+    'stats' if provided.
+    '''
+    verified = []
+    unverified = []
+    groupsPaths = [
+        [os.path.join(file.dir, file.name) for file in group]
+        for group in allDuplicates]
+    filesStats = iter(_StatFiles(
+        [file for group in allDuplicates for file in group],
+        scheduler,
+        stats))
+    groupsStats = [
+        [next(filesStats) for _ in group]
+        for group in allDuplicates]
+    results = sorted(scheduler.VerifyGroups(
+        groupsPaths,
+        level,
+        groupsStats))
+    for groupIdx, identicals in results:
+        group = allDuplicates[groupIdx]
+        verified.extend(
+            [group[idx] for idx in indices]
+            for indices in identicals)
+
+        # Collecting name-only matches along with the first file of the
+        # group, which they are similar to...
+        proven = {idx for indices in identicals for idx in indices}
+        leftovers = [
+            group[idx]
+            for idx in range(len(group))
+            if idx not in proven]
+        if leftovers:
+            if len(leftovers) == 1 or 0 in proven:
+                if leftovers[0] is not group[0]:
+                    leftovers.insert(0, group[0])
+            if len(leftovers) > 1:
+                unverified.append(leftovers)
+
+    return verified, unverified
+
+
+def _StatFiles(
+        files: Sequence[GroupFile],
+        scheduler: HashScheduler,
+        stats: dict[str, FileStat] | None = None
+        ) -> list[FileStat | None]:
+    '''Returns the FileStat of every file in the same order, None for files
+    which cannot be stat'd. Files are stat'd in parallel on the pool of
+    'scheduler'; rows of a FileTable are stat'd only once and keep their
+    stats in the table. Stats of other files are also put in 'stats' by
+    path if provided, unless it has them already.
+    '''
+    tablesRows: dict[FileTable, list[int]] = {}
+    paths = []
+    pathsIdxs = []
+    for idx, file in enumerate(files):
+        if isinstance(file, FileRow):
+            tablesRows.setdefault(file.table, []).append(file.idx)
+        else:
+            paths.append(os.path.join(file.dir, file.name))
+            pathsIdxs.append(idx)
+    for table, rows in tablesRows.items():
+        table.Stat(rows, scheduler)
+    filesStats = [
+        file.stat if isinstance(file, FileRow) else None
+        for file in files]
+    for pathIdx, stat_ in scheduler.StatFiles(paths):
+        filesStats[pathsIdxs[pathIdx]] = stat_
+        if stats is not None and stat_ is not None:
+            # Keeping the attributes of the first check...
+            stats.setdefault(paths[pathIdx], stat_)
+    return filesStats
+
+
+def FindTruncated(
+        allSimilars: list[list[GroupFile]],
+        level: VerifyLevel = VerifyLevel.FULL,
+        scheduler: HashScheduler | None = None,
+        stats: dict[str, FileStat] | None = None
+        ) -> tuple[list[list[GroupFile]], list[list[GroupFile]]]:
+    '''Finds truncated duplicates, like partial downloads, among similar
+    groups and returns the pair of the remaining 'allSimilars' and
+    'allTruncated'. Only files of the same canonical name are compared: a
+    non-empty file is truncated if its content is a prefix of a larger
+    file of the same canonical name. A group of 'allTruncated' is the
+    complete file followed by its truncated copies. Nothing is found
+    unless 'level' is VerifyLevel.FULL, as truncated copies are read in
+    full. If 'stats' is provided, the FileStat every file had when it was
+    compared is put in it by path.
+    '''
+    if level is not VerifyLevel.FULL or not allSimilars:
+        return allSimilars, []
+    isOwnScheduler = scheduler is None
+    if isOwnScheduler:
+        scheduler = HashScheduler()
+    try:
+        # Finding the candidates of every file: the larger files of the
+        # same canonical name in its group, the largest first. Every entry
+        # is (group index, file index, files sorted by size, the number of
+        # them larger than the file)...
+        candidates: list[tuple[int, int, list[int], int]] = []
+        allSizes = []
+        filesStats = iter(_StatFiles(
+            [file for group in allSimilars for file in group],
+            scheduler,
+            stats))
+        for groupIdx, group in enumerate(allSimilars):
+            sizes = [
+                -1 if stat_ is None else stat_.size
+                for stat_ in (next(filesStats) for _ in group)]
+            allSizes.append(sizes)
+            keysIndices: dict[tuple[str, str], list[int]] = {}
+            for fileIdx, file in enumerate(group):
+                keysIndices.setdefault(
+                    GetCanonicalName(file.name),
+                    []).append(fileIdx)
+            for indices in keysIndices.values():
+                if len(indices) < 2:
+                    continue
+                indices.sort(key=sizes.__getitem__, reverse=True)
+                nLarger = 0
+                for pos, fileIdx in enumerate(indices):
+                    if pos and sizes[fileIdx] < sizes[indices[pos - 1]]:
+                        nLarger = pos
+                    if nLarger and sizes[fileIdx] > 0:
+                        candidates.append(
+                            (groupIdx, fileIdx, indices, nLarger,))
+
+        # Checking every file against its largest candidate and, only if it
+        # is not a prefix of that one, against the next one, and so on. A
+        # file which is a prefix of a larger file is a prefix of the files
+        # that one is a prefix of, so the first match is the largest...
+        prefixOf: dict[int, dict[int, int]] = {}
+        nthCandidate = 0
+        while candidates:
+            pairs = []
+            for groupIdx, fileIdx, indices, _ in candidates:
+                group = allSimilars[groupIdx]
+                ofIdx = indices[nthCandidate]
+                pairs.append((
+                    os.path.join(group[fileIdx].dir, group[fileIdx].name),
+                    os.path.join(group[ofIdx].dir, group[ofIdx].name),
+                    allSizes[groupIdx][fileIdx],))
+            isMatched = [False] * len(candidates)
+            for pairIdx, isPrefix in scheduler.CheckPrefixes(pairs):
+                if isPrefix:
+                    isMatched[pairIdx] = True
+                    groupIdx, fileIdx, indices, _ = candidates[pairIdx]
+                    prefixOf.setdefault(groupIdx, {})[fileIdx] = \
+                        indices[nthCandidate]
+            nthCandidate += 1
+            candidates = [
+                candidate
+                for candidate, isMatched_ in zip(candidates, isMatched)
+                if not isMatched_ and nthCandidate < candidate[3]]
+    finally:
+        if isOwnScheduler:
+            scheduler.Close()
+
+    # Splitting truncated copies out of similar groups...
+    remaining = []
+    allTruncated = []
+    for groupIdx, group in enumerate(allSimilars):
+        if groupIdx not in prefixOf:
+            remaining.append(group)
+            continue
+        truncateds = prefixOf[groupIdx]
+
+        def GetComplete(fileIdx: int) -> int:
+            # Following the files the file is a prefix of up to a file
+            # which is not truncated itself...
+            while fileIdx in truncateds:
+                fileIdx = truncateds[fileIdx]
+            return fileIdx
+
+        completes: dict[int, list[int]] = {}
+        for fileIdx in sorted(truncateds):
+            completes.setdefault(GetComplete(fileIdx), []).append(fileIdx)
+        for completeIdx, indices in completes.items():
+            allTruncated.append(
+                [group[completeIdx]] + [group[idx] for idx in indices])
+        rest = [
+            file
+            for idx, file in enumerate(group)
+            if idx not in truncateds]
+        if len(rest) > 1:
+            remaining.append(rest)
+    return remaining, allTruncated
+
+
+def SplitExt(name: str) -> tuple[str, str]:
+    '''Splits the file name into a pair of stem & extension the same way
+    as pathlib does, without constructing a Path object.
+    '''
+    dotIdx = name.rfind('.')
+    if 0 < dotIdx < len(name) - 1:
+        return name[:dotIdx], name[dotIdx:]
+    return name, ''
+
+
+def GetCanonicalName(name: str) -> tuple[str, str]:
+    '''Returns the canonical name of the file as a pair of the stem
+    without any duplicate postfix and the extension. For example
+    'setup (1).exe' and 'setup_copy.exe' both become ('setup', '.exe').
+    '''
+    stem, ext = SplitExt(name)
+    return SplitDuplicatePostfix(stem)[0], ext
+
+
+# Matches a stem, capturing the base name & the duplicate postfix, if any,
+# in one pass. As the postfix must be at the end of the stem, the pattern
+# is applied to the reversed stem, so it is anchored at the start & never
+# scans the base name. Captured groups are reversed as well...
+_DUP_POSTFIX_REGEX = re.compile(
+    r'''
+    (?:
+        \)(?P<parIdx>\d+)\((?:\s*[-_]+)?\s*    # (23), _(23), - (23)
+        | (?P<sepIdx>\d+)\s*[-_]+\s*           # _23, - 23
+        | (?P<copies>(?:ypoc[-_\s]+)+)         # _copy, - copy - copy
+    )
+    (?P<base>.*)''',
+    re.VERBOSE | re.DOTALL)
+
+
+def SplitDuplicatePostfix(stem: str) -> tuple[str, int]:
+    '''Splits the stem of a file name into a pair of the base name and the
+    copy index. For numbered postfixes like ' (23)' the index is the number,
+    for ' copy' postfixes it is the count of 'copy' words. If the stem has no
+    duplicate postfix, it returns the stem itself and zero.
+    '''
+    match = _DUP_POSTFIX_REGEX.match(stem[::-1])
+    if match is None or not match['base']:
+        return stem, 0
+    base = match['base'][::-1]
+    if match['copies'] is not None:
+        return base, match['copies'].count('ypoc')
+    return base, int((match['parIdx'] or match['sepIdx'])[::-1])
+
+
+def SplitDuplicatePostfixes(stems: Iterable[str]) -> list[tuple[str, int]]:
+    '''Batch form of SplitDuplicatePostfix. It returns the pairs of base
+    names & copy indices in the same order as 'stems'. Repeated stems are
+    matched only once.
+    '''
+    memo: dict[str, tuple[str, int]] = {}
+    result = []
+    for stem in stems:
+        pair = memo.get(stem)
+        if pair is None:
+            pair = SplitDuplicatePostfix(stem)
+            memo[stem] = pair
+        result.append(pair)
+    return result
+
+
 def IsDuplicatePostfix(text: str) -> bool:
     '''Determines if 'text' is a duplicate postfix like ' - (23)', '_23', and
     so on. The following categories will be identified:
@@ -326,22 +996,5 @@ def IsDuplicatePostfix(text: str) -> bool:
     ⬤ XXXX copy copy
     and so on.'''
 
-    match = re.search(
-        r'^\s*[-_]+\s*\(\?\d+\)?$',
-        text)
-    if match:
-        return True
-
-    match = re.search(
-        r'^\s*\(\d+\)$',
-        text)
-    if match:
-        return True
-
-    match = re.search(
-        r'(?:[-_ ]*copy)+',
-        text)
-    if match:
-        return True
-
-    return False
+    match = _DUP_POSTFIX_REGEX.match(text[::-1])
+    return match is not None and not match['base']